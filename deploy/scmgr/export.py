@@ -0,0 +1,149 @@
+"""
+Resumable export of SCMgr data to cStock.
+
+The server keeps a checkpoint per site: the sequence number of the last
+chunk it committed and the newest (month, facility code) it has seen.
+An export asks for the checkpoint and sends everything from a few months
+before the high water mark on as numbered, compressed chunks of JSON. If
+an export is cut off it just runs again from the last committed chunk.
+
+A facility can be approved in SCMgr after facilities that sort later
+have already been sent, so rather than only what sorts after the high
+water mark, the last RESEND_MONTHS months are always sent again and the
+server skips the reports it already has. Rows are sent oldest first, and
+a chunk never splits a facility's month between two chunks. The query
+is run through any DB-API cursor that takes qmark parameters (pyodbc for the Access database, sqlite3 for testing) and
+has to return SCMgr's columns ordered by P_Date and Fac_Code, with one
+? for the earliest P_Date to return.
+"""
+import bz2
+import gzip
+import httplib
+import json
+from cStringIO import StringIO
+from datetime import date
+
+# where an export starts when the server has nothing for the site yet
+START_DATE = date(2011, 1, 1)
+
+# how many months, counting the high water month, are sent every time
+RESEND_MONTHS = 3
+
+DATE_COLUMN = 4
+FACILITY_COLUMN = 3
+
+class ExportError(Exception):
+    pass
+
+def _gzip(data):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode="wb")
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+COMPRESSORS = {"bz2": bz2.compress,
+               "gzip": _gzip,
+               "": lambda data: data}
+
+def row_key(row):
+    return (row[DATE_COLUMN].year, row[DATE_COLUMN].month, row[FACILITY_COLUMN])
+
+def serialize(row):
+    row = list(row)
+    row[DATE_COLUMN] = [row[DATE_COLUMN].year, row[DATE_COLUMN].month]
+    return row
+
+def resend_from(high_water, months=RESEND_MONTHS):
+    """
+    The first day of the earliest month to send, going back months
+    months from the high water (year, month[, facility]), counting its
+    own month.
+    """
+    year, month = high_water[0], high_water[1] - (months - 1)
+    while month < 1:
+        year, month = year - 1, month + 12
+    return date(year, month, 1)
+
+def new_rows(cursor, query, checkpoint, start=START_DATE, resend_months=RESEND_MONTHS):
+    """
+    The rows to send, oldest first: everything from resend_months
+    months before the high water mark on.
+    """
+    high_water = checkpoint.get("high_water")
+    since = max(start, resend_from(high_water, resend_months)) if high_water else start
+    cursor.execute(query, (since,))
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+def chunks(rows, size):
+    """
+    Lists of at least size rows (bar the last), cut only where the month
+    or facility changes.
+    """
+    chunk = []
+    for row in rows:
+        if len(chunk) >= size and row_key(row) != row_key(chunk[-1]):
+            yield chunk
+            chunk = []
+        chunk.append(row)
+    if chunk:
+        yield chunk
+
+class HTTPTransport(object):
+    """
+    Talks to the cStock export url for a site, over one connection.
+    """
+
+    def __init__(self, host, url, site, encoding="bz2"):
+        self.url = "%s%s/" % (url, site)
+        self.encoding = encoding
+        self.connection = httplib.HTTPConnection(host)
+
+    def _request(self, method, url, body=None, headers=None):
+        self.connection.request(method, url, body, headers or {})
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def checkpoint(self):
+        status, body = self._request("GET", self.url)
+        if status != 200:
+            raise ExportError("Couldn't get the checkpoint: %s %s" % (status, body))
+        return json.loads(body)
+
+    def send(self, sequence, data):
+        headers = {"Content-Type": "application/json",
+                   "Accept": "application/json"}
+        if self.encoding:
+            headers["Content-Encoding"] = self.encoding
+        status, body = self._request("POST", "%s?seq=%s" % (self.url, sequence),
+                                     COMPRESSORS[self.encoding](data), headers)
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, {"error": body}
+
+def export(cursor, query, transport, chunk_size, log=None, start=START_DATE,
+           resend_months=RESEND_MONTHS):
+    """
+    Send everything the server may not have yet. Returns the number of
+    chunks sent.
+    """
+    log = log or (lambda msg: None)
+    checkpoint = transport.checkpoint()
+    log("Resuming after chunk %(sequence)s (up to %(high_water)s)" % checkpoint)
+    sequence = checkpoint["sequence"]
+    sent = 0
+    for chunk in chunks(new_rows(cursor, query, checkpoint, start, resend_months),
+                        chunk_size):
+        sequence += 1
+        status, ack = transport.send(sequence, json.dumps([serialize(r) for r in chunk]))
+        if status != 200 or ack.get("sequence") != sequence:
+            raise ExportError("Chunk %s wasn't committed: %s %s" % (sequence, status, ack))
+        log("Chunk %s: %s rows, %s" % (sequence, len(chunk), ack.get("stats")))
+        sent += 1
+    return sent
@@ -1,6 +1,7 @@
 import pyodbc
 import sqlite3
 import config
+import export
 import logging
 import logging.handlers
 from datetime import datetime, date, timedelta
@@ -41,28 +42,10 @@ if __name__=='__main__':
     cnxn = dbconn()
     c = cnxn.cursor()
     print "Connecting to cStock..."
-    h = httplib.HTTPConnection(config.SUBMIT_HOST)
-    print "Executing query..."
-    c.execute(config.QUERY)
-    print "Transmitting data:"
-    while True:
-        res = c.fetchmany(config.CHUNK_SIZE)
-        if not res:
-            break
-        data = []
-        for r in res:
-            r[4] = [r[4].year, r[4].month]
-            data.append(list(r))
-        val = {"data": json.dumps(data)}
-        params = urllib.urlencode(val)
-        headers = {"Content-type": "application/x-www-form-urlencoded",
-                   "Accept": "text/plain"}
-        h.request('POST', config.SUBMIT_URL, params, headers)
-        response = h.getresponse()
-        if response.status == 201:
-            print response.read()
-            continue
-        else:
-            print response.reason, response.read()
-            break
+    transport = export.HTTPTransport(config.SUBMIT_HOST, config.SUBMIT_URL,
+                                     config.SITE, config.ENCODING)
+    print "Transmitting new data:"
+    def show(msg):
+        print msg
+    export.export(c, config.QUERY, transport, config.CHUNK_SIZE, show)
     print "All data transmitted."
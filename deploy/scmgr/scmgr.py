@@ -7,11 +7,11 @@ import json
 import urllib2, urllib
 import os
 import os.path
-import httplib
 import smtplib
 import time
 from email.mime.text import MIMEText
 from socket import gaierror
+import export
 
 # Why is this all hardcoded, you might ask?  I want the email_log function to succeed
 # if there's any error in the config, and that means hardcoding these parameters.
@@ -90,38 +90,11 @@ if __name__=='__main__':
         cnxn = pyodbc.connect('DRIVER={Microsoft Access Driver (*.mdb)};DBQ=%s' % dbp)        
         c = cnxn.cursor()
         log.info("Connecting to cStock...")
-        h = httplib.HTTPConnection(config['SUBMIT_HOST'])
-        h.connect()
-        h.close()# We close this connection again, otherwise it will time out.        
-        log.info("Fetching data from SCMgr (this may take a few minutes)...")
-        c.execute(config['QUERY'])
-        log.info("Sending data to cStock...")
-        h = httplib.HTTPConnection(config['SUBMIT_HOST'])
-        while True:
-            res = c.fetchmany(config['CHUNK_SIZE'])
-            if not res:
-                break
-            data = []
-            for r in res:
-                r[4] = [r[4].year, r[4].month]
-                data.append(list(r))
-            val = {"data": json.dumps(data)}
-            params = urllib.urlencode(val)
-            headers = {"Content-type": "application/x-www-form-urlencoded",
-                       "Accept": "text/plain"}
-            h.request('POST', config['SUBMIT_URL'], params, headers)
-            response = h.getresponse()
-            if response.status == 201:
-                log.info(response.read())
-                continue
-            elif response.status == 200:
-                log.info(response.read())
-                break
-            else:
-                log.error(response.status)
-                log.error(response.reason)
-                log.error(response.msg)
-                break
+        transport = export.HTTPTransport(config['SUBMIT_HOST'], config['SUBMIT_URL'],
+                                         config['SITE'], config.get('ENCODING', 'bz2'))
+        log.info("Sending new data to cStock (this may take a few minutes)...")
+        sent = export.export(c, config['QUERY'], transport, config['CHUNK_SIZE'], log.info)
+        log.info("Sent %s chunks." % sent)
         log.info("Sending log information...")
         email_log("SCMgr Update Success")
         log.info("Congratulations, cStock has been fully updated. You may close this window now.")
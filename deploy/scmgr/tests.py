@@ -0,0 +1,113 @@
+"""
+Tests for the export, with sqlite standing in for the Access database
+and a fake server. Run with: python tests.py
+"""
+import json
+import sqlite3
+import unittest
+from datetime import date
+import export
+
+QUERY = """
+SELECT Closing_Bal, Avg_mnthly_cons, fStockedOut, Fac_Code, P_Date, Prod_Name, strProductID
+FROM CTF_Item WHERE P_Date >= ? ORDER BY P_Date, Fac_Code
+"""
+
+class FakeServer(object):
+    """
+    Keeps a checkpoint and skips the rows it already has the way the
+    cStock export view does, and can be told to drop the connection
+    after some number of chunks.
+    """
+
+    def __init__(self, fail_after=None):
+        self.sequence = 0
+        self.high_water = None
+        self.rows = []
+        self.loaded = set()
+        self.fail_after = fail_after
+
+    def checkpoint(self):
+        return {"sequence": self.sequence, "high_water": self.high_water}
+
+    def send(self, sequence, data):
+        if self.fail_after is not None and sequence > self.fail_after:
+            raise IOError("connection dropped")
+        if sequence != self.sequence + 1:
+            return 409, self.checkpoint()
+        rows = json.loads(data)
+        new = [r for r in rows if (r[3], tuple(r[4]), r[6]) not in self.loaded]
+        self.loaded.update((r[3], tuple(r[4]), r[6]) for r in new)
+        self.rows.extend(new)
+        self.sequence = sequence
+        self.high_water = list(max([(r[4][0], r[4][1], r[3]) for r in rows] +
+                                   ([tuple(self.high_water)] if self.high_water else [])))
+        ret = self.checkpoint()
+        ret["stats"] = "%s rows, %s new" % (len(rows), len(new))
+        return 200, ret
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+        self.db.execute("CREATE TABLE CTF_Item (Closing_Bal INTEGER, Avg_mnthly_cons INTEGER, "
+                        "fStockedOut INTEGER, Fac_Code TEXT, P_Date DATE, "
+                        "Prod_Name TEXT, strProductID TEXT)")
+        for month in (1, 2, 3):
+            self._add_month(month)
+
+    def _add_month(self, month, facilities=("MHG002", "MHG013")):
+        for facility in facilities:
+            for product in ("A0451", "A0452"):
+                self.db.execute("INSERT INTO CTF_Item VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (10, 5, 0, facility, date(2011, month, 1), "", product))
+
+    def testChunksKeepFacilityMonthsTogether(self):
+        rows = list(export.new_rows(self.db.cursor(), QUERY, {"sequence": 0}))
+        chunks = list(export.chunks(rows, 3))
+        self.assertEqual([4, 4, 4], [len(c) for c in chunks])
+
+    def testRecentMonthsResent(self):
+        server = FakeServer()
+        self.assertEqual(3, export.export(self.db.cursor(), QUERY, server, 4))
+        self.assertEqual([2011, 3, "MHG013"], server.high_water)
+        self.assertEqual(1, export.export(self.db.cursor(), QUERY, server, 4,
+                                          resend_months=1))
+        self.assertEqual(12, len(server.rows))
+        self._add_month(4)
+        self.assertEqual(3, export.export(self.db.cursor(), QUERY, server, 4,
+                                          resend_months=2))
+        self.assertEqual(16, len(server.rows))
+        self.assertEqual([2011, 4, "MHG013"], server.high_water)
+
+    def testLateFacilitySent(self):
+        server = FakeServer()
+        export.export(self.db.cursor(), QUERY, server, 4)
+        # approved after MHG013's reports for the month were sent
+        self._add_month(3, ("MHG001",))
+        self._add_month(2, ("MHG001",))
+        export.export(self.db.cursor(), QUERY, server, 4)
+        self.assertEqual(16, len(server.rows))
+        self.assertEqual([2011, 3, "MHG013"], server.high_water)
+
+    def testResendFrom(self):
+        self.assertEqual(date(2011, 3, 1), export.resend_from([2011, 3, "MHG013"], 1))
+        self.assertEqual(date(2010, 11, 1), export.resend_from([2011, 1, "MHG013"], 3))
+
+    def testResume(self):
+        server = FakeServer(fail_after=1)
+        self.assertRaises(IOError, export.export, self.db.cursor(), QUERY, server, 4)
+        self.assertEqual(4, len(server.rows))
+        server.fail_after = None
+        # the first month again, which the server skips, then the rest
+        self.assertEqual(3, export.export(self.db.cursor(), QUERY, server, 4))
+        self.assertEqual(12, len(server.rows))
+        self.assertEqual(4, server.sequence)
+
+    def testCompression(self):
+        data = json.dumps([[10, 5, 0, "MHG002", [2011, 1], "", "A0451"]] * 100)
+        for encoding, compress in export.COMPRESSORS.items():
+            self.assertTrue(len(compress(data)) <= len(data))
+
+if __name__ == "__main__":
+    unittest.main()
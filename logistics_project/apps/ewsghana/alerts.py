@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 from django.core.urlresolvers import reverse
+from django.db.models import Q
 from rapidsms.models import Contact
 from alerts import Alert
 from logistics.util import config
@@ -24,8 +25,9 @@ def consumption_not_set(request):
     facilities = request.location.all_child_facilities()
     if not facilities:
         return None
-    return [ConsumptionNotSet(facility) for facility in facilities \
-                              if not facility.are_consumptions_set()]
+    return [ConsumptionNotSet(facility) for facility in \
+            facilities.filter(Q(alert_flags__isnull=True) | 
+                              Q(alert_flags__consumptions_set=False))]
 
 class FacilitiesWithoutInChargeAlert(Alert):
     # url is facility list view
@@ -50,8 +52,9 @@ def facilities_without_incharge(request):
                                          .exclude(type=config.SupplyPointCodes.CLINIC)
     if not facilities:
         return None
-    return [FacilitiesWithoutInChargeAlert(facility) for facility in facilities \
-            if facility.reportees().count() == 0]
+    return [FacilitiesWithoutInChargeAlert(facility) for facility in \
+            facilities.filter(Q(alert_flags__isnull=True) | 
+                              Q(alert_flags__has_incharge=False))]
     
 class ContactWithoutPhoneAlert(Alert):
     # url is contact view
@@ -70,10 +73,14 @@ class ContactWithoutPhoneAlert(Alert):
 @return_if_place_not_set()
 def contact_without_phone(request):
     facilities = request.location.all_child_facilities()
-    contacts = Contact.objects.filter(supply_point__in=facilities).distinct()
+    # only the facilities flagged as having contacts without phones, or
+    # not flagged yet
+    facilities = facilities.filter(Q(alert_flags__isnull=True) | 
+                                   Q(alert_flags__contacts_without_phone__gt=0))
+    contacts = Contact.objects.filter(supply_point__in=facilities, 
+                                      connection__isnull=True).distinct()
     if not contacts:
         return None
-    return [ContactWithoutPhoneAlert(contact) for contact in contacts \
-            if contact.connection_set.count() == 0]
+    return [ContactWithoutPhoneAlert(contact) for contact in contacts]
 
     
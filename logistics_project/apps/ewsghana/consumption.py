@@ -0,0 +1,92 @@
+"""
+Auto monthly consumption for many stocks at once.
+
+Each stock's consumption is worked out by ProductStock.update_auto_consumption
+itself, so there is only one definition of it, but the stocks are loaded
+a batch of supply points at a time, only the ones with new transactions
+are redone with --since, the batches can be spread over several
+processes, and the results are written back with a handful of updates
+per batch instead of a save per stock.
+"""
+from django.db import transaction
+from logistics.models import ProductStock, StockTransaction, SupplyPoint
+from logistics_project.apps.ewsghana.models import update_alert_flags
+from logistics_project.utils.parallel import parallel_map
+
+SUPPLY_POINTS_PER_CHUNK = 200
+UPDATE_BATCH_SIZE = 500
+
+def _batches(items, size=UPDATE_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+@transaction.commit_on_success
+def save_consumptions(consumptions, stocks):
+    """
+    Write {(supply point id, product id): monthly consumption or None}
+    to the ProductStocks in stocks, {(supply point id, product id): pk},
+    with one update per distinct value (and batch of pks). Returns the
+    ids of the supply points written to.
+    """
+    by_value = {}
+    for key, value in consumptions.items():
+        if key in stocks:
+            by_value.setdefault(value, []).append(stocks[key])
+    for value, pks in by_value.items():
+        for batch in _batches(pks):
+            ProductStock.objects.filter(pk__in=batch).update(auto_monthly_consumption=value)
+    return set(sp for sp, product in consumptions if (sp, product) in stocks)
+
+def monthly_consumptions(stocks):
+    """
+    {(supply point id, product id): auto monthly consumption or None} for
+    these ProductStocks, from ProductStock.update_auto_consumption. The
+    stocks aren't saved.
+    """
+    ret = {}
+    for stock in stocks:
+        stock.update_auto_consumption()
+        ret[(stock.supply_point_id, stock.product_id)] = stock.auto_monthly_consumption
+    return ret
+
+def _update_chunk(args):
+    supply_point_ids, only = args
+    stocks = [stock for stock in ProductStock.objects.filter(supply_point__in=supply_point_ids)\
+                                                     .select_related('supply_point', 'product')
+              if only is None or (stock.supply_point_id, stock.product_id) in only]
+    return save_consumptions(monthly_consumptions(stocks),
+                             dict(((s.supply_point_id, s.product_id), s.pk) for s in stocks))
+
+def update_all(since=None, processes=0, chunk_size=SUPPLY_POINTS_PER_CHUNK):
+    """
+    Recompute auto monthly consumption for every stock, or with since
+    only for the stocks with transactions since then. The supply points
+    are done in chunks, with processes > 1 by that many processes at
+    once where that is allowed (see logistics_project.utils.parallel).
+    Returns the ids of the supply points whose stocks were updated.
+    """
+    if since is not None:
+        changed = set(StockTransaction.objects.filter(date__gte=since)\
+                        .values_list('supply_point', 'product').distinct())
+        supply_point_ids = sorted(set(sp for sp, product in changed))
+    else:
+        changed = None
+        supply_point_ids = list(ProductStock.objects.order_by('supply_point')\
+                                    .values_list('supply_point', flat=True).distinct())
+    args = []
+    for ids in _batches(supply_point_ids, chunk_size):
+        only = None
+        if changed is not None:
+            ids_set = set(ids)
+            only = set(key for key in changed if key[0] in ids_set)
+        args.append((ids, only))
+    return set().union(*parallel_map(_update_chunk, args, processes))
+
+def refresh_alert_flags(supply_point_ids):
+    """
+    Recompute the consumption alert flag of these facilities. Saving a
+    ProductStock does this, but the bulk updates here send no signals.
+    """
+    for ids in _batches(sorted(supply_point_ids)):
+        for supply_point in SupplyPoint.objects.filter(pk__in=ids):
+            update_alert_flags(supply_point, contacts=False)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = "Recompute the dashboard alert flags of every facility"
+
+    def handle(self, *args, **options):
+        from logistics.models import SupplyPoint
+        from logistics_project.apps.ewsghana.models import update_alert_flags
+        count = 0
+        for supply_point in SupplyPoint.objects.all():
+            update_alert_flags(supply_point)
+            count += 1
+        print "updated alert flags of %s facilities" % count
@@ -1,17 +1,30 @@
-import sys
-from django.core.management.base import BaseCommand
-from django.conf import settings
-from dimagi.utils.couch.database import get_db
-from logistics_project.apps.ewsghana import loader
+from datetime import datetime
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from logistics_project.apps.ewsghana import consumption
+from logistics_project.utils.parallel import processes_allowed
 
 class Command(BaseCommand):
     help = "Set ProductStock.use_auto_consumption to be True, and update all auto_monthly_consumptions"
+    option_list = BaseCommand.option_list + (
+        make_option('--since', default=None,
+                    help='Only update stocks with transactions on or after this date (YYYY-MM-DD)'),
+        make_option('--processes', type='int', default=0,
+                    help='How many processes to work out consumption with'),
+    )
 
     def handle(self, *args, **options):
         from logistics.models import ProductStock
-        stocks = ProductStock.objects.all()
-        for stock in stocks:
-            stock.use_auto_consumption = True
-            stock.update_auto_consumption()
-            stock.save()
-   
+        since = options['since']
+        if since:
+            try:
+                since = datetime.strptime(since, "%Y-%m-%d")
+            except ValueError:
+                raise CommandError("--since should look like 2012-01-31")
+        switched = set(ProductStock.objects.filter(use_auto_consumption=False)\
+                           .values_list('supply_point', flat=True))
+        ProductStock.objects.update(use_auto_consumption=True)
+        with processes_allowed():
+            updated = consumption.update_all(since=since, processes=options['processes'])
+        consumption.refresh_alert_flags(updated | switched)
+        print "updated auto consumption at %s facilities" % len(updated)
@@ -1,8 +1,8 @@
+from datetime import datetime
+from django.db import models
 from rapidsms.models import Contact
 from logistics.models import SupplyPoint
 from logistics.util import config
-# don't remove this - it's where signals get instantiated
-from logistics_project.apps.ewsghana import signals
 
 class GhanaFacility(SupplyPoint):
     class Meta:
@@ -20,3 +20,39 @@ class GhanaFacility(SupplyPoint):
         while district.type and district.tree_parent and district.type.slug != config.LocationCodes.DISTRICT:
             district = district.tree_parent 
         return supervisors.filter(supply_point__location__in=district.get_descendants(include_self=True), supply_point__active=True)
+
+class FacilityAlertFlags(models.Model):
+    """
+    What the dashboard alerts need to know about a facility, worked out
+    ahead of time so an alert is one query over the facilities below a
+    location. Made when a facility is created and kept current by the
+    handlers in signals.py; the ghana_update_alert_flags command 
+    rebuilds them all. The alerts count a facility without flags as 
+    alerting.
+    """
+    supply_point = models.OneToOneField(SupplyPoint, related_name="alert_flags")
+    consumptions_set = models.BooleanField(default=True, db_index=True)
+    has_incharge = models.BooleanField(default=True, db_index=True)
+    contacts_without_phone = models.PositiveIntegerField(default=0, db_index=True)
+    updated = models.DateTimeField(default=datetime.utcnow)
+
+def update_alert_flags(supply_point, consumptions=True, contacts=True):
+    """
+    Recompute a facility's alert flags: the consumption one, the contact
+    ones or both. A facility without flags yet gets all of them.
+    """
+    flags, created = FacilityAlertFlags.objects.get_or_create(supply_point=supply_point)
+    if consumptions or created:
+        flags.consumptions_set = bool(supply_point.are_consumptions_set())
+    if contacts or created:
+        reportees = supply_point.reportees()
+        flags.has_incharge = reportees is not None and reportees.count() > 0
+        flags.contacts_without_phone = Contact.objects.filter(supply_point=supply_point, 
+                                                              connection__isnull=True)\
+                                                      .distinct().count()
+    flags.updated = datetime.utcnow()
+    flags.save()
+    return flags
+
+# don't remove this - it's where signals get instantiated
+from logistics_project.apps.ewsghana import signals
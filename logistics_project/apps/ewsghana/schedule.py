@@ -9,7 +9,9 @@ from dateutil.relativedelta import relativedelta
 from rapidsms.contrib.messaging.utils import send_message
 from rapidsms.messages.outgoing import OutgoingMessage
 from logistics.models import Contact, \
-    ProductReport, SupplyPoint
+    ProductReport, SupplyPoint, Product
+from logistics_project.apps.ewsghana.stocked import stocked_product_ids
+from logistics_project.utils.connections import default_connections
 from django.utils.translation import ugettext as _
 from logistics.util import config
 from rapidsms.conf import settings
@@ -30,41 +32,47 @@ def first_soh_reminder (router):
 def second_soh_reminder (router):
     """monday follow-up"""
     logging.info("running second soh reminder")
-    reporters = Contact.objects.filter(role__responsibilities__code=config.Responsibilities.STOCK_ON_HAND_RESPONSIBILITY).distinct()
+    reporters = list(Contact.objects.filter(role__responsibilities__code=config.Responsibilities.STOCK_ON_HAND_RESPONSIBILITY)\
+                        .filter(supply_point__isnull=False).select_related('supply_point').distinct())
+    snapshot = ReportingStatusSnapshot(set(r.supply_point for r in reporters), days_until_late=5)
+    connections = default_connections(reporters)
     for reporter in reporters:
-        if reporter.supply_point:
-            on_time_products, missing_products = reporter.supply_point.report_status(days_until_late=5)
-            if not on_time_products:
-                response = config.Messages.SECOND_STOCK_ON_HAND_REMINDER % {'name':reporter.name}
-                send_message_safe(reporter, response)
-            elif missing_products:
-                response = config.Messages.SECOND_INCOMPLETE_SOH_REMINDER % {'name':reporter.name, 
-                                                                             'products':" ".join([prod.sms_code for prod in missing_products])}
-                send_message_safe(reporter, response)
+        on_time_products, missing_products = snapshot.report_status(reporter.supply_point)
+        if not on_time_products:
+            response = config.Messages.SECOND_STOCK_ON_HAND_REMINDER % {'name':reporter.name}
+            _send(connections.get(reporter.pk), response)
+        elif missing_products:
+            response = config.Messages.SECOND_INCOMPLETE_SOH_REMINDER % {'name':reporter.name, 
+                                                                         'products':" ".join([prod.sms_code for prod in missing_products])}
+            _send(connections.get(reporter.pk), response)
 
 def third_soh_to_super (router):
     """ wednesday, message the in-charge """
-    facilities = SupplyPoint.objects.all()
+    facilities = list(SupplyPoint.objects.filter(pk__in=Contact.objects.values('supply_point')))
+    snapshot = ReportingStatusSnapshot(facilities)
+    # the reportees of the facilities and of their supervising facilities
+    supervising = set(f.pk for f in facilities) | \
+                  set(f.supervised_by_id for f in facilities if f.supervised_by_id)
+    supers = {}
+    for super in Contact.objects.filter(supply_point__in=supervising)\
+                    .filter(role__responsibilities__code=config.Responsibilities.REPORTEE_RESPONSIBILITY).distinct():
+        supers.setdefault(super.supply_point_id, []).append(super)
+    connections = default_connections([s for ss in supers.values() for s in ss])
+    def _notify_super(facility_id, about, message, products=[]):
+        for super in supers.get(facility_id, []):
+            response = message % {'name':super.name, 'facility':about.name, 
+                                  'products':" ".join([prod.name for prod in products]) if products else None }
+            _send(connections.get(super.pk), response)
     for facility in facilities:
-        if facility.contact_set.count() == 0:
-            continue
-        on_time_products, missing_products = facility.report_status()
-        def _notify_super(facility_to_notify, about, message, products=[]):
-            if facility_to_notify is not None:
-                supers = Contact.objects.filter(supply_point=facility_to_notify)
-                supers = supers.filter(role__responsibilities__code=config.Responsibilities.REPORTEE_RESPONSIBILITY).distinct()
-                for super in supers:
-                    response = message % {'name':super.name, 'facility':about.name, 
-                                          'products':" ".join([prod.name for prod in products]) if products else None }
-                    send_message_safe(super, response)
+        on_time_products, missing_products = snapshot.report_status(facility)
         if not on_time_products:
             # alert to super: no stock reports received
-            _notify_super(facility, facility, config.Messages.THIRD_STOCK_ON_HAND_REMINDER)
-            _notify_super(facility.supervised_by, facility, config.Messages.THIRD_STOCK_ON_HAND_REMINDER)
+            _notify_super(facility.pk, facility, config.Messages.THIRD_STOCK_ON_HAND_REMINDER)
+            _notify_super(facility.supervised_by_id, facility, config.Messages.THIRD_STOCK_ON_HAND_REMINDER)
         elif missing_products:
             # alert to super: not all stock reports received
-            _notify_super(facility, facility, config.Messages.INCOMPLETE_SOH_TO_SUPER, missing_products)
-            _notify_super(facility.supervised_by, facility, config.Messages.INCOMPLETE_SOH_TO_SUPER, missing_products)
+            _notify_super(facility.pk, facility, config.Messages.INCOMPLETE_SOH_TO_SUPER, missing_products)
+            _notify_super(facility.supervised_by_id, facility, config.Messages.INCOMPLETE_SOH_TO_SUPER, missing_products)
             
         
 def reminder_to_submit_RRIRV(router):
@@ -78,3 +86,45 @@ def reminder_to_submit_RRIRV(router):
 def send_message_safe(contact, message):
     if contact.default_connection:
         OutgoingMessage(contact.default_connection, message).send()
+
+def _send(connection, message):
+    if connection is not None:
+        OutgoingMessage(connection, message).send()
+
+class ReportingStatusSnapshot(object):
+    """
+    Which products each of a set of facilities stocks, and which of 
+    those they have reported on recently, from a few queries for all of
+    them. report_status(facility) gives the same answer as 
+    SupplyPoint.report_status.
+    """
+
+    def __init__(self, facilities, days_until_late=None, now=None):
+        if days_until_late is None:
+            days_until_late = settings.LOGISTICS_DAYS_UNTIL_LATE_PRODUCT_REPORT
+        facilities = list(facilities)
+        ids = [f.pk for f in facilities]
+        self.stocked = stocked_product_ids(facilities)
+        since = (now or datetime.utcnow()) - timedelta(days=days_until_late)
+        self.reported = set(ProductReport.objects.filter(supply_point__in=ids, 
+                                                         report_date__gt=since)\
+                                .values_list('supply_point', 'product').distinct())
+        product_ids = set()
+        for stocked in self.stocked.values():
+            product_ids.update(stocked)
+        # in the products' own ordering
+        self.products = list(Product.objects.filter(pk__in=product_ids))
+
+    def report_status(self, facility):
+        """
+        (products reported on time, products missing) for a facility
+        """
+        stocked = self.stocked.get(facility.pk, set())
+        on_time, missing = [], []
+        for product in self.products:
+            if product.pk in stocked:
+                if (facility.pk, product.pk) in self.reported:
+                    on_time.append(product)
+                else:
+                    missing.append(product)
+        return on_time, missing
@@ -1,8 +1,56 @@
 #!/usr/bin/env python
 # vim: ai ts=4 sts=4 et sw=4 encoding=utf-8
 
+from django.db.models.signals import pre_save, post_save, post_delete
+from rapidsms.models import Contact, Connection
+from logistics.models import ProductStock, SupplyPoint
 from logistics.signals import stockout_resolved, notify_suppliees_of_stockouts_resolved
 from logistics.signals import stockout_reported, notify_suppliees_of_stockouts_reported
+from logistics_project.apps.ewsghana.models import update_alert_flags
 
 stockout_resolved.connect(notify_suppliees_of_stockouts_resolved)
 stockout_reported.connect(notify_suppliees_of_stockouts_reported)
+
+def _update_flags(supply_point_ids, **kwargs):
+    for supply_point in SupplyPoint.objects.filter(pk__in=[i for i in supply_point_ids if i]):
+        update_alert_flags(supply_point, **kwargs)
+
+def supply_point_created(sender, instance, created, **kwargs):
+    # so a new facility with no contacts or stock yet still alerts
+    if created and not kwargs.get("raw"):
+        update_alert_flags(instance)
+
+def stock_changed(sender, instance, **kwargs):
+    _update_flags([instance.supply_point_id], contacts=False)
+
+def _contact_supply_points(contact_ids):
+    return list(Contact.objects.filter(pk__in=[i for i in contact_ids if i])\
+                    .values_list('supply_point', flat=True))
+
+def remember_contact_supply_point(sender, instance, **kwargs):
+    # a contact that moves facility changes the flags of both
+    instance._previous_supply_points = _contact_supply_points([instance.pk])
+
+def contact_changed(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_supply_points", [])
+    _update_flags(set(previous + [instance.supply_point_id]), consumptions=False)
+
+def remember_connection_contact(sender, instance, **kwargs):
+    instance._previous_supply_points = _contact_supply_points\
+        (Connection.objects.filter(pk=instance.pk).values_list('contact', flat=True)) \
+        if instance.pk else []
+
+def connection_changed(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_supply_points", [])
+    _update_flags(set(previous + _contact_supply_points([instance.contact_id])), 
+                  consumptions=False)
+
+post_save.connect(supply_point_created, sender=SupplyPoint)
+post_save.connect(stock_changed, sender=ProductStock)
+post_delete.connect(stock_changed, sender=ProductStock)
+pre_save.connect(remember_contact_supply_point, sender=Contact)
+post_save.connect(contact_changed, sender=Contact)
+post_delete.connect(contact_changed, sender=Contact)
+pre_save.connect(remember_connection_contact, sender=Connection)
+post_save.connect(connection_changed, sender=Connection)
+post_delete.connect(connection_changed, sender=Connection)
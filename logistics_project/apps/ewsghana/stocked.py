@@ -0,0 +1,30 @@
+"""
+The products a set of facilities stock, for all of them at once.
+"""
+from rapidsms.conf import settings
+from logistics.models import Contact, ProductStock
+
+def stocked_product_ids(facilities):
+    """
+    {facility id: set of product ids}, worked out the way 
+    commodities_stocked does for the LOGISTICS_STOCKED_BY setting.
+    """
+    facilities = list(facilities)
+    ids = [f.pk for f in facilities]
+    ret = dict((pk, set()) for pk in ids)
+    if settings.LOGISTICS_STOCKED_BY == 'user':
+        rows = Contact.objects.filter(supply_point__in=ids, commodities__isnull=False)\
+                    .values_list('supply_point', 'commodities')
+    elif settings.LOGISTICS_STOCKED_BY == 'facility':
+        rows = ProductStock.objects.filter(supply_point__in=ids, is_active=True)\
+                    .values_list('supply_point', 'product')
+    else:
+        # every facility stocks the same products
+        rows = []
+        if facilities:
+            stocked = set(facilities[0].commodities_stocked().values_list('pk', flat=True))
+            for pk in ids:
+                ret[pk] = set(stocked)
+    for sp, product in rows:
+        ret[sp].add(product)
+    return ret
@@ -0,0 +1,139 @@
+"""
+Filling in the StockTransactions that were never made for old
+ProductReports.
+
+All the reports are read in one pass, ordered by supply point, product
+and date, with the id of any transaction already made from each one
+joined in. For each stock, transactions are generated from its reports
+up to the first one that already has a transaction, and that existing
+transaction is fixed up to start from the balance the generated ones
+end on. New transactions are written with bulk inserts a batch at a
+time, so the whole thing can be rerun safely to repair the history.
+"""
+from itertools import groupby
+from django.db import transaction
+from logistics.models import ProductReport, StockTransaction, SupplyPoint, Product
+from logistics_project.utils.bulk import insert_rows
+
+INSERT_BATCH_SIZE = 1000
+
+INSERT_COLUMNS = ('supply_point_id', 'product_id', 'product_report_id', 'quantity',
+                  'beginning_balance', 'ending_balance', 'date')
+
+class RepairStats(object):
+
+    def __init__(self):
+        self.reports = 0
+        self.stocks = 0
+        self.created = 0
+        self.modified = 0
+        self.deleted = 0
+        self.newest = None
+
+    def __unicode__(self):
+        return "%s reports of %s stocks read, %s transactions generated, " \
+               "%s existing transactions modified and %s deleted (newest generated: %s)" % \
+            (self.reports, self.stocks, self.created, self.modified, self.deleted, self.newest)
+
+    def __str__(self):
+        return unicode(self).encode("utf-8")
+
+def plan_stock(reports, from_product_report):
+    """
+    The transactions to generate for one stock's reports, oldest first,
+    each with a transaction_id attribute (None if it has no transaction
+    yet). Returns (new transactions, id of the first existing
+    transaction or None, how many reports were looked at).
+    """
+    beginning_balance = 0
+    generated = []
+    seen = 0
+    for report in reports:
+        seen += 1
+        if report.transaction_id is not None:
+            return generated, report.transaction_id, seen
+        st = from_product_report(report, beginning_balance)
+        if st is not None:
+            generated.append(st)
+            beginning_balance = st.ending_balance
+    return generated, None, seen
+
+def fix_existing(existing, last_generated):
+    """
+    What to do with the first existing transaction of a stock so it
+    follows on from the last generated one: None, "delete" or "modify"
+    (in which case existing has been changed but not saved).
+    """
+    if last_generated.ending_balance == existing.beginning_balance:
+        return None
+    if last_generated.ending_balance == existing.ending_balance:
+        # that transaction isn't needed any more
+        return "delete"
+    existing.beginning_balance = last_generated.ending_balance
+    existing.quantity = existing.ending_balance - existing.beginning_balance
+    return "modify"
+
+@transaction.commit_on_success
+def flush(new_transactions, fixes):
+    """
+    Insert the new transactions and save or delete the fixed up ones,
+    all in one transaction.
+    """
+    insert_rows(StockTransaction, INSERT_COLUMNS,
+                [[getattr(st, c) for c in INSERT_COLUMNS] for st in new_transactions])
+    for action, st in fixes:
+        if action == "delete":
+            st.delete()
+        else:
+            st.save()
+
+def _reports():
+    table = ProductReport._meta.db_table
+    return ProductReport.objects.select_related('report_type')\
+        .order_by('supply_point', 'product', 'report_date', 'pk')\
+        .extra(select={"transaction_id": "SELECT MIN(st.id) FROM %s st WHERE st.product_report_id = %s.id" % \
+                       (StockTransaction._meta.db_table, table)})
+
+def repair(dry_run=False, batch_size=INSERT_BATCH_SIZE):
+    """
+    Generate the missing transactions of every stock. With dry_run
+    nothing is written. Returns the RepairStats of the run.
+    """
+    stats = RepairStats()
+    supply_points = dict((sp.pk, sp) for sp in SupplyPoint.objects.all())
+    products = dict((p.pk, p) for p in Product.objects.all())
+    pending, fixes = [], []
+    for (sp_id, product_id), reports in groupby(_reports().iterator(),
+                                                lambda r: (r.supply_point_id, r.product_id)):
+        stats.stocks += 1
+        def _reports_of_stock():
+            for report in reports:
+                # shared instances, instead of a query per report
+                report.supply_point = supply_points[sp_id]
+                report.product = products[product_id]
+                yield report
+        generated, existing_id, seen = plan_stock(_reports_of_stock(),
+                                                  StockTransaction.from_product_report)
+        stats.reports += seen
+        if not generated:
+            continue
+        stats.created += len(generated)
+        if stats.newest is None or generated[-1].date > stats.newest:
+            stats.newest = generated[-1].date
+        pending.extend(generated)
+        if existing_id is not None:
+            existing = StockTransaction.objects.get(pk=existing_id)
+            action = fix_existing(existing, generated[-1])
+            if action == "delete":
+                stats.deleted += 1
+                fixes.append((action, existing))
+            elif action == "modify":
+                stats.modified += 1
+                fixes.append((action, existing))
+        if len(pending) >= batch_size:
+            if not dry_run:
+                flush(pending, fixes)
+            pending, fixes = [], []
+    if not dry_run and (pending or fixes):
+        flush(pending, fixes)
+    return stats
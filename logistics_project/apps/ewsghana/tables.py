@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 # vim: ai ts=4 sts=4 et sw=4 encoding=utf-8
 
-from itertools import chain
+from collections import defaultdict
 from django.core.urlresolvers import reverse
 from djtables import Table, Column
 from djtables.column import DateColumn
-from logistics.models import ProductStock
+from rapidsms.models import Contact
+from logistics.models import Product, ProductStock
 from logistics.tables import FacilityTable, _location
+from logistics.util import config
+from logistics_project.apps.ewsghana.stocked import stocked_product_ids
 
 def _facility_view(cell):
     return reverse(
@@ -15,28 +18,66 @@ def _facility_view(cell):
 def _facility_type(cell):
     return cell.object.type
 def _consumption(cell):
-    available = cell.object.stocked_consumptions_available()
-    total = cell.object.commodities_stocked().count()
+    available = cell.object.consumptions_available
+    total = len(cell.object.stocked_commodities)
     return "%s of %s (%s)" % (available,
                               total, 
                               'complete' if available >= total 
                               else 'INCOMPLETE')
 def _supervisor(cell):
-    supervisors = list(chain(cell.object.reportees(), 
-                             cell.object.supervised_by.reportees() if cell.object.supervised_by else []))
+    supervisors = cell.object.supervisors
     if supervisors:
         return ", ".join([s.name for s in supervisors])
     return "None"
 def _reporters(cell):
-    reporters = cell.object.reporters()
+    reporters = cell.object.reporter_list
     if reporters:
         return ", ".join([r.name for r in reporters])
     return "None"
 def _commodities_stocked(cell):
-    commodities = cell.object.commodities_stocked()
+    commodities = cell.object.stocked_commodities
     if commodities:
-        return " ".join([c.code for c in set(commodities)])
+        return " ".join([c.code for c in commodities])
     return None
+
+def prefetch_facility_details(facilities):
+    """
+    Set what FacilityDetailTable shows on each of a page of facilities,
+    from a few queries for the whole page: stocked_commodities, 
+    consumptions_available (how many of those have a monthly 
+    consumption), supervisors (the reportees of the facility and of the
+    facility supervising it) and reporter_list.
+    """
+    ids = [f.pk for f in facilities]
+    stocked = stocked_product_ids(facilities)
+    product_ids = set()
+    for product_set in stocked.values():
+        product_ids.update(product_set)
+    products = Product.objects.in_bulk(list(product_ids))
+    with_consumption = set((stock.supply_point_id, stock.product_id) for stock in \
+                           ProductStock.objects.filter(supply_point__in=ids, 
+                                                       product__in=list(product_ids)) \
+                           if stock.monthly_consumption is not None)
+    supply_point_ids = set(ids) | set(f.supervised_by_id for f in facilities if f.supervised_by_id)
+    def _contacts(responsibility):
+        ret = defaultdict(list)
+        for contact in Contact.objects.filter(supply_point__in=supply_point_ids,
+                                              role__responsibilities__code=responsibility)\
+                                      .distinct().order_by('pk'):
+            ret[contact.supply_point_id].append(contact)
+        return ret
+    reportees = _contacts(config.Responsibilities.REPORTEE_RESPONSIBILITY)
+    reporters = _contacts(config.Responsibilities.STOCK_ON_HAND_RESPONSIBILITY)
+    for facility in facilities:
+        facility.stocked_commodities = sorted([products[pk] for pk in stocked[facility.pk]], 
+                                              key=lambda p: p.code)
+        facility.consumptions_available = len([pk for pk in stocked[facility.pk] \
+                                               if (facility.pk, pk) in with_consumption])
+        facility.supervisors = reportees[facility.pk] + \
+            (reportees[facility.supervised_by_id] if facility.supervised_by_id else [])
+        facility.reporter_list = reporters[facility.pk]
+    return facilities
+
 class FacilityDetailTable(FacilityTable):
     name = Column(link=_facility_view)
     type = Column(value=_facility_type)
@@ -54,6 +95,11 @@ class FacilityDetailTable(FacilityTable):
         order_by = 'location'
         per_page = 30
 
+    @property
+    def rows(self):
+        facilities = prefetch_facility_details(list(self.paginator.page(self._meta.page).object_list))
+        return [self._meta.row_class(self, facility) for facility in facilities]
+
 class AuditLogTable(Table):
     date = DateColumn(format="H:i d/m/Y")
     user = Column()
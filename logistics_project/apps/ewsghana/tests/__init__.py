@@ -1,5 +1,7 @@
 import unittest
 from reminders import *
+from alertflags import *
+from consumption import *
 from default import *
 from equivalents import *
 from location import *
@@ -7,4 +9,6 @@ from receipt import *
 from requisition_status import *
 from stockedby import *
 from stockonhand import *
+from stocktransactions import *
+from tables import *
 from validator import *
\ No newline at end of file
@@ -0,0 +1,65 @@
+from rapidsms.tests.scripted import TestScript
+from rapidsms.models import Contact, Connection
+from logistics.models import SupplyPoint, Product, ProductStock
+from logistics.models import Location, SupplyPointType
+from logistics_project.apps.ewsghana import app as logistics_app
+from logistics_project.apps.ewsghana.consumption import refresh_alert_flags
+from logistics_project.apps.ewsghana.models import FacilityAlertFlags
+from logistics_project.apps.ewsghana.tests.util import load_test_data, register_user
+
+class TestAlertFlags(TestScript):
+    apps = ([logistics_app.App])
+    fixtures = ["ghana_initial_data.json"] 
+    def setUp(self):
+        TestScript.setUp(self)
+        load_test_data()
+        self.facility = SupplyPoint.objects.get(code='dedh')
+
+    def _flags(self):
+        return FacilityAlertFlags.objects.get(supply_point=self.facility)
+
+    def testContactsWithoutPhone(self):
+        contact = register_user(self, '8282', 'tester')
+        self.assertEqual(0, self._flags().contacts_without_phone)
+        nophone = Contact.objects.create(name='nophone', supply_point=self.facility)
+        self.assertEqual(1, self._flags().contacts_without_phone)
+        Connection.objects.create(identity='8283', contact=nophone, 
+                                  backend=contact.default_connection.backend)
+        self.assertEqual(0, self._flags().contacts_without_phone)
+        nophone.supply_point = None
+        nophone.save()
+        Connection.objects.filter(contact=nophone).delete()
+        self.assertEqual(0, self._flags().contacts_without_phone)
+
+    def testConsumptions(self):
+        product = Product.objects.all()[0]
+        ProductStock.objects.create(is_active=True, product=product, 
+                                    supply_point=self.facility)
+        self.assertEqual(self.facility.are_consumptions_set(), 
+                         self._flags().consumptions_set)
+        stock = ProductStock.objects.get(product=product, supply_point=self.facility)
+        stock.monthly_consumption = 10
+        stock.save()
+        self.assertEqual(self.facility.are_consumptions_set(), 
+                         self._flags().consumptions_set)
+
+    def testBulkConsumptionUpdates(self):
+        product = Product.objects.all()[0]
+        ProductStock.objects.create(is_active=True, product=product, 
+                                    supply_point=self.facility)
+        # the consumption command writes with update(), which sends no signals
+        ProductStock.objects.filter(supply_point=self.facility)\
+            .update(use_auto_consumption=True, auto_monthly_consumption=10)
+        FacilityAlertFlags.objects.filter(supply_point=self.facility)\
+            .update(consumptions_set=not self.facility.are_consumptions_set())
+        refresh_alert_flags([self.facility.pk])
+        self.assertEqual(self.facility.are_consumptions_set(), 
+                         self._flags().consumptions_set)
+
+    def testNewFacilityFlagged(self):
+        facility = SupplyPoint.objects.create(code='newfac', name='New Facility',
+                                              location=Location.objects.get(code='de'),
+                                              type=SupplyPointType.objects.get(code='hc'))
+        flags = FacilityAlertFlags.objects.get(supply_point=facility)
+        self.assertFalse(flags.has_incharge)
+        self.assertEqual(0, flags.contacts_without_phone)
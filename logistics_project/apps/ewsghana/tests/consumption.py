@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from django.conf import settings as django_settings
+from rapidsms.conf import settings
+from rapidsms.tests.scripted import TestScript
+from logistics.const import Reports
+from logistics.models import SupplyPoint, Product, ProductStock, \
+    ProductReport, ProductReportType
+from logistics_project.apps.ewsghana import app as logistics_app
+from logistics_project.apps.ewsghana.consumption import update_all
+from logistics_project.apps.ewsghana.tests.util import load_test_data
+
+class TestUpdateAll(TestScript):
+    apps = ([logistics_app.App])
+    fixtures = ["ghana_initial_data.json"]
+    def setUp(self):
+        settings.LOGISTICS_STOCKED_BY = 'user'
+        TestScript.setUp(self)
+        load_test_data()
+        self.facility = SupplyPoint.objects.get(code='dedh')
+        self.ov = Product.objects.get(sms_code='ov')
+        self.ml = Product.objects.get(sms_code='ml')
+
+    def _report(self, product, amounts, days_ago):
+        # stock on hand reports, or receipts given as (Reports.REC, amount),
+        # spread out over time
+        now = datetime.utcnow()
+        for amount, days in zip(amounts, days_ago):
+            code, quantity = amount if isinstance(amount, tuple) else (Reports.SOH, amount)
+            ProductReport.objects.create(supply_point=self.facility, product=product,
+                                         report_type=ProductReportType.objects.get(code=code),
+                                         quantity=quantity, message=None,
+                                         report_date=now - timedelta(days=days))
+
+    def _assertMatches(self):
+        """
+        Check update_all gives every stock the consumption
+        update_auto_consumption does, and return those.
+        """
+        expected = {}
+        for stock in ProductStock.objects.filter(supply_point=self.facility):
+            stock.update_auto_consumption()
+            stock.save()
+            expected[stock.product.sms_code] = stock.auto_monthly_consumption
+        # stale values have to be overwritten, including with None
+        ProductStock.objects.update(auto_monthly_consumption=12345)
+        update_all()
+        for stock in ProductStock.objects.filter(supply_point=self.facility):
+            self.assertEqual(expected[stock.product.sms_code], stock.auto_monthly_consumption)
+        return expected
+
+    def testMatchesUpdateAutoConsumption(self):
+        self._report(self.ov, (100, 80, 50), (60, 30, 0))
+        self._report(self.ml, (20,), (0,))
+        expected = self._assertMatches()
+        self.assertNotEqual(None, expected["ov"])
+        self.assertEqual(None, expected["ml"])
+
+    def testReceipts(self):
+        self._report(self.ov, (100, (Reports.REC, 50), 120), (40, 20, 0))
+        self._assertMatches()
+
+    def testEndStockout(self):
+        self._report(self.ov, (100, 80, 0), (60, 30, 0))
+        self._report(self.ml, (100, 0, 40), (60, 30, 0))
+        self._assertMatches()
+
+    def testMinimumDays(self):
+        self._report(self.ov, (100, 80, 50), (20, 10, 0))
+        rules = getattr(django_settings, "LOGISTICS_CONSUMPTION", {})
+        django_settings.LOGISTICS_CONSUMPTION = dict(rules, MINIMUM_DAYS=60)
+        try:
+            self.assertEqual(None, self._assertMatches()["ov"])
+        finally:
+            django_settings.LOGISTICS_CONSUMPTION = rules
@@ -4,6 +4,7 @@ from logistics.models import SupplyPoint, ProductType, Product
 from logistics_project.apps.ewsghana.tests.util import load_test_data, \
     report_stock, register_user
 from logistics_project.apps.ewsghana import app as logistics_app
+from logistics_project.apps.ewsghana.schedule import ReportingStatusSnapshot
 
 class TestReminders (TestScript):
     apps = ([logistics_app.App])
@@ -45,3 +46,21 @@ class TestReminders (TestScript):
         self.assertTrue(self.commodity in products_reported)
         self.assertTrue(self.commodity2 in products_reported)
         self.assertEqual(len(products_not_reported), 0)
+
+    def testSnapshotMatchesReportStatus(self):
+        def _check():
+            snapshot = ReportingStatusSnapshot(SupplyPoint.objects.all(), days_until_late=1)
+            for facility in SupplyPoint.objects.all():
+                on_time, missing = facility.report_status(days_until_late=1)
+                snap_on_time, snap_missing = snapshot.report_status(facility)
+                self.assertEqual(set(on_time), set(snap_on_time))
+                self.assertEqual(set(missing), set(snap_missing))
+        _check()
+        self.contact.commodities.add(self.commodity)
+        self.contact.commodities.add(self.commodity2)
+        _check()
+        report_stock(self, self.contact, self.commodity, 10)
+        _check()
+        snapshot = ReportingStatusSnapshot([self.facility], days_until_late=1)
+        self.assertEqual(([self.commodity], [self.commodity2]),
+                         snapshot.report_status(self.facility))
@@ -0,0 +1,89 @@
+import unittest
+from rapidsms.conf import settings
+from rapidsms.tests.scripted import TestScript
+from logistics.models import SupplyPoint, Product, StockTransaction
+from logistics_project.apps.ewsghana import app as logistics_app
+from logistics_project.apps.ewsghana.stocktransactions import plan_stock, fix_existing, repair
+from logistics_project.apps.ewsghana.tests.util import load_test_data, \
+    report_stock, register_user
+
+class _Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def _report(quantity, transaction_id=None):
+    return _Obj(quantity=quantity, transaction_id=transaction_id)
+
+def _from_product_report(report, beginning_balance):
+    if report.quantity is None:
+        return None
+    return _Obj(beginning_balance=beginning_balance, ending_balance=report.quantity,
+                quantity=report.quantity - beginning_balance)
+
+class TestPlanStock(unittest.TestCase):
+
+    def testGeneratesUntilExisting(self):
+        reports = [_report(10), _report(None), _report(7), _report(5, 42), _report(3)]
+        generated, existing_id, seen = plan_stock(reports, _from_product_report)
+        self.assertEqual([(0, 10), (10, 7)], 
+                         [(st.beginning_balance, st.ending_balance) for st in generated])
+        self.assertEqual(42, existing_id)
+        self.assertEqual(4, seen)
+
+    def testNothingExisting(self):
+        generated, existing_id, seen = plan_stock([_report(10)], _from_product_report)
+        self.assertEqual(1, len(generated))
+        self.assertEqual(None, existing_id)
+
+    def testFixExisting(self):
+        last = _Obj(ending_balance=7)
+        self.assertEqual(None, fix_existing(_Obj(beginning_balance=7, ending_balance=5), last))
+        self.assertEqual("delete", fix_existing(_Obj(beginning_balance=0, ending_balance=7), last))
+        existing = _Obj(beginning_balance=0, ending_balance=5, quantity=5)
+        self.assertEqual("modify", fix_existing(existing, last))
+        self.assertEqual((7, -2), (existing.beginning_balance, existing.quantity))
+
+class TestRepair(TestScript):
+    apps = ([logistics_app.App])
+    fixtures = ["ghana_initial_data.json"]
+    def setUp(self):
+        settings.LOGISTICS_STOCKED_BY = 'user'
+        TestScript.setUp(self)
+        load_test_data()
+        self.facility = SupplyPoint.objects.get(code='dedh')
+        self.product = Product.objects.get(sms_code='ov')
+        contact = register_user(self, '8282', 'tester', self.facility.code, self.facility.name)
+        for amount in (100, 80, 50):
+            report_stock(self, contact, self.product, amount)
+
+    def _balances(self):
+        return [(st.beginning_balance, st.ending_balance) for st in \
+                StockTransaction.objects.filter(supply_point=self.facility,
+                                                product=self.product).order_by('date', 'pk')]
+
+    def testRepair(self):
+        StockTransaction.objects.all().delete()
+
+        stats = repair(dry_run=True)
+        self.assertTrue(stats.created >= 3)
+        self.assertEqual(0, StockTransaction.objects.count())
+
+        stats = repair()
+        self.assertEqual(stats.created, StockTransaction.objects.count())
+        self.assertEqual([(0, 100), (100, 80), (80, 50)], self._balances())
+
+        # everything has a transaction now, so a rerun changes nothing
+        stats = repair()
+        self.assertEqual((0, 0, 0), (stats.created, stats.modified, stats.deleted))
+        self.assertEqual([(0, 100), (100, 80), (80, 50)], self._balances())
+
+    def testRepairBeforeExisting(self):
+        # only the latest report still has its transaction
+        latest = StockTransaction.objects.filter(supply_point=self.facility,
+                                                 product=self.product).latest('pk')
+        StockTransaction.objects.filter(supply_point=self.facility,
+                                        product=self.product).exclude(pk=latest.pk).delete()
+        stats = repair()
+        self.assertEqual(0, stats.deleted)
+        self.assertEqual([(0, 100), (100, 80), (80, 50)], self._balances())
+        self.assertEqual(0, repair().created)
@@ -0,0 +1,30 @@
+from rapidsms.conf import settings
+from rapidsms.tests.scripted import TestScript
+from logistics.models import Product, ProductStock, SupplyPoint
+from logistics_project.apps.ewsghana import app as logistics_app
+from logistics_project.apps.ewsghana.tables import prefetch_facility_details
+from logistics_project.apps.ewsghana.tests.util import load_test_data, register_user
+
+class TestFacilityDetails(TestScript):
+    apps = ([logistics_app.App])
+    fixtures = ["ghana_initial_data.json"] 
+    def setUp(self):
+        settings.LOGISTICS_STOCKED_BY = 'facility'
+        TestScript.setUp(self)
+        load_test_data()
+        self.facility = SupplyPoint.objects.get(code='dedh')
+        mc = Product.objects.get(sms_code='mc')
+        lf = Product.objects.get(sms_code='lf')
+        ProductStock(is_active=True, product=mc, supply_point=self.facility,
+                     monthly_consumption=5).save()
+        ProductStock(is_active=True, product=lf, supply_point=self.facility).save()
+        register_user(self, "888", "testuser", "dedh")
+
+    def testMatchesFacilityMethods(self):
+        facility, = prefetch_facility_details([SupplyPoint.objects.get(code='dedh')])
+        self.assertEqual(self.facility.stocked_consumptions_available(), 
+                         facility.consumptions_available)
+        self.assertEqual(set(self.facility.commodities_stocked()), 
+                         set(facility.stocked_commodities))
+        self.assertEqual(set(self.facility.reporters()), set(facility.reporter_list))
+        self.assertEqual(set(self.facility.reportees()), set(facility.supervisors))
@@ -144,7 +144,7 @@ def email_reports(request, context={}, template="ewsghana/email_reports.html"):
 
 @location_context
 def facilities_list(request, location_code=None, context={}, template="ewsghana/facilities_list.html"):
-    facilities = context['location'].all_facilities()
+    facilities = context['location'].all_facilities().select_related('type', 'location')
     context ['table'] = FacilityDetailTable(facilities, request=request)
     context['destination_url'] = "facilities_list"
     return render_to_response(
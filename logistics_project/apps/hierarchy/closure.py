@@ -0,0 +1,71 @@
+"""
+Maintaining closure tables: a row of (ancestor, descendant, depth) for
+every node of a tree and each node above it, including itself at depth
+0. The functions here work on any closure model with ancestor and
+descendant foreign keys and a depth.
+"""
+from django.db import transaction
+from logistics_project.utils.bulk import insert_rows
+
+def ancestors(node_id, parents):
+    """
+    [(ancestor id, depth)] from the node itself up to its root, given
+    {node id: parent id}. Stops if the parents loop back on themselves.
+    """
+    chain = []
+    seen = set()
+    while node_id is not None and node_id not in seen:
+        seen.add(node_id)
+        chain.append((node_id, len(chain)))
+        node_id = parents.get(node_id)
+    return chain
+
+def closure_rows(parents):
+    """
+    (ancestor id, descendant id, depth) for every node in {node id: parent id}.
+    """
+    for node_id in parents:
+        for ancestor_id, depth in ancestors(node_id, parents):
+            yield (ancestor_id, node_id, depth)
+
+@transaction.commit_on_success
+def rebuild(closure_model, parents):
+    """
+    Replace everything in a closure table. Returns the number of rows.
+    """
+    closure_model.objects.all().delete()
+    return insert_rows(closure_model, ('ancestor_id', 'descendant_id', 'depth'),
+                       closure_rows(parents))
+
+class _Parents(dict):
+    # {node id: parent id}, looking up nodes it hasn't seen with parent_of
+    def __init__(self, parent_of, known):
+        dict.__init__(self, known)
+        self.parent_of = parent_of
+
+    def get(self, node_id, default=None):
+        if node_id not in self:
+            self[node_id] = self.parent_of(node_id)
+        return dict.get(self, node_id, default)
+
+def update_node(closure_model, node_id, parent_id, parent_of):
+    """
+    Bring the closure table up to date after a node is saved with a
+    (possibly new) parent. If the node moved, everything below it moves
+    with it. parent_of(id) returns the parent id of any other node.
+    """
+    rows = closure_model.objects
+    parents = list(rows.filter(descendant=node_id, depth=1).values_list('ancestor', flat=True))
+    has_self = rows.filter(ancestor=node_id, descendant=node_id).exists()
+    if has_self and parents == ([parent_id] if parent_id is not None else []):
+        return
+    # the node and everything below it that already has rows, which 
+    # can be there before the node's own if children were saved first.
+    # all their rows are rebuilt from the parents.
+    subtree = set(rows.filter(ancestor=node_id).values_list('descendant', flat=True))
+    subtree.add(node_id)
+    parents = _Parents(parent_of, {node_id: parent_id})
+    rows.filter(descendant__in=list(subtree)).delete()
+    for descendant_id in subtree:
+        for ancestor_id, depth in ancestors(descendant_id, parents):
+            rows.create(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth)
@@ -0,0 +1,14 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from logistics_project.apps.hierarchy.utils import rebuild_supply_point_closure,\
+    rebuild_location_closure
+
+class Command(BaseCommand):
+    help = "Rebuild the supply point and location closure tables from scratch"
+
+    def handle(self, *args, **options):
+        start = datetime.utcnow()
+        sps = rebuild_supply_point_closure()
+        locs = rebuild_location_closure()
+        print "Wrote %s supply point and %s location rows in %s" % \
+            (sps, locs, datetime.utcnow() - start)
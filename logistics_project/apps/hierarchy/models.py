@@ -0,0 +1,39 @@
+from django.db import models
+from logistics.models import SupplyPoint
+from rapidsms.contrib.locations.models import Location
+
+class SupplyPointClosure(models.Model):
+    """
+    One row for every supply point and each of the supply points above 
+    it in the supplied_by chain (and itself, at depth 0), so everything 
+    below a supply point at any depth is a single lookup. Kept current 
+    by the signals in signals.py, filled in by syncdb when it is missing
+    any supply points and rebuilt with the rebuild_closure management 
+    command.
+    """
+    ancestor = models.ForeignKey(SupplyPoint, related_name="closure_descendants")
+    descendant = models.ForeignKey(SupplyPoint, related_name="closure_ancestors")
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
+
+    def __unicode__(self):
+        return "%s > %s (%s)" % (self.ancestor_id, self.descendant_id, self.depth)
+
+class LocationClosure(models.Model):
+    """
+    The same as SupplyPointClosure, for locations and their parents.
+    """
+    ancestor = models.ForeignKey(Location, related_name="closure_descendants")
+    descendant = models.ForeignKey(Location, related_name="closure_ancestors")
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
+
+    def __unicode__(self):
+        return "%s > %s (%s)" % (self.ancestor_id, self.descendant_id, self.depth)
+
+# don't remove this - it's where signals get instantiated
+from logistics_project.apps.hierarchy import signals
@@ -0,0 +1,34 @@
+from django.db.models.signals import post_save, post_syncdb
+from logistics.models import SupplyPoint
+from rapidsms.contrib.locations.models import Location
+from logistics_project.apps.hierarchy.closure import update_node
+from logistics_project.apps.hierarchy.models import SupplyPointClosure,\
+    LocationClosure
+from logistics_project.apps.hierarchy.utils import supply_point_parent,\
+    location_parent, rebuild_supply_point_closure, rebuild_location_closure
+
+def update_supply_point_closure(sender, instance, **kwargs):
+    update_node(SupplyPointClosure, instance.pk, instance.supplied_by_id,
+                supply_point_parent)
+
+def update_location_closure(sender, instance, **kwargs):
+    update_node(LocationClosure, instance.pk, instance.parent_id, location_parent)
+
+def _incomplete(closure_model, node_model):
+    # every node has a row for itself
+    return closure_model.objects.filter(depth=0).count() < node_model.objects.count()
+
+def build_missing_closures(sender, **kwargs):
+    # the tables are only kept current from when they were added, so on a
+    # database that already had supply points and locations they are
+    # rebuilt by the first syncdb (or migrate)
+    if sender.__name__ != SupplyPointClosure.__module__:
+        return
+    if _incomplete(SupplyPointClosure, SupplyPoint):
+        rebuild_supply_point_closure()
+    if _incomplete(LocationClosure, Location):
+        rebuild_location_closure()
+
+post_save.connect(update_supply_point_closure, sender=SupplyPoint)
+post_save.connect(update_location_closure, sender=Location)
+post_syncdb.connect(build_missing_closures)
@@ -0,0 +1 @@
+from logistics_project.apps.hierarchy.tests.closure import *
@@ -0,0 +1,88 @@
+import unittest
+from django.test import TestCase
+from rapidsms.contrib.locations.models import Location, LocationType
+from logistics_project.apps.hierarchy.closure import ancestors, closure_rows,\
+    update_node
+from logistics_project.apps.hierarchy import models as hierarchy_models
+from logistics_project.apps.hierarchy.models import LocationClosure
+from logistics_project.apps.hierarchy.signals import build_missing_closures
+
+class TestClosureRows(unittest.TestCase):
+
+    # national > district > facility > two hsas
+    parents = {1: None, 2: 1, 3: 2, 4: 3, 5: 3}
+
+    def testAncestors(self):
+        self.assertEqual([(4, 0), (3, 1), (2, 2), (1, 3)], ancestors(4, self.parents))
+        self.assertEqual([(1, 0)], ancestors(1, self.parents))
+
+    def testLoopsStop(self):
+        self.assertEqual([(1, 0), (2, 1)], ancestors(1, {1: 2, 2: 1}))
+
+    def testClosureRows(self):
+        rows = set(closure_rows(self.parents))
+        self.assertEqual(1 + 2 + 3 + 4 + 4, len(rows))
+        below_district = sorted(d for a, d, depth in rows if a == 2)
+        self.assertEqual([2, 3, 4, 5], below_district)
+        self.assertTrue((1, 5, 3) in rows)
+
+class TestUpdateNode(TestCase):
+
+    def setUp(self):
+        type = LocationType.objects.create(slug="closuretest", name="closuretest")
+        ids = dict((name, Location.objects.create(name=name, code=name, type=type).pk) \
+                   for name in ("national", "district", "facility", "hsa1", "hsa2", "district2"))
+        self.ids = ids
+        self.parents = {ids["national"]: None, ids["district"]: ids["national"],
+                        ids["facility"]: ids["district"], ids["hsa1"]: ids["facility"],
+                        ids["hsa2"]: ids["facility"], ids["district2"]: ids["national"]}
+        # as if the table was added after the locations were
+        LocationClosure.objects.all().delete()
+
+    def _save(self, *names):
+        for name in names:
+            node_id = self.ids[name]
+            update_node(LocationClosure, node_id, self.parents[node_id], self.parents.get)
+
+    def _move(self, name, parent):
+        self.parents[self.ids[name]] = self.ids[parent]
+        self._save(name)
+
+    def _check(self):
+        self.assertEqual(set(closure_rows(self.parents)),
+                         set(LocationClosure.objects.values_list('ancestor', 'descendant', 'depth')))
+
+    def _below(self, name):
+        return set(LocationClosure.objects.filter(ancestor=self.ids[name])\
+                                          .values_list('descendant', flat=True))
+
+    def testTopDown(self):
+        self._save("national", "district", "facility", "hsa1", "hsa2", "district2")
+        self._check()
+
+    def testChildSavedBeforeParent(self):
+        self._save("hsa1", "facility")
+        self.assertTrue(self.ids["hsa1"] in self._below("facility"))
+        self._save("hsa2", "national", "district2", "district")
+        self._check()
+
+    def testMove(self):
+        self._save("national", "district", "facility", "hsa1", "hsa2", "district2")
+        self._move("facility", "district2")
+        self._check()
+        self.assertEqual(set([self.ids["district"]]), self._below("district"))
+        self.assertTrue(self.ids["hsa2"] in self._below("district2"))
+
+    def testReparentAfterChildFirst(self):
+        self._save("hsa1", "facility")
+        self._move("facility", "district2")
+        self._move("hsa2", "district")
+        self._save("national", "district", "district2")
+        self._check()
+
+    def testBuiltAfterSyncdb(self):
+        # only some of the locations have rows
+        self._save("national", "district")
+        build_missing_closures(sender=hierarchy_models)
+        for name in self.ids:
+            self.assertEqual(set([self.ids[name]]), self._below(name))
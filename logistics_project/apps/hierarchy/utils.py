@@ -0,0 +1,43 @@
+from logistics.models import SupplyPoint
+from rapidsms.contrib.locations.models import Location
+from logistics_project.apps.hierarchy.closure import rebuild
+from logistics_project.apps.hierarchy.models import SupplyPointClosure,\
+    LocationClosure
+
+def _as_list(location):
+    return location if isinstance(location, (list, tuple)) else [location]
+
+def supply_point_ids_below(location):
+    """
+    The ids of the supply points at or below a location (or list of 
+    locations) in the supplied_by chain, at any depth, as a subquery.
+    """
+    return SupplyPointClosure.objects.filter\
+        (ancestor__location__in=_as_list(location)).values('descendant')
+
+def location_ids_below(location):
+    """
+    The ids of a location (or list of locations) and everything under
+    them, at any depth, as a subquery.
+    """
+    return LocationClosure.objects.filter\
+        (ancestor__in=_as_list(location)).values('descendant')
+
+def _first(values):
+    # None when the node isn't there (yet), e.g. while loading fixtures
+    values = list(values[:1])
+    return values[0] if values else None
+
+def supply_point_parent(supply_point_id):
+    return _first(SupplyPoint.objects.filter(pk=supply_point_id)\
+                    .values_list('supplied_by', flat=True))
+
+def location_parent(location_id):
+    return _first(Location.objects.filter(pk=location_id)\
+                    .values_list('parent_id', flat=True))
+
+def rebuild_supply_point_closure():
+    return rebuild(SupplyPointClosure, dict(SupplyPoint.objects.values_list('pk', 'supplied_by')))
+
+def rebuild_location_closure():
+    return rebuild(LocationClosure, dict(Location.objects.values_list('pk', 'parent_id')))
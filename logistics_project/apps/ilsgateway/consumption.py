@@ -0,0 +1,178 @@
+"""
+Monthly consumption and months of stock for many facilities at once.
+
+ServiceDeliveryPoint.calculate_monthly_consumption used to run a dozen
+queries per facility and product. These functions load all the reports
+they need for a list of facilities and products in one query and work
+out the same numbers in memory.
+"""
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from dateutil.rrule import rrule, MONTHLY, MO, TU, WE, TH, FR
+from models import ServiceDeliveryPointProductReport
+from utils import get_last_business_day_of_month
+
+#TODO This needs to be a setting or a db value
+MONTHS_TO_CALCULATE = 3
+
+CONSUMPTION_REPORT_TYPES = ['soh', 'la', 'dlvd']
+
+def consumption_boundaries(now, months=MONTHS_TO_CALCULATE):
+    """
+    The last business day (at 14:00) of each month that the consumption
+    calculation spans.
+    """
+    return list(rrule(MONTHLY,
+                      interval=1,
+                      dtstart=now + relativedelta(months=-(months+1)),
+                      count=months+2,
+                      byweekday=(MO,TU,WE,TH,FR),
+                      byhour=14,
+                      bysecond=0,
+                      bysetpos=-1,
+                      byminute=0))
+
+def _latest(reports, report_type, start, end):
+    # reports are (type, date, quantity), ordered by date
+    quantity = 0
+    for type, date, qty in reports:
+        if date > end:
+            break
+        if type == report_type and date >= start:
+            quantity = qty
+    return quantity
+
+def average_consumption(reports, boundaries, months=MONTHS_TO_CALCULATE):
+    """
+    Average monthly consumption from a facility's (type, date, quantity)
+    reports of one product, ordered by date. None if it can't be worked
+    out for any month.
+    """
+    consumption_list = []
+    for i in range(months):
+        opening_balance = _latest(reports, 'soh', boundaries[i], boundaries[i+1])
+        vals = dict((report_type, _latest(reports, report_type,
+                                          boundaries[i+1], boundaries[i+2])) \
+                    for report_type in CONSUMPTION_REPORT_TYPES)
+        if opening_balance == 0 or vals['soh'] == 0:
+            continue
+        consumption_list.append(opening_balance + vals['dlvd'] + vals['la'] - vals['soh'])
+    if consumption_list:
+        return sum(consumption_list) / float(len(consumption_list))
+    return None
+
+def monthly_consumption(sdps, sms_codes, now=None):
+    """
+    {(sdp id, product sms code): average monthly consumption or None}
+    for every facility and product passed in.
+    """
+    now = now or datetime.now()
+    boundaries = consumption_boundaries(now)
+    sdp_ids = [getattr(sdp, "pk", sdp) for sdp in sdps]
+    by_cell = dict(((sdp_id, code), []) for sdp_id in sdp_ids for code in sms_codes)
+    rows = ServiceDeliveryPointProductReport.objects.filter\
+                (service_delivery_point__in=sdp_ids,
+                 report_type__sms_code__in=CONSUMPTION_REPORT_TYPES,
+                 product__sms_code__in=sms_codes,
+                 report_date__range=(boundaries[0], now))\
+                .order_by('report_date')\
+                .values_list('service_delivery_point', 'product__sms_code',
+                             'report_type__sms_code', 'report_date', 'quantity')
+    for sdp_id, code, type, date, quantity in rows:
+        by_cell[(sdp_id, code)].append((type, date, quantity))
+    return dict((cell, average_consumption(reports, boundaries) if reports else None) \
+                for cell, reports in by_cell.items())
+
+def stock_on_hand_window(end_date):
+    """
+    The window ServiceDeliveryPoint.stock_on_hand looks for a report in.
+    """
+    last_month = end_date + relativedelta(months=-1)
+    start_time = last_month + relativedelta(day=get_last_business_day_of_month(last_month.year,
+                                                                               last_month.month))
+    end_time = end_date + relativedelta(day=get_last_business_day_of_month(end_date.year,
+                                                                           end_date.month))
+    return start_time, end_time
+
+def _latest_stock_on_hand(sdps, sms_codes, start_time, end_time):
+    rows = ServiceDeliveryPointProductReport.objects.filter\
+                (service_delivery_point__in=[getattr(sdp, "pk", sdp) for sdp in sdps],
+                 product__sms_code__in=sms_codes,
+                 report_type__sms_code="soh",
+                 report_date__range=(start_time, end_time))\
+                .order_by('report_date')\
+                .values_list('service_delivery_point', 'product__sms_code', 'quantity')
+    # later reports overwrite earlier ones
+    return dict(((sdp_id, code), quantity) for sdp_id, code, quantity in rows)
+
+def latest_stock_on_hand(sdps, sms_codes, end_date):
+    """
+    {(sdp id, product sms code): quantity} of the latest stock on hand
+    report in the window ending at end_date, where there is one.
+    """
+    start_time, end_time = stock_on_hand_window(end_date)
+    return _latest_stock_on_hand(sdps, sms_codes, start_time, end_time)
+
+def months_of_stock(sdps, sms_codes, report_date=None):
+    """
+    {(sdp id, product sms code): months of stock or None}, computed the
+    same way as ServiceDeliveryPoint.months_of_stock but in two queries.
+    """
+    report_date = report_date or datetime.now()
+    consumption = monthly_consumption(sdps, sms_codes)
+    stock = latest_stock_on_hand(sdps, sms_codes, report_date)
+    ret = {}
+    for cell, monthly in consumption.items():
+        soh = stock.get(cell)
+        if not soh:
+            ret[cell] = None
+        elif monthly > 0:
+            ret[cell] = round(soh / monthly, 1)
+        else:
+            ret[cell] = 0
+    return ret
+
+class FacilityProductMatrix(object):
+    """
+    A value for each of a list of facilities and products, as dense rows
+    in the order they were passed in. None where there is no value.
+    """
+
+    def __init__(self, sdps, products, values):
+        self.sdps = list(sdps)
+        self.products = list(products)
+        self._row_index = dict((sdp.pk, i) for i, sdp in enumerate(self.sdps))
+        self._column_index = dict((p.sms_code, j) for j, p in enumerate(self.products))
+        self.rows = [[values.get((sdp.pk, p.sms_code)) for p in self.products] \
+                     for sdp in self.sdps]
+
+    def get(self, sdp, product):
+        return self.rows[self._row_index[sdp.pk]][self._column_index[product.sms_code]]
+
+    def column_counts(self, test):
+        """
+        {product sms code: number of facilities whose value passes test}
+        """
+        counts = [0] * len(self.products)
+        for row in self.rows:
+            for j, value in enumerate(row):
+                if test(value):
+                    counts[j] += 1
+        return dict((p.sms_code, counts[j]) for j, p in enumerate(self.products))
+
+def stock_matrix(sdps, products, window):
+    """
+    The latest stock on hand of each facility and product reported in
+    the (start, end) window, from one query.
+    """
+    sdps, products = list(sdps), list(products)
+    start_time, end_time = window
+    return FacilityProductMatrix(sdps, products,
+                                 _latest_stock_on_hand(sdps, [p.sms_code for p in products],
+                                                       start_time, end_time))
+
+def months_of_stock_matrix(sdps, products, report_date=None):
+    sdps, products = list(sdps), list(products)
+    return FacilityProductMatrix(sdps, products,
+                                 months_of_stock(sdps, [p.sms_code for p in products],
+                                                 report_date))
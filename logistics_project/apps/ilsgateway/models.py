@@ -126,12 +126,15 @@ class ServiceDeliveryPoint(Location):
         return self.sdp_name
 
     def stock_levels_array(self):
+        from consumption import months_of_stock
         soh_array = []
-        for product in Product.objects.all():
+        products = list(Product.objects.all())
+        mos = months_of_stock([self], [p.sms_code for p in products])
+        for product in products:
             soh_value = self.stock_on_hand(product.sms_code)
             if soh_value == None:
                 soh_value = "No data"
-            mos_value = self.months_of_stock(product.sms_code)
+            mos_value = mos[(self.pk, product.sms_code)]
             if mos_value == None:
                 mos_value = "Insufficient data"
             soh_array.append([product.sms_code, soh_value, mos_value])
@@ -388,71 +391,9 @@ class ServiceDeliveryPoint(Location):
             return None
         
     def calculate_monthly_consumption(self, sms_code):
-        # This maybe become be a performance hog, could a) cache or b) refactor
-        
-        #TODO This needs to be a setting or a db value
-        months_to_calculate = 3
-        # Calculate consumption for the X months prior, then calculate latest stock levels divided by avg monthly consumption
-        now = datetime.now()
-        rr1 = rrule(MONTHLY, 
-                    interval=1, 
-                    dtstart=now + relativedelta(months=-(months_to_calculate+1)), 
-                    count=months_to_calculate+2,
-                    byweekday=(MO,TU,WE,TH,FR), 
-                    byhour=14, 
-                    bysecond=0,
-                    bysetpos=-1,
-                    byminute=0)
-            
-        reports = ServiceDeliveryPointProductReport.objects.filter(Q(service_delivery_point__id=self.id,
-                                                                  report_type__sms_code__in=['soh', 'la', 'dlvd'],
-                                                                  product__sms_code=sms_code,
-                                                                  report_date__range=(rr1[0], now))).order_by('report_date')
-        if reports:
-            logging.debug(list(rr1))
-            consumption_list = []
-            for i in range(months_to_calculate):
-                current_month_vals = {}
-                logging.debug("Calcing consumption for period %s to %s" % (rr1[i+1], rr1[i+2]))
-                # calc closing balance from last month (current cycles' opening balance)
-                report_type = 'soh'
-                current_month_reports = reports.filter(report_date__range=(rr1[i], rr1[i+1]),
-                                                       report_type__sms_code=report_type)
-                if current_month_reports:
-                    latest_report = current_month_reports.latest('report_date')
-                    logging.debug("  Closing balance for period ending %s reported on %s: %s" % (rr1[i], latest_report.report_date, latest_report.quantity))
-                    if report_type == 'soh':
-                        current_month_vals['opening_balance'] = latest_report.quantity
-                    elif report_type == 'la':
-                        current_month_vals['adjustments'] = latest_report.quantity
-                else:                        
-                    if report_type == 'soh':
-                        current_month_vals['opening_balance'] = 0
-                    elif report_type == 'la':
-                        current_month_vals['adjustments'] = 0
-                
-                # calculate received, adjustments and opening balance for the next month        
-                for report_type in ['soh', 'dlvd', 'la']:                        
-                    current_month_reports = reports.filter(report_date__range=(rr1[i+1], rr1[i+2]),
-                                                           report_type__sms_code=report_type)
-                    if current_month_reports:
-                        latest_report = current_month_reports.latest('report_date')
-                        logging.debug("  %s for period ending %s reported on %s: %s" % (report_type, rr1[i+1], latest_report.report_date, latest_report.quantity))
-                        current_month_vals[report_type] = latest_report.quantity
-                    else:                        
-                        current_month_vals[report_type] = 0
-
-                if current_month_vals['opening_balance'] == 0 or current_month_vals['soh'] == 0:
-                    consumption = None
-                else:
-                    consumption = current_month_vals['opening_balance'] + current_month_vals['dlvd'] + current_month_vals['la'] - current_month_vals['soh'] 
-                if consumption is not None:
-                    consumption_list.append(consumption)
-            if len(consumption_list) > 0:
-                avg_consumption =  sum([i for i in consumption_list]) / float(len(consumption_list))
-                return avg_consumption
-            else:
-                return None
+        # see consumption.py to calculate this for many facilities at once
+        from consumption import monthly_consumption
+        return monthly_consumption([self], [sms_code])[(self.pk, sms_code)]
 
     def stock_on_hand(self, sms_code, end_date=datetime.now() + relativedelta(months=-1) ):
         start_time = end_date + relativedelta(months=-1, 
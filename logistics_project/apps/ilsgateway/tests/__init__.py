@@ -3,4 +3,5 @@ import unittest
 #from deliverygroup import *
 #from servicedeliverypoint import *
 #from reminders import *
-from callbacks import *
\ No newline at end of file
+from callbacks import *
+from consumption import *
\ No newline at end of file
@@ -0,0 +1,44 @@
+import unittest
+from datetime import datetime, timedelta
+from logistics_project.apps.ilsgateway.consumption import average_consumption,\
+    consumption_boundaries, FacilityProductMatrix
+
+class TestAverageConsumption(unittest.TestCase):
+
+    def setUp(self):
+        self.boundaries = consumption_boundaries(datetime(2011, 6, 15))
+
+    def _in_month(self, i, days=5):
+        # a date between boundaries i and i + 1
+        return self.boundaries[i] + timedelta(days=days)
+
+    def testNoData(self):
+        self.assertEqual(None, average_consumption([], self.boundaries))
+
+    def testOneMonth(self):
+        reports = [('soh', self._in_month(0), 100),
+                   ('dlvd', self._in_month(1, 2), 50),
+                   ('soh', self._in_month(1, 4), 60),
+                   ('soh', self._in_month(1, 6), 70)]
+        # opening 100, received 50, closing 70 (the latest)
+        self.assertEqual(80.0, average_consumption(reports, self.boundaries))
+
+    def testZeroBalanceSkipped(self):
+        reports = [('soh', self._in_month(0), 100),
+                   ('soh', self._in_month(1), 0)]
+        self.assertEqual(None, average_consumption(reports, self.boundaries))
+
+class _Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class TestFacilityProductMatrix(unittest.TestCase):
+
+    def testDense(self):
+        sdps = [_Obj(pk=1), _Obj(pk=2)]
+        products = [_Obj(sms_code='dp'), _Obj(sms_code='ip')]
+        matrix = FacilityProductMatrix(sdps, products, {(1, 'dp'): 5, (2, 'ip'): 0})
+        self.assertEqual([[5, None], [None, 0]], matrix.rows)
+        self.assertEqual(0, matrix.get(sdps[1], products[1]))
+        self.assertEqual({'dp': 1, 'ip': 0},
+                         matrix.column_counts(lambda v: v is not None and v > 0))
@@ -11,6 +11,8 @@ from django.contrib.auth.decorators import login_required
 from django.utils.translation import ugettext as _
 from rapidsms.contrib.messagelog.models import Message
 from utils import *
+from consumption import months_of_stock, stock_matrix, stock_on_hand_window,\
+    months_of_stock_matrix
 from forms import NoteForm, SelectLocationForm, StockInquiryForm, SelectProductForm
 from tables import MessageHistoryTable, CurrentStockStatusTable, CurrentMOSTable, OrderingTable
 from django.contrib.auth.admin import UserAdmin
@@ -258,8 +260,17 @@ def reports(request):
     #stock tables
     stock_data_tables = []
     number_of_products_to_display = 5
-    products = Product.objects.all()[0:number_of_products_to_display]
+    all_products = list(Product.objects.all())
+    products = all_products[0:number_of_products_to_display]
     i = 0
+    facilities = Facility.objects.filter(parent_id=sdp.id).order_by(order_by, "name")
+    stock_date = report_date + relativedelta(months=-1, hour=14, minute=0, second=0, microsecond=0)
+    if view_type == 'inventory':
+        stock = stock_matrix(facilities, all_products, stock_on_hand_window(stock_date))
+    else:
+        stock = months_of_stock_matrix(facilities, all_products, stock_date)
+    under_stocked_by_product = stock.column_counts(lambda v: _stock_cell_class(v) == 'under_min')
+    over_stocked_by_product = stock.column_counts(lambda v: _stock_cell_class(v) == 'exceeds_max')
 
     while products:
         stock_data_table = [] 
@@ -282,11 +293,6 @@ def reports(request):
         for product in products:
             stock_header_row.append({'data': product.sms_code})
     
-        facilities = Facility.objects.filter(parent_id=sdp.id).order_by(order_by, "name")
-        under_stocked_by_product = {}
-        over_stocked_by_product = {}
-        idx = 0
-        
         start_time = report_date + relativedelta(months=-1, hour=14, minute=0, second=0, microsecond=0) + relativedelta(months=-1, 
                                          day=get_last_business_day_of_month((report_date + relativedelta(months=-1)).year, 
                                                                             (report_date + relativedelta(months=-1)).month))
@@ -294,10 +300,6 @@ def reports(request):
         end_time = report_date + relativedelta(months=-1, hour=14, minute=0, second=0, microsecond=0) + relativedelta(day=get_last_business_day_of_month(report_date.year, 
                                                                           report_date.month))
         late_report_time = add_business_days(start_time, 5)
-        for product in products:
-            under_stocked_by_product[idx] = 0
-            over_stocked_by_product[idx] = 0
-            idx += 1
 
         soh_on_time_count = 0
         soh_late_count = 0
@@ -329,41 +331,13 @@ def reports(request):
                     'data': facility.name},
                    {'data': last_report_date,
                     'cell_class': soh_reporting_cell_class}]
-            idx = 0
             for product in products:
-                cell_class = ''
-                if view_type == 'inventory':
-                    mos = facility.stock_on_hand(product.sms_code, report_date + relativedelta(months=-1, hour=14, minute=0, second=0, microsecond=0))
-                    if mos == None:
-                        cell_class = 'insufficient_data'
-                        mos = 'No data'
-                    elif mos == 0:
-                        cell_class = 'zero_count'
-                    elif mos < settings.MONTHS_OF_STOCK_MIN:
-                        cell_class = 'under_min'
-                        under_stocked_by_product[idx] = under_stocked_by_product[idx] + 1
-                        print under_stocked_by_product[idx] 
-                    elif mos > settings.MONTHS_OF_STOCK_MAX:                   
-                        cell_class = 'exceeds_max'
-                        over_stocked_by_product[idx] = over_stocked_by_product[idx] + 1
-                else:
-                    mos = facility.months_of_stock(product.sms_code, report_date + relativedelta(months=-1, hour=14, minute=0, second=0, microsecond=0))
-                    if mos == None:
-                        cell_class = 'insufficient_data'
-                        mos = 'Insufficient data'
-                    elif mos == 0:
-                        cell_class = 'zero_count'
-                    elif mos < settings.MONTHS_OF_STOCK_MIN:
-                        cell_class = 'under_min'
-                        under_stocked_by_product[idx] = under_stocked_by_product[idx] + 1
-                        print under_stocked_by_product[idx] 
-                    elif mos > settings.MONTHS_OF_STOCK_MAX:                   
-                        cell_class = 'exceeds_max'
-                        over_stocked_by_product[idx] = over_stocked_by_product[idx] + 1
-                
+                mos = stock.get(facility, product)
+                cell_class = _stock_cell_class(mos)
+                if mos == None:
+                    mos = 'No data' if view_type == 'inventory' else 'Insufficient data'
                 row.append({'data': mos,
                             'cell_class': cell_class})
-                idx += 1
     
             stock_data_table.append(row)
     
@@ -382,17 +356,17 @@ def reports(request):
         not_reporting_row = [{},{},{'data': 'Not reported this period',
                                     'cell_class': "soh_not_reported"},{'data':'%d out of %d (%d%%)' % (soh_not_reported_count, facilities.count(), float(soh_not_reported_count) / float(facilities.count()) * 100.0 ),
                                     'cell_class': "soh_not_reported"},{},{},{},{},{}]
-        idx = 0
         for product in products:
+            under_stocked = under_stocked_by_product[product.sms_code]
+            over_stocked = over_stocked_by_product[product.sms_code]
             if facilities.count():
-                understock_percentage = float(under_stocked_by_product[idx]) / float(facilities.count()) * 100.0
-                overstock_percentage = float(over_stocked_by_product[idx]) / float(facilities.count()) * 100.0
+                understock_percentage = float(under_stocked) / float(facilities.count()) * 100.0
+                overstock_percentage = float(over_stocked) / float(facilities.count()) * 100.0
             else:
                 understock_percentage = 0
                 overstock_percentage = 0
-            understock_row.append({'data': '%d (%d%%)' % (under_stocked_by_product[idx], understock_percentage)})
-            overstock_row.append({'data': '%d (%d%%)' % (over_stocked_by_product[idx], overstock_percentage)})
-            idx += 1
+            understock_row.append({'data': '%d (%d%%)' % (under_stocked, understock_percentage)})
+            overstock_row.append({'data': '%d (%d%%)' % (over_stocked, overstock_percentage)})
         if view_type == 'months_of_stock':
             stock_data_table.append(understock_row)
             stock_data_table.append(overstock_row)
@@ -401,7 +375,7 @@ def reports(request):
         stock_data_table.append(not_reporting_row)
         stock_data_tables.append([stock_header_row, stock_data_table])
         i += 1
-        products = Product.objects.all()[i * number_of_products_to_display:(i + 1) * number_of_products_to_display]
+        products = all_products[i * number_of_products_to_display:(i + 1) * number_of_products_to_display]
     
     # supervision table
     number_supervised = 0
@@ -758,6 +732,17 @@ def note_history(request, facility_id):
                                'facility': facility}, 
                               context_instance=RequestContext(request))
 
+def _stock_cell_class(value, levels=True):
+    if value == None:
+        return 'insufficient_data'
+    elif value == 0:
+        return 'zero_count'
+    elif levels and value < settings.MONTHS_OF_STOCK_MIN:
+        return 'under_min'
+    elif levels and value > settings.MONTHS_OF_STOCK_MAX:
+        return 'exceeds_max'
+    return ''
+
 @login_required
 def facilities_index(request, view_type='inventory'):
     now = datetime.now()
@@ -800,8 +785,15 @@ def facilities_index(request, view_type='inventory'):
 
     stock_data_tables = []
     number_of_products_to_display = 6
-    products = Product.objects.all()[0:number_of_products_to_display]
+    all_products = list(Product.objects.all())
+    products = all_products[0:number_of_products_to_display]
     i = 0
+    if view_type == "inventory":
+        stock = stock_matrix(facilities, all_products,
+                             stock_on_hand_window(report_date + relativedelta(months=-1)))
+    else:
+        stock = months_of_stock_matrix(facilities, all_products,
+                                       report_date + relativedelta(months=-1))
 
     while products:
         data_table = [] 
@@ -836,37 +828,19 @@ def facilities_index(request, view_type='inventory'):
                    {'link': reverse('logistics_project.apps.ilsgateway.views.facilities_detail', args=[facility.id]),
                     'data': facility.name}]
             for product in products:
-                if view_type=="inventory":
-                    quantity = facility.stock_on_hand(product.sms_code, report_date + relativedelta(months=-1))                
-                    cell_class = ''
-                    if quantity == None:
-                        cell_class = 'insufficient_data'
-                        quantity = 'No data'
-                    elif quantity == 0:
-                        cell_class = 'zero_count'
-                        
-                    row.append({'data': quantity,
-                                'cell_class': cell_class})
-                elif view_type == "months_of_stock":
-                    quantity = facility.months_of_stock(product.sms_code, report_date + relativedelta(months=-1))
-                    cell_class = ''
-                    if quantity == None:
-                        cell_class = 'insufficient_data'
-                        quantity = 'Insufficient data'
-                    elif quantity == 0:
-                        cell_class = 'zero_count'
-                    elif quantity < settings.MONTHS_OF_STOCK_MIN:
-                        cell_class = 'under_min'                    
-                    elif quantity > settings.MONTHS_OF_STOCK_MAX:                   
-                        cell_class = 'exceeds_max'
-                    row.append({'data': quantity,
-                                'cell_class': cell_class})
+                quantity = stock.get(facility, product)
+                # stock levels are only highlighted in months of stock
+                cell_class = _stock_cell_class(quantity, levels=(view_type == "months_of_stock"))
+                if quantity == None:
+                    quantity = 'No data' if view_type == "inventory" else 'Insufficient data'
+                row.append({'data': quantity,
+                            'cell_class': cell_class})
     
             data_table.append(row)
             counter += 1
         stock_data_tables.append([header_row, data_table])
         i += 1
-        products = Product.objects.all()[i * number_of_products_to_display:(i + 1) * number_of_products_to_display]
+        products = all_products[i * number_of_products_to_display:(i + 1) * number_of_products_to_display]
 
                      
     return render_to_response("facilities_list.html", 
@@ -1047,11 +1021,13 @@ def facilities_detail(request, facility_id,view_type='inventory'):
     breadcrumbs = [[f.parent.parent.name], [f.parent.name, ''], [f.name, ''], [_('Facility Detail')] ]  
     
     product_counts = []
-    for product in Product.objects.all():
+    if view_type == 'months_of_stock':
+        mos_by_cell = months_of_stock([f], [p.sms_code for p in products])
+    for product in products:
         if view_type == 'inventory':
             product_counts.append([product.name, f.stock_on_hand(product.sms_code)])
         elif view_type == 'months_of_stock':
-            product_counts.append([product.name, f.months_of_stock(product.sms_code)])
+            product_counts.append([product.name, mos_by_cell[(f.id, product.sms_code)]])
     
     if request.method == 'POST': 
         form = NoteForm(request.POST) 
@@ -1,10 +1,9 @@
 from __future__ import absolute_import
 from datetime import datetime, timedelta
-from django.db.models.expressions import F
 from alerts import Alert
 from logistics.models import StockRequest, SupplyPoint,\
-    SupplyPointType, ProductStock, StockRequestStatus
-from django.db.models.aggregates import Max
+    SupplyPointType, ProductStock, StockRequestStatus, Product
+from django.db.models.aggregates import Max, Count
 from django.core.urlresolvers import reverse
 from logistics.util import config
 from logistics.decorators import place_in_request
@@ -33,6 +32,93 @@ class ProductStockAlert(Alert):
     def product(self):
         return self._product
 
+class HSAStockSnapshot(object):
+    """
+    The HSA stock levels, pending requests and commodity counts below a
+    location, each loaded in one query the first time an alert asks for
+    them. The alerts are all generated in the same request, so they share
+    one snapshot (see hsa_snapshot) rather than each going back to the
+    database for every HSA.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self._supply_points = None
+        self._products = None
+        self._stocks = None
+        self._pending = None
+        self._commodity_counts = None
+
+    @property
+    def supply_points(self):
+        """
+        {supply point id: supply point} for the HSAs
+        """
+        if self._supply_points is None:
+            self._supply_points = dict((sp.pk, sp) for sp in \
+                hsa_supply_points_below(self.location).select_related('supplied_by', 'location'))
+        return self._supply_points
+
+    def _hsas(self):
+        return hsa_supply_points_below(self.location).values('pk')
+
+    @property
+    def stocks(self):
+        """
+        {(supply point id, product id): (quantity, is active, emergency order level)}
+        """
+        if self._stocks is None:
+            self._stocks = dict(((sp, p), (qty, active, eol)) for sp, p, qty, active, eol in \
+                ProductStock.objects.filter(supply_point__in=self._hsas())\
+                    .values_list('supply_point', 'product', 'quantity', 'is_active',
+                                 'product__emergency_order_level'))
+        return self._stocks
+
+    @property
+    def pending(self):
+        """
+        (supply point id, product id, status, is emergency) of the HSAs' 
+        pending requests
+        """
+        if self._pending is None:
+            self._pending = list(StockRequest.pending_requests()\
+                .filter(supply_point__in=self._hsas()).order_by('pk')\
+                .values_list('supply_point', 'product', 'status', 'is_emergency'))
+        return self._pending
+
+    @property
+    def commodity_counts(self):
+        """
+        {hsa contact: number of commodities they manage}
+        """
+        if self._commodity_counts is None:
+            self._commodity_counts = dict((c, c.commodity_count) for c in \
+                hsas_below(self.location).select_related('supply_point')\
+                    .annotate(commodity_count=Count('commodities')))
+        return self._commodity_counts
+
+    def product(self, product_id):
+        if self._products is None:
+            self._products = Product.objects.in_bulk(list(set([p for sp, p in self.stocks] + \
+                                                              [r[1] for r in self.pending])))
+        return self._products[product_id]
+
+    def stock(self, supply_point_id, product_id):
+        """
+        Same as SupplyPoint.stock: 0 if the HSA has no stock of the product
+        """
+        return self.stocks.get((supply_point_id, product_id), (0, None, None))[0]
+
+def hsa_snapshot(request):
+    """
+    The HSAStockSnapshot for the request's location, made once per request.
+    """
+    snapshot = getattr(request, "_hsa_stock_snapshot", None)
+    if snapshot is None or snapshot.location != request.location:
+        snapshot = HSAStockSnapshot(request.location)
+        request._hsa_stock_snapshot = snapshot
+    return snapshot
+
 @place_in_request()
 def health_center_stockout(request):
     sps = facility_supply_points_below(request.location)
@@ -49,13 +135,11 @@ class HealthCenterUnableResupplyStockoutAlert(ProductStockAlert):
 
 @place_in_request()
 def health_center_unable_resupply_stockout(request):
-    r = []
-    hsas = hsa_supply_points_below(request.location)
-    for s in StockRequest.pending_requests().filter(supply_point__in=hsas,
-                                                    status=StockRequestStatus.STOCKED_OUT):
-        if s.supply_point.stock(s.product) == 0:
-            r += [HealthCenterUnableResupplyStockoutAlert(s.supply_point, s.product)]
-    return r
+    snapshot = hsa_snapshot(request)
+    return [HealthCenterUnableResupplyStockoutAlert(snapshot.supply_points[sp],
+                                                    snapshot.product(p)) \
+            for sp, p, status, is_emergency in snapshot.pending \
+            if status == StockRequestStatus.STOCKED_OUT and snapshot.stock(sp, p) == 0]
 
 class HealthCenterUnableResupplyEmergencyAlert(ProductStockAlert):
 
@@ -67,12 +151,11 @@ class HealthCenterUnableResupplyEmergencyAlert(ProductStockAlert):
 
 @place_in_request()
 def health_center_unable_resupply_emergency(request):
-    hsas = hsa_supply_points_below(request.location)
-    return [HealthCenterUnableResupplyEmergencyAlert(s.supply_point, s.product)\
-            for s in StockRequest.pending_requests()\
-                            .filter(is_emergency=True,
-                                    status=StockRequestStatus.STOCKED_OUT,
-                                    supply_point__in=hsas)]
+    snapshot = hsa_snapshot(request)
+    return [HealthCenterUnableResupplyEmergencyAlert(snapshot.supply_points[sp],
+                                                     snapshot.product(p)) \
+            for sp, p, status, is_emergency in snapshot.pending \
+            if is_emergency and status == StockRequestStatus.STOCKED_OUT]
     
 
 class NonReportingHSAAlert(Alert):
@@ -103,14 +186,12 @@ def hsa_below_emergency_quantity(request):
     '''
     This query finds HSA/product pairs where the product is below emergency level but there are no pending requests.
     '''
-    hsas = hsa_supply_points_below(request.location)
-    r = []
-    for p in ProductStock.objects.filter(is_active=True,
-            supply_point__in=hsas,
-            quantity__lte = F('product__emergency_order_level')):
-        if not StockRequest.pending_requests().filter(product=p.product, supply_point=p.supply_point).exists():
-            r += [HSABelowEmergencyQuantityAlert(p.supply_point, p.product)]
-    return r
+    snapshot = hsa_snapshot(request)
+    pending = set((sp, p) for sp, p, status, is_emergency in snapshot.pending)
+    return [HSABelowEmergencyQuantityAlert(snapshot.supply_points[sp], snapshot.product(p)) \
+            for (sp, p), (quantity, is_active, emergency_level) in sorted(snapshot.stocks.items()) \
+            if is_active and quantity is not None and emergency_level is not None \
+            and quantity <= emergency_level and (sp, p) not in pending]
 
 
 class LateReportingAlert(Alert):
@@ -149,7 +230,8 @@ def late_reporting_receipt(request):
                                            supply_point__in=hsas,
                                            status=StockRequestStatus.APPROVED)\
                     .values('supply_point').annotate(last_response=Max('responded_on'))
-    alerts = [LateReportingAlert(SupplyPoint.objects.get(pk=val["supply_point"]), val["last_response"]) \
+    supply_points = hsa_snapshot(request).supply_points
+    alerts = [LateReportingAlert(supply_points[val["supply_point"]], val["last_response"]) \
               for val in bad_reqs]
     return alerts
 
@@ -171,9 +253,9 @@ def hsas_no_supervision(request):
 
 @place_in_request()
 def hsas_no_products(request):
-    hsas = hsas_below(request.location)
+    counts = hsa_snapshot(request).commodity_counts
     return [Alert(config.Alerts.HSA_NO_PRODUCTS % {"hsa": hsa.name}, _hsa_url(hsa.supply_point)) \
-                  for hsa in hsas.all() if hsa.commodities.count() == 0]
+                  for hsa in sorted(counts, key=lambda hsa: hsa.pk) if counts[hsa] == 0]
     
 def _facility_url(supply_point):
     return reverse("malawi_facility", args=[supply_point.code])
@@ -0,0 +1,52 @@
+import time
+from datetime import datetime
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from logistics.models import Product
+from logistics_project.apps.malawi.nag import receipt_warnings
+from logistics_project.apps.malawi.nagbench import generate_receipt_data,\
+    create_receipt_data, naive_tiers
+from logistics_project.apps.malawi.util import get_facility_supply_points
+
+class Command(BaseCommand):
+    help = "Time the receipt nag queries on generated data. Nothing is kept: " \
+           "the data is generated in a transaction that is rolled back."
+    option_list = BaseCommand.option_list + (
+        make_option('--hsas', type='int', default=10000,
+                    help='How many HSAs to generate'),
+        make_option('--facility', default=None,
+                    help='The code of the facility to add the HSAs to (default: the first one)'),
+        make_option('--compare', action='store_true', default=False,
+                    help='Also time the old per request scan and check the results match'),
+    )
+
+    @transaction.commit_manually
+    def handle(self, *args, **options):
+        try:
+            facilities = get_facility_supply_points().order_by('pk')
+            if options['facility']:
+                facilities = facilities.filter(code=options['facility'])
+            if not facilities or not Product.objects.exists():
+                raise CommandError("This needs a facility and a product to generate data with")
+            now = datetime.utcnow()
+            data = generate_receipt_data(options['hsas'], now)
+            start = time.time()
+            ids = create_receipt_data(data, facilities[0], Product.objects.order_by('pk')[0])
+            print "generated %s HSAs in %.3fs" % (options['hsas'], time.time() - start)
+
+            # everything nag_hsas_rec does short of sending the messages
+            start = time.time()
+            warnings = receipt_warnings(now)
+            print "receipt nags: %.3fs (%s)" % \
+                (time.time() - start, ", ".join("%s" % len(w['hsas']) for w in warnings))
+            if options['compare']:
+                start = time.time()
+                naive = naive_tiers(*(data + (now,)))
+                print "per request scan: %.3fs" % (time.time() - start)
+                hsas = dict((sp, hsa) for hsa, sp in ids.items())
+                tiers = tuple(set(hsas[sp.pk] for sp in w['hsas'] if sp.pk in hsas) \
+                              for w in warnings)
+                print "results match" if naive == tiers else "RESULTS DIFFER"
+        finally:
+            transaction.rollback()
@@ -0,0 +1,27 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from dimagi.utils.dates import DateSpan
+from logistics_project.apps.malawi import reportstore
+from logistics_project.utils.parallel import processes_allowed
+
+class Command(BaseCommand):
+    args = "[slug [startdate enddate]]"
+    help = "Compute and store the monitoring reports (or one report, with its dates " \
+           "as YYYY-MM-DD), with LOGISTICS_PARALLEL_BREAKDOWNS processes"
+
+    def handle(self, *args, **options):
+        if len(args) not in (0, 1, 3):
+            raise CommandError("Usage: malawi_publish_reports %s" % self.args)
+        with processes_allowed():
+            if not args:
+                count = reportstore.publish_all()
+            else:
+                datespan = None
+                if len(args) == 3:
+                    try:
+                        datespan = DateSpan(*[datetime.strptime(d, "%Y-%m-%d") for d in args[1:]])
+                    except ValueError:
+                        raise CommandError("The dates should look like 2012-01-31")
+                reportstore.publish(args[0], datespan)
+                count = 1
+        print "published %s reports" % count
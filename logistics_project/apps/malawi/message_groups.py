@@ -1,14 +1,13 @@
 # This file defines functions used to generate message groups.
 from django.db.models.query_utils import Q
 from logistics_project.apps.malawi.util import hsa_supply_points_below
+from logistics_project.apps.hierarchy.utils import supply_point_ids_below
 from rapidsms.contrib.locations.models import Location
 from rapidsms.models import Contact
 
 
 def below_location(location):
-    return {location.name: Q(supply_point__location=location) |
-                           Q(supply_point__supplied_by__location=location) | 
-                           Q(supply_point__supplied_by__supplied_by__location=location)}
+    return {location.name: Q(supply_point__in=supply_point_ids_below(location))}
 
 
 def by_district():
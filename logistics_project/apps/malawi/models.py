@@ -1,3 +1,49 @@
-# stub models file
+from datetime import datetime
+from django.db import models
 
+class StoredReport(models.Model):
+    """
+    A rendered monitoring report. Each time a report is computed for a
+    datespan a new version is stored alongside the old ones, and the 
+    latest version is what gets served (see reportstore.py). Reports 
+    that always show current data have no dates.
+    """
+    slug = models.CharField(max_length=100)
+    startdate = models.DateField(null=True, blank=True)
+    enddate = models.DateField(null=True, blank=True)
+    version = models.PositiveIntegerField()
+    body = models.TextField()
+    computed_at = models.DateTimeField(default=datetime.utcnow)
 
+    class Meta:
+        unique_together = ("slug", "startdate", "enddate", "version")
+
+    def __unicode__(self):
+        return "%s (%s - %s) v%s" % (self.slug, self.startdate, self.enddate, self.version)
+
+class SCMgrCheckpoint(models.Model):
+    """
+    How far an SCMgr site's export has got: the sequence number of the
+    last chunk committed, and the newest month and facility code in the
+    chunks so far.
+    """
+    site = models.CharField(max_length=100, unique=True)
+    sequence = models.PositiveIntegerField(default=0)
+    high_water_date = models.DateField(null=True, blank=True)
+    high_water_facility = models.CharField(max_length=20, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return "%s: chunk %s" % (self.site, self.sequence)
+
+    def to_dict(self):
+        high_water = None
+        if self.high_water_date:
+            high_water = [self.high_water_date.year, self.high_water_date.month,
+                          self.high_water_facility]
+        return {"site": self.site,
+                "sequence": self.sequence,
+                "high_water": high_water}
+
+# don't remove this - it's where signals get instantiated
+from logistics_project.apps.malawi import signals
@@ -3,6 +3,7 @@ import logging
 import os
 from rapidsms.contrib.locations.models import Location
 from rapidsms.models import Contact
+from django.db.models import Max
 from logistics.models import ProductReport, ProductReportType, SupplyPoint,\
     SupplyPointType, NagRecord, ContactRole, StockRequest, StockRequestStatus
 from celery.schedules import crontab
@@ -12,6 +13,7 @@ from logistics.const import Reports
 from logistics.util import config
 from static.malawi.config import Messages
 from logistics_project.apps.malawi.util import hsa_supply_points_below
+from logistics_project.utils.connections import default_connections
 
 DAYS_BETWEEN_FIRST_AND_SECOND_WARNING = 3
 DAYS_BETWEEN_SECOND_AND_THIRD_WARNING = 2
@@ -28,12 +30,12 @@ def get_non_reporting_hsas(since, report_code=Reports.SOH, location=None):
     """
     Get all HSAs who haven't reported since a passed in date
     """
-    hsas = set(hsa_supply_points_below(location))
-    reporters = set(x.supply_point for x in \
-                    ProductReport.objects.filter(report_type__code=report_code,
-                                                 report_date__range=[since,
-                                                                     datetime.utcnow()]))
-    return hsas - reporters
+    hsas = hsa_supply_points_below(location)
+    reporters = ProductReport.objects.filter(supply_point__in=hsas,
+                                             report_type__code=report_code,
+                                             report_date__range=[since,
+                                                                 datetime.utcnow()])
+    return set(hsas.exclude(pk__in=reporters.values('supply_point')))
 
 def get_stock_requests_pending_pickup(before=None):
     reqs = StockRequest.objects.filter(status=StockRequestStatus.APPROVED)
@@ -44,124 +46,150 @@ def get_stock_requests_pending_pickup(before=None):
 def get_hsas_pending_pickup(before=None):
     return set([x.supply_point for x in get_stock_requests_pending_pickup(before)])
                      
-def nag_hsas_soh(since, location=None):
-    """
-    Send non-reporting HSAs a predefined nag message.  
-    Notify their supervisor if they've been sufficiently delinquent.
-    """
-    # everyone who didn't report
-    hsas = get_non_reporting_hsas(since, Reports.SOH, location)
-    
-    nags_in_range = NagRecord.objects.filter\
-                        (report_date__range=[since, datetime.utcnow()],
-                         nag_type=Reports.SOH)
-
-    # empty init
-    hsa_first_warnings = set(())
-    hsa_second_warnings = set(())
-    hsa_third_warnings = set(())
-    hsa_fourth_warnings = set(())
-    now = datetime.utcnow()
-    
-    # only send nags if we're past the nag period
-    if now > since + timedelta(days=WARNING_DAYS):
-        # everyone who didn't report - people who have gotten at least 1 nag in the period
-        hsa_first_warnings = hsas - set(x.supply_point for x in nags_in_range)
-        
-    if now > since + timedelta(days=WARNING_DAYS + DAYS_BETWEEN_FIRST_AND_SECOND_WARNING):
-        # everyone who hasn't gotten a nag level 2 or higher, but has gotten a first
-        hsa_second_warnings = hsas.intersection(x.supply_point for x in \
-                                                nags_in_range.filter(warning=1)) - \
-                              set(x.supply_point for x in nags_in_range.filter(warning__gte=2))
-
-    if now > since + timedelta(days=WARNING_DAYS + DAYS_BETWEEN_FIRST_AND_SECOND_WARNING +\
-                               DAYS_BETWEEN_SECOND_AND_THIRD_WARNING):
-        # everyone who hasn't gotten a nag level 3 or higher, but has gotten a second.
-        hsa_third_warnings = hsas.intersection(x.supply_point for x in \
-                                               nags_in_range.filter(warning=2)) - \
-                             set(x.supply_point for x in nags_in_range.filter(warning__gte=3))
-    if now > since + timedelta(days=WARNING_DAYS + DAYS_BETWEEN_FIRST_AND_SECOND_WARNING +\
-                               DAYS_BETWEEN_SECOND_AND_THIRD_WARNING + DAYS_BETWEEN_THIRD_AND_FOURTH_WARNING):
-        
-        # everyone who hasn't gotten a nag level 4 or higher, but has gotten a third.
-        hsa_fourth_warnings = hsas.intersection(x.supply_point for x in \
-                                                nags_in_range.filter(warning=3)) - \
-                              set(x.supply_point for x in nags_in_range.filter(warning__gte=4))
-
-    # These should never fail.
-    assert(hsa_first_warnings.intersection(hsa_second_warnings) == set())
-    assert(hsa_second_warnings.intersection(hsa_third_warnings) == set())
-    assert(hsa_third_warnings.intersection(hsa_fourth_warnings) == set())
-
-    warnings = [
-            {'hsas': hsa_first_warnings,
-             'number': 1,
+def _soh_warnings():
+    return [{'number': 1,
              'days': WARNING_DAYS,
              'code': Reports.SOH,
              'message': config.Messages.HSA_NAG_FIRST,
              'flag_supervisor' : False},
-            {'hsas': hsa_second_warnings,
-             'number': 2,
+            {'number': 2,
              'days': DAYS_BETWEEN_FIRST_AND_SECOND_WARNING,
              'code': Reports.SOH,
              'message': config.Messages.HSA_NAG_SECOND,
              'flag_supervisor': False},
-            {'hsas': hsa_third_warnings,
-             'number': 3,
+            {'number': 3,
              'days': DAYS_BETWEEN_SECOND_AND_THIRD_WARNING,
              'code': Reports.SOH,
              'message': config.Messages.HSA_NAG_THIRD,
              'flag_supervisor': True,
              'supervisor_message': config.Messages.HSA_SUPERVISOR_NAG},
-            {'hsas': hsa_fourth_warnings,
-             'number': 4,
+            {'number': 4,
              'days': DAYS_BETWEEN_THIRD_AND_FOURTH_WARNING,
              'code': Reports.SOH,
              'message': config.Messages.HSA_NAG_THIRD, # Same messages
              'flag_supervisor': True,
-             'supervisor_message': config.Messages.HSA_SUPERVISOR_NAG}
-            ]
-    
-    send_nag_messages(warnings)
+             'supervisor_message': config.Messages.HSA_SUPERVISOR_NAG}]
 
-def nag_hsas_rec():
+def next_soh_warning(level, since, now):
     """
-    Send non-reporting HSAs a predefined nag message.  Notify their supervisor if they've been
-    sufficiently delinquent.
+    The number of the SOH warning due to an HSA that hasn't reported since
+    <since>, given the highest warning it's been sent in that time (0 if
+    none), or None if it isn't due one yet.
+    """
+    # an HSA gets a warning once the period is WARNING_DAYS old, and each 
+    # following one when the gap after the previous warning has passed
+    due = since + timedelta(days=WARNING_DAYS)
+    for number, gap in ((1, 0),
+                        (2, DAYS_BETWEEN_FIRST_AND_SECOND_WARNING),
+                        (3, DAYS_BETWEEN_SECOND_AND_THIRD_WARNING),
+                        (4, DAYS_BETWEEN_THIRD_AND_FOURTH_WARNING)):
+        due += timedelta(days=gap)
+        if level == number - 1:
+            return number if now > due else None
+    return None
+
+def nag_hsas_soh(since, location=None):
+    """
+    Send non-reporting HSAs a predefined nag message.  
+    Notify their supervisor if they've been sufficiently delinquent.
+    
+    The location can also be a list of locations.
     """
     now = datetime.utcnow()
+    # everyone who didn't report
+    hsas = get_non_reporting_hsas(since, Reports.SOH, location)
+    
+    # the highest warning each of them has had this period
+    levels = dict(NagRecord.objects.filter(supply_point__in=[hsa.pk for hsa in hsas],
+                                           report_date__range=[since, now],
+                                           nag_type=Reports.SOH)\
+                      .values_list('supply_point').annotate(Max('warning')).order_by())
+    
+    warnings = _soh_warnings()
+    for w in warnings:
+        w['hsas'] = set()
+    for hsa in hsas:
+        number = next_soh_warning(levels.get(hsa.pk, 0), since, now)
+        if number:
+            warnings[number - 1]['hsas'].add(hsa)
+    
+    send_nag_messages(warnings)
+
+def receipt_nag_tiers(pending, last_receipts, nags, now):
+    """
+    Work out which HSAs get which receipt nag.
     
+    pending is a list of (supply point id, responded on) for the approved
+    stock requests waiting for pickup. last_receipts maps supply point ids
+    to the date of their latest receipt report, and nags maps them to the
+    (date, warning) of their receipt nags, both going back as far as the
+    oldest pending request.
+    
+    Returns the sets of supply point ids due a first, second and third
+    warning.
+    """
     # send the first nag WARNING_DAYS days after the order ready message
-    def _get_hsas_ready_for_nag(warning_time, extra_filter_params={}):
-        
-        reqs = get_stock_requests_pending_pickup(warning_time)
-
-        hsa_warnings = []
-        for req in reqs:
-            if not NagRecord.objects.filter(supply_point=req.supply_point,
-                                        report_date__range=[req.responded_on,now],
-                                        nag_type=Reports.REC,
-                                        **extra_filter_params).count():
-
-                if not ProductReport.objects.filter(report_type__code=Reports.REC,
-                                                 report_date__range=[req.responded_on,
-                                                                     now]).exists():
-                    hsa_warnings.append(req.supply_point)
-        return set(hsa_warnings)
-        
     first_warning_time = now - timedelta(days=WARNING_DAYS)
-    hsa_first_warnings = _get_hsas_ready_for_nag(first_warning_time)
-    
     second_warning_time = first_warning_time - timedelta(days=REC_DAYS_BETWEEN_FIRST_AND_SECOND_WARNING)
-    hsa_second_warnings = _get_hsas_ready_for_nag(second_warning_time, 
-                                                  extra_filter_params={"warning__gte": 2}) \
-                                - hsa_first_warnings
-    
     third_warning_time = second_warning_time - timedelta(days=REC_DAYS_BETWEEN_SECOND_AND_THIRD_WARNING)
-    hsa_third_warnings = _get_hsas_ready_for_nag(third_warning_time, 
-                                                 extra_filter_params={"warning__gte": 3}) \
-                                - hsa_first_warnings - hsa_second_warnings
+    
+    first, second, third = set(), set(), set()
+    for supply_point, responded_on in pending:
+        if responded_on > first_warning_time:
+            continue
+        last_receipt = last_receipts.get(supply_point)
+        if last_receipt is not None and last_receipt >= responded_on:
+            continue
+        # the highest warning sent since the order was ready
+        level = max([warning for date, warning in nags.get(supply_point, []) \
+                     if date >= responded_on] or [0])
+        if level == 0:
+            first.add(supply_point)
+        if level < 2 and responded_on <= second_warning_time:
+            second.add(supply_point)
+        if level < 3 and responded_on <= third_warning_time:
+            third.add(supply_point)
+    second -= first
+    third -= first | second
+    return first, second, third
 
+def pending_receipt_index(now):
+    """
+    The approved stock requests waiting for pickup that are old enough to
+    nag about, joined to their HSAs' receipts and receipt nags since the
+    oldest of them, in the (pending, last_receipts, nags) shapes
+    receipt_nag_tiers takes. Three queries, however many requests there
+    are.
+    """
+    reqs = get_stock_requests_pending_pickup(now - timedelta(days=WARNING_DAYS))
+    pending = list(reqs.values_list('supply_point', 'responded_on'))
+    if not pending:
+        return [], {}, {}
+    since = min(responded_on for supply_point, responded_on in pending)
+    supply_points = reqs.values('supply_point')
+    last_receipts = dict(ProductReport.objects.filter(supply_point__in=supply_points,
+                                                      report_type__code=Reports.REC,
+                                                      report_date__range=[since, now])\
+                             .values_list('supply_point').annotate(Max('report_date'))\
+                             .order_by())
+    nags = {}
+    for supply_point, date, warning in NagRecord.objects.filter\
+            (supply_point__in=supply_points, nag_type=Reports.REC,
+             report_date__range=[since, now])\
+            .values_list('supply_point', 'report_date', 'warning'):
+        nags.setdefault(supply_point, []).append((date, warning))
+    return pending, last_receipts, nags
+
+def receipt_warnings(now):
+    """
+    The receipt nags due, as warnings for send_nag_messages.
+    """
+    pending, last_receipts, nags = pending_receipt_index(now)
+    first, second, third = receipt_nag_tiers(pending, last_receipts, nags, now)
+    hsas = SupplyPoint.objects.in_bulk(first | second | third)
+    hsa_first_warnings = set(hsas[id] for id in first)
+    hsa_second_warnings = set(hsas[id] for id in second)
+    hsa_third_warnings = set(hsas[id] for id in third)
 
     warnings = [
             {'hsas': hsa_first_warnings,
@@ -185,41 +213,67 @@ def nag_hsas_rec():
              'flag_supervisor': True,
              'supervisor_message': config.Messages.HSA_RECEIPT_SUPERVISOR_NAG}
             ]
-    send_nag_messages(warnings)
+    return warnings
+
+def nag_hsas_rec():
+    """
+    Send non-reporting HSAs a predefined nag message.  Notify their supervisor if they've been
+    sufficiently delinquent.
+    """
+    send_nag_messages(receipt_warnings(datetime.utcnow()))
 
 
 def send_nag_messages(warnings):
+    """
+    Send out warnings, each a dict with a set of HSA supply points to nag. 
+    The contacts and supervisors of all the HSAs are looked up together,
+    so this makes the same number of queries however many HSAs there are
+    (apart from saving a NagRecord for each nag sent).
+    """
+    hsa_ids = set(hsa.pk for w in warnings for hsa in w["hsas"])
+    if not hsa_ids:
+        return
+    now = datetime.utcnow()
+    # don't nag anyone we've nagged for the same reason in the last 24 hours
+    recently_nagged = set(NagRecord.objects.filter\
+                            (supply_point__in=hsa_ids,
+                             nag_type__in=set(w['code'] for w in warnings),
+                             report_date__gt=now - timedelta(hours=MIN_NAG_INTERVAL))\
+                            .values_list('supply_point', 'nag_type'))
+    contacts = {}
+    for contact in Contact.objects.filter(supply_point__in=hsa_ids).order_by('id'):
+        contacts.setdefault(contact.supply_point_id, contact)
+    supervisors = {}
+    if any(w["flag_supervisor"] for w in warnings if w["hsas"]):
+        for supervisor in Contact.objects.filter\
+                (is_active=True, role__code=config.Roles.HSA_SUPERVISOR,
+                 supply_point__in=set(hsa.supplied_by_id for w in warnings \
+                                      for hsa in w["hsas"])):
+            supervisors.setdefault(supervisor.supply_point_id, []).append(supervisor)
+    connections = default_connections(contacts.values() + 
+                                      [s for l in supervisors.values() for s in l])
+    
     for w in warnings:
         for hsa in w["hsas"]:
-            
-            previous_nags = NagRecord.objects.filter(supply_point=hsa, nag_type=w['code'])\
-                                .order_by('-report_date')
-            if previous_nags:
-                # don't nag anyone we've nagged for the same reason in the last 24 hours
-                last_nag_date = previous_nags[0].report_date
-                if datetime.utcnow() - last_nag_date < timedelta(hours=MIN_NAG_INTERVAL):
-                    continue 
-            try:
-                
-                contact = Contact.objects.get(supply_point=hsa)
-                send_message(contact.default_connection, w["message"] % {'hsa': contact.name, 'days': w['days']})
-                NagRecord(supply_point=hsa, warning=w["number"],nag_type=w['code']).save()
-            except Contact.DoesNotExist:
+            if (hsa.pk, w['code']) in recently_nagged:
+                continue
+            contact = contacts.get(hsa.pk)
+            if contact is None:
                 logging.error("Contact does not exist for HSA: %s" % hsa.name)
                 continue
+            send_message(connections.get(contact.pk), w["message"] % {'hsa': contact.name, 'days': w['days']})
+            NagRecord(supply_point=hsa, warning=w["number"],nag_type=w['code']).save()
             if w["flag_supervisor"]:
-                for supervisor in Contact.objects.filter(is_active=True,
-                                                         role=ContactRole.objects.get(code=config.Roles.HSA_SUPERVISOR),
-                                                         supply_point=hsa.supplied_by):
-                    send_message(supervisor.default_connection, w["supervisor_message"] % { 'hsa': contact.name})
+                for supervisor in supervisors.get(hsa.supplied_by_id, []):
+                    send_message(connections.get(supervisor.pk), w["supervisor_message"] % { 'hsa': contact.name})
                 
 
 def nag_hsas_ept():
     # For the EPT group, nag them so that they report at least every 30 days
     since = datetime.utcnow() - timedelta(days=30-WARNING_DAYS)
-    locs = [Location.objects.get(name=loc) for loc in config.Groups.GROUPS[config.Groups.EPT]]
-    for l in locs:
-        nag_hsas_soh(since, l)
+    locs = list(Location.objects.filter(name__in=config.Groups.GROUPS[config.Groups.EPT]))
+    if locs:
+        nag_hsas_soh(since, locs)
 
 def nag_hsas_em():
     # For the EM group, nag them to report around a (configurable) day of month
@@ -234,6 +288,6 @@ def nag_hsas_em():
         except ValueError:
             since.replace(year=datetime.utcnow().year - 1, month=12)
     
-    locs = [Location.objects.get(name=loc) for loc in config.Groups.GROUPS[config.Groups.EM]]
-    for l in locs:
-        nag_hsas_soh(since, l)
\ No newline at end of file
+    locs = list(Location.objects.filter(name__in=config.Groups.GROUPS[config.Groups.EM]))
+    if locs:
+        nag_hsas_soh(since, locs)
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+Generated data for timing the receipt nags (see the malawi_nag_benchmark
+command and tests/receiptnags.py).
+
+generate_receipt_data makes pending requests, receipts and receipt nags
+for any number of HSAs as plain tuples, and create_receipt_data writes
+them to the database so that nag.pending_receipt_index can be timed on
+them. naive_tiers is how nag_hsas_rec used to work the tiers out, a scan
+per request per warning, to check the results against.
+"""
+from datetime import timedelta
+from random import Random
+from logistics.const import Reports
+from logistics.models import SupplyPoint, ProductReport, ProductReportType,\
+    NagRecord, StockRequest, StockRequestStatus
+from logistics.util import config
+from logistics_project.apps.malawi.nag import receipt_nag_tiers, WARNING_DAYS,\
+    REC_DAYS_BETWEEN_FIRST_AND_SECOND_WARNING, REC_DAYS_BETWEEN_SECOND_AND_THIRD_WARNING
+
+def generate_receipt_data(hsas, now, seed=0):
+    """
+    A random set of pending requests, receipts and receipt nags for
+    <hsas> HSAs, numbered from 1. Requests are (hsa, responded on),
+    receipts (hsa, date) and nags (hsa, date, warning).
+    """
+    random = Random(seed)
+    pending, receipts, nags = [], [], []
+    for sp in xrange(1, hsas + 1):
+        responded_on = now - timedelta(days=random.uniform(0, 20))
+        pending.append((sp, responded_on))
+        if random.random() < 0.3:
+            receipts.append((sp, responded_on + timedelta(days=random.uniform(-5, 5))))
+        for warning in range(1, random.randint(0, 3) + 1):
+            nags.append((sp, responded_on + timedelta(days=random.uniform(-2, 10)), warning))
+    receipts = [r for r in receipts if r[1] <= now]
+    nags = [n for n in nags if n[1] <= now]
+    return pending, receipts, nags
+
+def create_receipt_data(data, facility, product):
+    """
+    Save generate_receipt_data's data as HSAs supplied by facility, with
+    approved stock requests and receipts of product, and receipt nags.
+    Returns {generated hsa number: supply point id}.
+    """
+    pending, receipts, nags = data
+    rec = ProductReportType.objects.get(code=Reports.REC)
+    ids = {}
+    for hsa, responded_on in pending:
+        sp = SupplyPoint.objects.create(name="benchmark hsa %s" % hsa,
+                                        code="%s%05d" % (facility.code, hsa),
+                                        type=config.hsa_supply_point_type(),
+                                        location=facility.location, supplied_by=facility)
+        ids[hsa] = sp.pk
+        StockRequest.objects.create(supply_point=sp, product=product,
+                                    status=StockRequestStatus.APPROVED,
+                                    requested_on=responded_on - timedelta(days=1),
+                                    responded_on=responded_on)
+    for hsa, date in receipts:
+        ProductReport.objects.create(supply_point_id=ids[hsa], product=product,
+                                     report_type=rec, quantity=10, message=None,
+                                     report_date=date)
+    for hsa, date, warning in nags:
+        nag = NagRecord.objects.create(supply_point_id=ids[hsa], warning=warning,
+                                       nag_type=Reports.REC)
+        # the report date is filled in on save
+        NagRecord.objects.filter(pk=nag.pk).update(report_date=date)
+    return ids
+
+def indexed_tiers(pending, receipts, nags, now):
+    """
+    receipt_nag_tiers of generate_receipt_data's data, indexed the way
+    nag.pending_receipt_index does it.
+    """
+    since = min(responded_on for sp, responded_on in pending)
+    last_receipts = {}
+    for sp, date in receipts:
+        if date >= since and date > last_receipts.get(sp, since - timedelta(days=1)):
+            last_receipts[sp] = date
+    by_sp = {}
+    for sp, date, warning in nags:
+        if date >= since:
+            by_sp.setdefault(sp, []).append((date, warning))
+    return receipt_nag_tiers(pending, last_receipts, by_sp, now)
+
+def naive_tiers(pending, receipts, nags, now):
+    """
+    How nag_hsas_rec used to work it out, a scan of the reports and nags
+    per request per warning (minus the bug where receipts from any HSA
+    counted).
+    """
+    first_warning_time = now - timedelta(days=WARNING_DAYS)
+    second_warning_time = first_warning_time - timedelta(days=REC_DAYS_BETWEEN_FIRST_AND_SECOND_WARNING)
+    third_warning_time = second_warning_time - timedelta(days=REC_DAYS_BETWEEN_SECOND_AND_THIRD_WARNING)
+    def ready(warning_time, min_warning):
+        ret = set()
+        for sp, responded_on in pending:
+            if responded_on > warning_time:
+                continue
+            if [n for n in nags if n[0] == sp and responded_on <= n[1] <= now \
+                and n[2] >= min_warning]:
+                continue
+            if [r for r in receipts if r[0] == sp and responded_on <= r[1] <= now]:
+                continue
+            ret.add(sp)
+        return ret
+    first = ready(first_warning_time, 1)
+    second = ready(second_warning_time, 2) - first
+    third = ready(third_warning_time, 3) - first - second
+    return first, second, third
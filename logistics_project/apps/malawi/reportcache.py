@@ -0,0 +1,101 @@
+"""
+Caching of the per district numbers behind the monitoring reports.
+
+Each district's numbers are keyed by a generation of that district,
+which goes up whenever a supply point in it is saved, or a product
+report or stock request is saved for one (see signals.py). A new report only means working out
+its own district again, and entries can be kept for a long time without
+going stale. Within a process, the numbers are also kept in memory so
+paging between reports doesn't even go to the cache.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from logistics.models import SupplyPoint
+from logistics_project.apps.hierarchy.models import SupplyPointClosure,\
+    LocationClosure
+from logistics_project.utils import generations
+
+# the most district numbers kept in memory before starting over
+MAX_MEMO_SIZE = 64
+
+_memo = {}
+
+def _generation_key(location_id):
+    return "malawi-report-generation-%s" % location_id
+
+def get_generation(location_id):
+    return generations.get_generation(_generation_key(location_id),
+                                      settings.LOGISTICS_REPORT_CACHE_TIMEOUT)
+
+def bump_generation(location_id):
+    generations.bump_generation(_generation_key(location_id))
+
+def locations_above(supply_point_id):
+    """
+    The ids of the locations whose reports include a supply point: those
+    of the supply points above it in the supplied_by chain, and the
+    locations above its own.
+    """
+    ids = set(SupplyPointClosure.objects.filter(descendant=supply_point_id)\
+                .values_list('ancestor__location', flat=True))
+    ids.update(LocationClosure.objects.filter\
+                (descendant__in=SupplyPoint.objects.filter(pk=supply_point_id)\
+                                    .values('location'))\
+                .values_list('ancestor', flat=True))
+    ids.discard(None)
+    return ids
+
+def locations_placed_above(location_id, supplied_by_id):
+    """
+    locations_above for a supply point at location_id supplied by
+    supplied_by_id, whether or not it is saved there yet.
+    """
+    ids = set(SupplyPointClosure.objects.filter(descendant=supplied_by_id)\
+                .values_list('ancestor__location', flat=True))
+    ids.update(LocationClosure.objects.filter(descendant=location_id)\
+                .values_list('ancestor', flat=True))
+    ids.discard(None)
+    return ids
+
+def supply_point_changed(supply_point_id):
+    for location_id in locations_above(supply_point_id):
+        bump_generation(location_id)
+
+def supply_point_saved(supply_point, previous_locations=()):
+    """
+    A supply point being added, deactivated or moved changes the
+    denominators of the reports it is counted in, so bump those, and the
+    previous_locations it was counted in before a move.
+    """
+    ids = locations_placed_above(supply_point.location_id, supply_point.supplied_by_id)
+    for location_id in ids.union(previous_locations):
+        bump_generation(location_id)
+
+def _key(district, datespan, facility):
+    return "malawi-district-numbers-%s-%s-%s-%s-%s" % \
+        (district.pk, get_generation(district.pk), datespan.startdate.isoformat(),
+         datespan.enddate.isoformat(), facility)
+
+def cached_district_numbers(calc, districts, datespan, facility=False):
+    """
+    calc(districts, datespan, facility), a list of numbers in the order of
+    the districts, with each district's worked out at most once per
+    generation of the district. The ones that are missing are passed to
+    calc together.
+    """
+    keys = [_key(d, datespan, facility) for d in districts]
+    found = dict((key, _memo[key]) for key in keys if key in _memo)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        found.update(cache.get_many(missing))
+    todo = [(d, key) for d, key in zip(districts, keys) if key not in found]
+    if todo:
+        numbers = calc([d for d, key in todo], datespan, facility)
+        for (d, key), n in zip(todo, numbers):
+            cache.set(key, n, settings.LOGISTICS_REPORT_CACHE_TIMEOUT)
+            found[key] = n
+    if len(_memo) + len(keys) > MAX_MEMO_SIZE:
+        _memo.clear()
+    for key in keys:
+        _memo[key] = found[key]
+    return [found[key] for key in keys]
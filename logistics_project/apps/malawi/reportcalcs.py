@@ -1,3 +1,4 @@
+from copy import deepcopy
 from datetime import timedelta
 from django.conf import settings
 from django.template.loader import render_to_string
@@ -7,7 +8,9 @@ from logistics.reports import ReportingBreakdown, calc_percentage
 from logistics_project.apps.malawi.util import get_em_districts, hsa_supply_points_below,\
     get_ept_districts, facility_supply_points_below
 from django.utils.datastructures import SortedDict
+from logistics_project.utils.parallel import parallel_map
 from collections import defaultdict
+from logistics_project.apps.malawi.reportcache import cached_district_numbers
 
 PRODUCT_CODES = ['co', 'or', 'zi', 'la', 'lb', 'dm', 'pa'] # Amox?
 
@@ -26,6 +29,53 @@ def _update_dict(totals, to_add):
         else:
             totals[k] = v
 
+# the per product numbers each district report shows
+DISTRICT_PRODUCT_KEYS = ['no_stockouts_pct_p', 'no_stockouts_p', 'totals_p', 
+                         'avg_req_time', 'discrepancies_pct_p', 'discrepancies_avg_p',
+                         'discrepancies_tot_p', 'discrepancies_p', 
+                         'stockouts_duration_p', 'stockouts_avg_duration_p']
+# and the ones that get added up into the group totals
+TOTALED_PRODUCT_KEYS = ['stockouts_duration_p', 'no_stockouts_p', 'discrepancies_p', 
+                        'discrepancies_tot_p', 'filled_orders_p', 'totals_p']
+
+def _district_numbers(args):
+    """
+    The numbers for one district, as plain data so that they can come 
+    back from another process.
+    """
+    district, datespan, facility = args
+    if facility:
+        bd = ReportingBreakdown(facility_supply_points_below(district),
+                                datespan, MNE=True)
+    else:
+        bd = ReportingBreakdown(hsa_supply_points_below(district),
+                               datespan, MNE=True)
+    numbers = {"totals": _to_totals(bd), "req_times": bd.req_times}
+    for key in set(DISTRICT_PRODUCT_KEYS + TOTALED_PRODUCT_KEYS):
+        numbers[key] = getattr(bd, key)
+    return numbers
+
+def _all_district_numbers(districts, datespan, facility):
+    """
+    The numbers for each district, in the order of the districts passed
+    in. With LOGISTICS_PARALLEL_BREAKDOWNS set, batch jobs work them out
+    with that many processes at once (see parallel_map).
+    """
+    return parallel_map(_district_numbers, [(d, datespan, facility) for d in districts],
+                        settings.LOGISTICS_PARALLEL_BREAKDOWNS)
+
+def _add_district(reports, totals, district, numbers):
+    # the numbers are shared with the report cache and both of these add
+    # to them in place, so work from a copy
+    numbers = deepcopy(numbers)
+    reports[district] = numbers["totals"]
+    _update_dict(totals, reports[district])
+    totals['req_times'] += numbers['req_times']
+    for key in DISTRICT_PRODUCT_KEYS:
+        reports[district][key] = numbers[key]
+    for key in TOTALED_PRODUCT_KEYS:
+        _update_dict(totals[key], numbers[key])
+
 def _district_breakdown(datespan, facility=False):
     """
     Breakdown of reporting information, by group and district
@@ -34,8 +84,9 @@ def _district_breakdown(datespan, facility=False):
     ept = get_ept_districts()
     em_reports = SortedDict()
     ept_reports = SortedDict()
-    em_totals = defaultdict(lambda: 0)
-    ept_totals = defaultdict(lambda: 0)
+    # int, not a lambda, so that these can be pickled into the cache
+    em_totals = defaultdict(int)
+    ept_totals = defaultdict(int)
     em_totals.update({'no_stockouts_pct_p':{},
                       'no_stockouts_p':{},
                       'stockouts_duration_p':{},
@@ -59,60 +110,14 @@ def _district_breakdown(datespan, facility=False):
                        'filled_orders_p': {},
                        'req_times':[]})
 
-    for d in em:
-        if facility:
-            bd = ReportingBreakdown(facility_supply_points_below(d),
-                                    datespan, MNE=True)
-        else:
-            bd = ReportingBreakdown(hsa_supply_points_below(d),
-                                   datespan, MNE=True)
-        em_reports[d] = _to_totals(bd)
-        _update_dict(em_totals, em_reports[d])
-        em_totals['req_times'] += bd.req_times
-        em_reports[d]['no_stockouts_pct_p'] = bd.no_stockouts_pct_p
-        em_reports[d]['no_stockouts_p'] = bd.no_stockouts_p
-        em_reports[d]['totals_p'] = bd.totals_p
-        em_reports[d]['avg_req_time'] = bd.avg_req_time
-        em_reports[d]['discrepancies_pct_p'] = bd.discrepancies_pct_p
-        em_reports[d]['discrepancies_avg_p'] = bd.discrepancies_avg_p
-        em_reports[d]['discrepancies_tot_p'] = bd.discrepancies_tot_p
-        em_reports[d]['discrepancies_p'] = bd.discrepancies_p
-        em_reports[d]['stockouts_duration_p'] = bd.stockouts_duration_p
-
-        em_reports[d]['stockouts_avg_duration_p'] = bd.stockouts_avg_duration_p
-        _update_dict(em_totals['stockouts_duration_p'], bd.stockouts_duration_p)
-        _update_dict(em_totals['no_stockouts_p'], bd.no_stockouts_p)
-        _update_dict(em_totals['discrepancies_p'], bd.discrepancies_p)
-        _update_dict(em_totals['discrepancies_tot_p'], bd.discrepancies_tot_p)
-        _update_dict(em_totals['filled_orders_p'], bd.filled_orders_p)
-        _update_dict(em_totals['totals_p'], bd.totals_p)
-
-    for d in ept:
-        if facility:
-            bd = ReportingBreakdown(facility_supply_points_below(d),
-                                    datespan, MNE=True)
-        else:
-            bd = ReportingBreakdown(hsa_supply_points_below(d),
-                                   datespan, MNE=True)
-        ept_reports[d] = _to_totals(bd)
-        _update_dict(ept_totals, ept_reports[d])
-        ept_totals['req_times'] += bd.req_times
-        ept_reports[d]['no_stockouts_pct_p'] = bd.no_stockouts_pct_p
-        ept_reports[d]['no_stockouts_p'] = bd.no_stockouts_p
-        ept_reports[d]['totals_p'] = bd.totals_p
-        ept_reports[d]['discrepancies_pct_p'] = bd.discrepancies_pct_p
-        ept_reports[d]['discrepancies_avg_p'] = bd.discrepancies_avg_p
-        ept_reports[d]['discrepancies_tot_p'] = bd.discrepancies_tot_p
-        ept_reports[d]['discrepancies_p'] = bd.discrepancies_p
-        ept_reports[d]['avg_req_time'] = bd.avg_req_time
-        ept_reports[d]['stockouts_duration_p'] = bd.stockouts_duration_p
-        ept_reports[d]['stockouts_avg_duration_p'] = bd.stockouts_avg_duration_p
-        _update_dict(ept_totals['no_stockouts_p'], bd.no_stockouts_p)
-        _update_dict(ept_totals['stockouts_duration_p'], bd.stockouts_duration_p)
-        _update_dict(ept_totals['discrepancies_p'], bd.discrepancies_p)
-        _update_dict(ept_totals['discrepancies_tot_p'], bd.discrepancies_tot_p)
-        _update_dict(ept_totals['filled_orders_p'], bd.filled_orders_p)
-        _update_dict(ept_totals['totals_p'], bd.totals_p)
+    em, ept = list(em), list(ept)
+    # all the districts at once, so they can all be worked on in parallel.
+    # merging them back in district order keeps the totals the same.
+    numbers = cached_district_numbers(_all_district_numbers, em + ept, datespan, facility)
+    for d, n in zip(em, numbers[:len(em)]):
+        _add_district(em_reports, em_totals, d, n)
+    for d, n in zip(ept, numbers[len(em):]):
+        _add_district(ept_reports, ept_totals, d, n)
 
     for p in ept_totals['stockouts_duration_p']:
         ept_totals['stockouts_avg_duration_p'][p] = timedelta(seconds=sum(ept_totals['stockouts_duration_p'][p])/len(ept_totals['stockouts_duration_p'][p]))
@@ -0,0 +1,106 @@
+"""
+Precomputed monitoring reports.
+
+Computing a monitoring report can take a long time, so a periodic task
+(see tasks.py) renders every report for the current and previous month
+and stores the html as a new StoredReport version. The monitoring view
+serves the latest stored version and only falls back to computing the
+report itself, cached for a while, for locations and datespans that
+haven't been stored.
+"""
+from datetime import datetime, timedelta
+from django.core.cache import cache
+from dimagi.utils.dates import DateSpan
+from logistics_project.apps.malawi.models import StoredReport
+from logistics_project.apps.malawi.reports import ReportDefinition, \
+    ReportInstance, REPORT_SLUGS, REPORTS_CURRENT
+
+# how many versions of each report to hold on to
+KEEP_VERSIONS = 3
+
+# how long the reports that are computed on demand are cached
+ON_DEMAND_TIMEOUT = 60 * 15
+
+def month_datespan(year, month):
+    start = datetime(year, month, 1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return DateSpan(start, end)
+
+def report_datespans(now=None):
+    """
+    The datespans reports are precomputed for: the current month and
+    the one before it.
+    """
+    now = now or datetime.utcnow()
+    last_month = now.replace(day=1) - timedelta(days=1)
+    return [month_datespan(now.year, now.month),
+            month_datespan(last_month.year, last_month.month)]
+
+def _dates(slug, datespan):
+    if slug in REPORTS_CURRENT or datespan is None:
+        return None, None
+    return datespan.startdate.date(), datespan.enddate.date()
+
+def latest(slug, datespan):
+    """
+    The latest StoredReport for a report and datespan, or None.
+    """
+    startdate, enddate = _dates(slug, datespan)
+    stored = StoredReport.objects.filter(slug=slug, startdate=startdate,
+                                         enddate=enddate).order_by('-version')[:1]
+    return stored[0] if stored else None
+
+def on_demand_body(instance):
+    """
+    The body of a report instance that isn't stored, worked out at most
+    once every ON_DEMAND_TIMEOUT seconds for the same report, datespan
+    and location.
+    """
+    slug = instance.definition.slug
+    startdate, enddate = _dates(slug, instance.datespan)
+    key = "malawi-report-body-%s-%s-%s-%s" % (slug, startdate, enddate,
+                                              getattr(instance.location, "pk", None))
+    body = cache.get(key)
+    if body is None:
+        body = instance.get_report_body()
+        cache.set(key, body, ON_DEMAND_TIMEOUT)
+    return body
+
+def store(slug, datespan, body):
+    """
+    Save body as the newest version of a report, dropping all but the
+    last KEEP_VERSIONS versions.
+    """
+    startdate, enddate = _dates(slug, datespan)
+    previous = latest(slug, datespan)
+    stored = StoredReport.objects.create(slug=slug, startdate=startdate, enddate=enddate,
+                                         version=previous.version + 1 if previous else 1,
+                                         body=body)
+    StoredReport.objects.filter(slug=slug, startdate=startdate, enddate=enddate,
+                                version__lte=stored.version - KEEP_VERSIONS).delete()
+    return stored
+
+def publish(slug, datespan):
+    """
+    Compute a report and store it.
+    """
+    instance = ReportInstance(ReportDefinition(slug), datespan)
+    return store(slug, datespan, instance.get_report_body())
+
+def publish_all(now=None):
+    """
+    Compute and store every implemented report for the datespans in
+    report_datespans. Reports with current data are only done once.
+    Returns the number of reports stored.
+    """
+    count = 0
+    for slug in REPORT_SLUGS:
+        if not ReportDefinition(slug).is_implemented:
+            continue
+        datespans = report_datespans(now)
+        if slug in REPORTS_CURRENT:
+            datespans = datespans[:1]
+        for datespan in datespans:
+            publish(slug, datespan)
+            count += 1
+    return count
@@ -0,0 +1,183 @@
+"""
+Loading stock reports sent over from SCMgr (see deploy/scmgr).
+
+Each row is [closing balance, average monthly consumption, stocked out,
+facility code, [year, month], product name, product id], in SCMgr's
+codes. Rows are handled a chunk at a time: the facilities, products and
+reports already loaded for a chunk are looked up up front, and the whole
+chunk is saved in one transaction.
+
+Sites using the export protocol (deploy/scmgr/export.py) number their
+chunks and send them compressed. Each site has an SCMgrCheckpoint of the
+last chunk committed and the newest month and facility in it, so an
+interrupted export picks up where it left off and a chunk sent twice is
+only loaded once.
+"""
+import bz2
+import gzip
+import struct
+import zlib
+from cStringIO import StringIO
+from datetime import datetime, date
+from django.conf import settings
+from django.db import transaction
+from logistics.models import SupplyPoint, Product, ProductReport
+from static.malawi.scmgr_const import PRODUCT_CODE_MAP, HEALTH_FACILITY_MAP
+from logistics_project.apps.malawi.models import SCMgrCheckpoint
+
+class ChunkStats(object):
+
+    def __init__(self):
+        self.processed = 0
+        self.known = 0
+        self.blank = 0
+        self.unknown = 0
+
+    @property
+    def total(self):
+        return self.processed + self.known + self.blank + self.unknown
+
+    def __unicode__(self):
+        return "%s new, %s already loaded, %s blank, %s unknown" % \
+            (self.processed, self.known, self.blank, self.unknown)
+
+    def __str__(self):
+        return unicode(self).encode("utf-8")
+
+def _codes(row):
+    # (facility code, product sms code, report date), or None if the
+    # row is for a facility or product we don't track
+    facility = HEALTH_FACILITY_MAP.get(row[3])
+    product = PRODUCT_CODE_MAP.get(row[6])
+    if facility is None or product is None:
+        return None
+    return facility, product.lower(), datetime(year=row[4][0], month=row[4][1], day=1)
+
+def _load_rows(rows):
+    stats = ChunkStats()
+    coded = [(row, _codes(row)) for row in rows]
+    keys = [codes for row, codes in coded if codes is not None]
+    facilities, products = {}, {}
+    if keys:
+        facilities = dict((sp.code, sp) for sp in SupplyPoint.objects.filter\
+                                            (code__in=set(k[0] for k in keys)))
+        products = dict((p.sms_code, p) for p in Product.objects.filter\
+                                            (sms_code__in=set(k[1] for k in keys)))
+    loaded = set()
+    if facilities and products:
+        loaded = set(ProductReport.objects.filter\
+                        (supply_point__in=[sp.pk for sp in facilities.values()],
+                         product__in=[p.pk for p in products.values()],
+                         report_date__in=set(k[2] for k in keys))\
+                        .values_list('supply_point', 'product', 'report_date'))
+    for row, codes in coded:
+        if codes is None or codes[0] not in facilities or codes[1] not in products:
+            stats.unknown += 1
+            continue
+        facility, product, date = facilities[codes[0]], products[codes[1]], codes[2]
+        key = (facility.pk, product.pk, date)
+        if key in loaded:
+            stats.known += 1
+            continue
+        quantity, is_stocked_out = row[0], row[2]
+        if not quantity and not is_stocked_out:
+            # If stock quantity is 0, but stockout not indicated, this line wasn't filled in.
+            stats.blank += 1
+            continue
+        facility.report_stock(product, quantity, date=date)
+        loaded.add(key)
+        stats.processed += 1
+    return stats
+
+@transaction.commit_on_success
+def load_chunk(rows):
+    """
+    Save the stock reports in rows that haven't been loaded yet. Rows
+    already loaded are skipped, so sending the same rows twice is safe.
+    Returns the ChunkStats of the chunk.
+    """
+    return _load_rows(rows)
+
+def load(rows, chunk_size=None):
+    """
+    Load rows LOGISTICS_SCMGR_CHUNK_SIZE at a time, returning the stats
+    of each chunk.
+    """
+    chunk_size = chunk_size or settings.LOGISTICS_SCMGR_CHUNK_SIZE
+    return [load_chunk(rows[i:i + chunk_size]) for i in range(0, len(rows), chunk_size)]
+
+class SequenceError(Exception):
+    """
+    A chunk came in ahead of the next one expected from its site.
+    """
+    pass
+
+def _gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+DECOMPRESSORS = {"bz2": bz2.decompress,
+                 "gzip": _gunzip,
+                 "": lambda data: data}
+
+def decompress(data, encoding):
+    """
+    Raises ValueError for an unknown encoding or data that doesn't
+    decompress.
+    """
+    try:
+        decompressor = DECOMPRESSORS[encoding or ""]
+    except KeyError:
+        raise ValueError("Unknown encoding %s" % encoding)
+    try:
+        return decompressor(data)
+    except (IOError, EOFError, zlib.error, struct.error) as e:
+        raise ValueError("Can't decompress the chunk (%s)" % e)
+
+def check_rows(rows):
+    """
+    Raise ValueError unless rows is a list of rows in the shape described
+    at the top of this module.
+    """
+    if not isinstance(rows, list):
+        raise ValueError("The chunk isn't a list of rows")
+    for row in rows:
+        if not isinstance(row, list) or len(row) != 7 or \
+           not isinstance(row[0], (int, long, float, type(None))) or \
+           not isinstance(row[3], basestring) or not isinstance(row[6], basestring) or \
+           not isinstance(row[4], list) or len(row[4]) != 2 or \
+           not all(isinstance(n, (int, long)) for n in row[4]) or \
+           not 1 <= row[4][1] <= 12:
+            raise ValueError("Badly formed row: %r" % (row,))
+
+def get_checkpoint(site):
+    try:
+        return SCMgrCheckpoint.objects.get(site=site)
+    except SCMgrCheckpoint.DoesNotExist:
+        return SCMgrCheckpoint(site=site)
+
+@transaction.commit_on_success
+def commit_chunk(site, sequence, rows):
+    """
+    Load a site's chunk and move its checkpoint past it, all in one 
+    transaction. Chunks that were already committed are acknowledged 
+    without being loaded again. Returns the site's checkpoint and the
+    ChunkStats of the chunk, or None if it was already committed. Raises
+    ValueError if the rows aren't well formed.
+    """
+    check_rows(rows)
+    checkpoint = get_checkpoint(site)
+    if sequence <= checkpoint.sequence:
+        return checkpoint, None
+    if sequence != checkpoint.sequence + 1:
+        raise SequenceError("Expected chunk %s from %s but got %s" % \
+                            (checkpoint.sequence + 1, site, sequence))
+    stats = _load_rows(rows)
+    if rows:
+        year, month, facility = max((r[4][0], r[4][1], r[3]) for r in rows)
+        high_water = (date(year, month, 1), facility)
+        if checkpoint.high_water_date is None or \
+           high_water > (checkpoint.high_water_date, checkpoint.high_water_facility):
+            checkpoint.high_water_date, checkpoint.high_water_facility = high_water
+    checkpoint.sequence = sequence
+    checkpoint.save()
+    return checkpoint, stats
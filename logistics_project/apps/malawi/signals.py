@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4 encoding=utf-8
+
+from django.db.models.signals import pre_save, post_save
+from logistics.models import ProductReport, StockRequest, SupplyPoint
+from logistics_project.apps.malawi.reportcache import supply_point_changed,\
+    supply_point_saved, locations_placed_above
+
+def invalidate_report_cache(sender, instance, **kwargs):
+    supply_point_changed(instance.supply_point_id)
+
+def remember_report_locations(sender, instance, **kwargs):
+    # where the supply point was counted before this save, in case it moves
+    instance._previous_report_locations = set()
+    for location_id, supplied_by_id in SupplyPoint.objects.filter(pk=instance.pk)\
+                                        .values_list('location', 'supplied_by'):
+        instance._previous_report_locations = locations_placed_above(location_id, supplied_by_id)
+
+def invalidate_supply_point_reports(sender, instance, **kwargs):
+    supply_point_saved(instance, getattr(instance, '_previous_report_locations', ()))
+
+post_save.connect(invalidate_report_cache, sender=ProductReport)
+post_save.connect(invalidate_report_cache, sender=StockRequest)
+pre_save.connect(remember_report_locations, sender=SupplyPoint)
+post_save.connect(invalidate_supply_point_reports, sender=SupplyPoint)
@@ -2,14 +2,18 @@
 # vim: ai ts=4 sts=4 et sw=4
 
 
+from collections import defaultdict
 from django.conf import settings
+from django.db.models.aggregates import Max
 from djtables import Table, Column
 from djtables.column import DateColumn
 from logistics_project.apps.registration.tables import list_commodities,\
     contact_edit_link
 from django.core.urlresolvers import reverse
 from django.template.defaultfilters import yesno
-from logistics.models import StockRequestStatus
+from logistics.models import StockRequestStatus, ProductStock
+from rapidsms.models import Contact
+from rapidsms.contrib.messagelog.models import Message
 
 
 class MalawiContactTable(Table):
@@ -31,33 +35,87 @@ class MalawiContactTable(Table):
     class Meta:
         order_by = 'supply_point__code'
 
+def with_stock_counts(hsas):
+    """
+    HSAs annotated with the number of products they're stocked out of,
+    as stocked_out, so that the HSA table can sort on it in the database.
+    """
+    return hsas.extra(select={"stocked_out": """
+        SELECT COUNT(*) FROM %(stock)s 
+        WHERE %(stock)s.supply_point_id = %(contact)s.supply_point_id 
+        AND %(stock)s.is_active = %%s AND %(stock)s.quantity = 0""" % \
+            {"stock": ProductStock._meta.db_table,
+             "contact": Contact._meta.db_table}},
+        select_params=(True,))
+
+def prefetch_hsa_details(hsas):
+    """
+    Set the rest of what the HSA table shows on each of a page of HSAs,
+    from three queries: emergency_count, adequate_count and 
+    overstocked_count, commodity_codes and last_message_date.
+    """
+    ids = [hsa.pk for hsa in hsas]
+    bands = defaultdict(lambda: [0, 0, 0])
+    for stock in ProductStock.objects.filter(is_active=True, quantity__gt=0,
+                                             supply_point__in=[hsa.supply_point_id for hsa in hsas])\
+                                     .select_related('product'):
+        counts = bands[stock.supply_point_id]
+        if stock.is_below_emergency_level():
+            counts[0] += 1
+        elif stock.is_in_adequate_supply():
+            counts[1] += 1
+        elif stock.is_overstocked():
+            counts[2] += 1
+    commodities = defaultdict(list)
+    for pk, code in Contact.objects.filter(pk__in=ids, commodities__isnull=False)\
+                            .order_by('commodities__name')\
+                            .values_list('pk', 'commodities__sms_code'):
+        commodities[pk].append(code)
+    last_messages = dict(Message.objects.filter(contact__in=ids).values_list('contact')\
+                                        .annotate(Max('date')).order_by())
+    for hsa in hsas:
+        hsa.emergency_count, hsa.adequate_count, hsa.overstocked_count = \
+            bands[hsa.supply_point_id]
+        hsa.commodity_codes = " ".join(commodities[hsa.pk]) or "None"
+        hsa.last_message_date = last_messages.get(hsa.pk)
+    return hsas
+
 class HSATable(Table):
+    """
+    Expects HSAs annotated by with_stock_counts. Everything else it shows
+    is loaded for the whole page at once by prefetch_hsa_details.
+    """
     facility = Column(value=lambda cell: cell.object.supply_point.supplied_by,
                       sortable=False)
     name     = Column(link=lambda cell: reverse("malawi_hsa", args=[cell.object.supply_point.code]))
     id = Column(value=lambda cell: cell.object.hsa_id,
                 sortable=False)
     commodities = Column(name="Responsible For These Commodities", 
-                         value=list_commodities,
+                         value=lambda cell: cell.object.commodity_codes,
                          sortable=False)
     stocked_out = Column(name="Products stocked out",
-                         value=lambda cell: cell.object.supply_point.stockout_count())
+                         value=lambda cell: cell.object.stocked_out)
     emergency = Column(name="Products in emergency",
-                         value=lambda cell: cell.object.supply_point.emergency_stock_count(),
+                         value=lambda cell: cell.object.emergency_count,
                          sortable=False)
     ok = Column(name="Products in adequate supply",
-                         value=lambda cell: cell.object.supply_point.adequate_supply_count(),
+                         value=lambda cell: cell.object.adequate_count,
                          sortable=False)
     overstocked = Column(name="Products overstocked",
-                         value=lambda cell: cell.object.supply_point.overstocked_count(),
+                         value=lambda cell: cell.object.overstocked_count,
                          sortable=False)
     last_seen = Column(name="Last message",
-                       value=lambda cell: cell.object.last_message.date.strftime("%b-%d-%Y") if cell.object.last_message else "n/a",
+                       value=lambda cell: cell.object.last_message_date.strftime("%b-%d-%Y") if cell.object.last_message_date else "n/a",
                        sortable=False)
     
     class Meta:
         order_by = 'supply_point__code'
 
+    @property
+    def rows(self):
+        hsas = prefetch_hsa_details(list(self.paginator.page(self._meta.page).object_list))
+        return [self._meta.row_class(self, hsa) for hsa in hsas]
+
 class MalawiLocationTable(Table):
     name     = Column()
     type = Column()
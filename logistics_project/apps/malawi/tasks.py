@@ -1,8 +1,26 @@
+import os
+import subprocess
+import sys
 from celery.schedules import crontab
-from celery.decorators import periodic_task
+from celery.decorators import periodic_task, task
 from logistics_project.apps.malawi.nag import nag_hsas_em, nag_hsas_ept, nag_hsas_rec
 from datetime import datetime
 from django.conf import settings
+from django.core.management import call_command
+
+MANAGE_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "manage.py")
+
+def _publish(*args):
+    """
+    Run malawi_publish_reports. A celery worker is a daemon process, which
+    isn't allowed the processes that work out the districts at once (see
+    logistics_project.utils.parallel), so when there are to be some the
+    command gets a process of its own.
+    """
+    if settings.LOGISTICS_PARALLEL_BREAKDOWNS > 1:
+        subprocess.check_call([sys.executable, MANAGE_PY, "malawi_publish_reports"] + list(args))
+    else:
+        call_command("malawi_publish_reports", *args)
 
 
 @periodic_task(run_every=crontab(hour="*", minute="1", day_of_week="*"))
@@ -11,6 +29,17 @@ def nag_hsas():
     nag_hsas_em()
     nag_hsas_rec()
 
+@periodic_task(run_every=crontab(hour="*", minute="20", day_of_week="*"))
+def publish_monitoring_reports():
+    _publish()
+
+@task
+def refresh_monitoring_report(slug, startdate, enddate):
+    if startdate and enddate:
+        _publish(slug, startdate.strftime("%Y-%m-%d"), enddate.strftime("%Y-%m-%d"))
+    else:
+        _publish(slug)
+
 @periodic_task(run_every=crontab(hour="*", minute="*", day_of_week="*"))
 def heartbeat():
     with open(settings.CELERY_HEARTBEAT_FILE, 'w') as f:
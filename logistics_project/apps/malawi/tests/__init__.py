@@ -1,11 +1,19 @@
 import unittest
+from logistics_project.apps.malawi.tests.alerts import *
 from logistics_project.apps.malawi.tests.approval import *
 from logistics_project.apps.malawi.tests.boot import *
 from logistics_project.apps.malawi.tests.createuser import *
 from logistics_project.apps.malawi.tests.nag import *
 from logistics_project.apps.malawi.tests.product import *
+from logistics_project.apps.malawi.tests.receiptnags import *
 from logistics_project.apps.malawi.tests.register import *
 from logistics_project.apps.malawi.tests.report import *
+from logistics_project.apps.malawi.tests.reportcache import *
+from logistics_project.apps.malawi.tests.reportcalcs import *
+from logistics_project.apps.malawi.tests.reportstore import *
 from logistics_project.apps.malawi.tests.roles import *
+from logistics_project.apps.malawi.tests.scmgr import *
+from logistics_project.apps.malawi.tests.sohnags import *
 from logistics_project.apps.malawi.tests.stockonhand import *
+from logistics_project.apps.malawi.tests.tables import *
 from logistics_project.apps.malawi.tests.transfer import *
@@ -0,0 +1,44 @@
+from django.test.client import RequestFactory
+from logistics.models import ProductStock
+from logistics.util import config
+from logistics_project.apps.malawi import alerts
+from logistics_project.apps.malawi.tests.base import MalawiTestBase
+from logistics_project.apps.malawi.tests.util import create_hsa, create_manager,\
+    report_stock
+
+class TestAlerts(MalawiTestBase):
+
+    def setUp(self):
+        super(TestAlerts, self).setUp()
+        self.hsa = create_hsa(self, "16175551000", "wendy", products="la lb zi")
+        ic = create_manager(self, "16175551001", "sally")
+        create_manager(self, "16175551004", "robert", config.Roles.HSA_SUPERVISOR)
+        create_manager(self, "16175551002", "peter", config.Roles.IMCI_COORDINATOR, "26")
+        create_manager(self, "16175551003", "ruth", config.Roles.DISTRICT_PHARMACIST, "26")
+        report_stock(self, self.hsa, "zi 10 la 15", [ic], "zi 190, la 345")
+        a = """
+           16175551001 > os 261601
+           16175551000 < %(hsa_notice)s
+           16175551003 < %(district)s
+           16175551002 < %(district)s
+           16175551001 < %(confirm)s
+        """ % {"confirm": config.Messages.HF_UNABLE_RESTOCK_EO %\
+                    {"reporter": "sally", "products": "zi, la"},
+               "hsa_notice": config.Messages.HSA_UNABLE_RESTOCK_ANYTHING % {"hsa": "wendy"},
+               "district": config.Messages.DISTRICT_UNABLE_RESTOCK_NORMAL  % \
+                    {"contact": "sally", "supply_point": "Ntaja", "products": "zi, la"}}
+        self.runScript(a)
+        ProductStock.objects.filter(supply_point=self.hsa.supply_point,
+                                    product__sms_code="zi").update(quantity=0)
+        self.request = RequestFactory().get("/")
+
+    def testSharedSnapshot(self):
+        stockouts = alerts.health_center_unable_resupply_stockout(self.request)
+        self.assertEqual([("wendy", "zi")], 
+                         [(a.supply_point.name, a.product.sms_code) for a in stockouts])
+        snapshot = alerts.hsa_snapshot(self.request)
+        # both requests are pending, so nothing is below emergency without one
+        self.assertEqual([], alerts.hsa_below_emergency_quantity(self.request))
+        self.assertEqual([], alerts.health_center_unable_resupply_emergency(self.request))
+        self.assertTrue(snapshot is alerts.hsa_snapshot(self.request))
+        self.assertEqual(3, snapshot.commodity_counts[self.hsa])
@@ -0,0 +1,86 @@
+import unittest
+from datetime import datetime, timedelta
+from logistics.const import Reports
+from logistics.models import Product, StockRequest, StockRequestStatus, NagRecord,\
+    SupplyPoint
+from logistics_project.apps.malawi.nag import nag_hsas_rec, pending_receipt_index,\
+    receipt_nag_tiers, WARNING_DAYS, REC_DAYS_BETWEEN_FIRST_AND_SECOND_WARNING
+from logistics_project.apps.malawi.tests.base import MalawiTestBase
+from logistics_project.apps.malawi.nagbench import generate_receipt_data,\
+    create_receipt_data, indexed_tiers, naive_tiers
+from logistics_project.apps.malawi.tests.util import create_hsa
+
+class TestReceiptNagTiers(unittest.TestCase):
+
+    def testMatchesPerRequestScan(self):
+        now = datetime.utcnow()
+        for seed in range(3):
+            data = generate_receipt_data(300, now, seed=seed)
+            self.assertEqual(naive_tiers(*(data + (now,))),
+                             indexed_tiers(*(data + (now,))))
+
+    def testReceiptFromAnotherHSADoesntCount(self):
+        now = datetime.utcnow()
+        responded_on = now - timedelta(days=WARNING_DAYS + 1)
+        first, second, third = indexed_tiers([(1, responded_on), (2, responded_on)],
+                                             [(2, now)], [], now)
+        self.assertEqual(set([1]), first)
+
+class TestNagHSAsRec(MalawiTestBase):
+
+    def setUp(self):
+        super(TestNagHSAsRec, self).setUp()
+        self.sp = create_hsa(self, "16175551000", "wendy").supply_point
+
+    def _approved(self, days_ago):
+        now = datetime.utcnow()
+        StockRequest.objects.create(supply_point=self.sp,
+                                    product=Product.objects.get(sms_code="zi"),
+                                    status=StockRequestStatus.APPROVED,
+                                    requested_on=now - timedelta(days=days_ago + 1),
+                                    responded_on=now - timedelta(days=days_ago))
+
+    def _days_pass(self, days):
+        # move the request and its nags back in time
+        for model, field in ((StockRequest, 'responded_on'), (NagRecord, 'report_date')):
+            for pk, date in model.objects.filter(supply_point=self.sp).values_list('pk', field):
+                model.objects.filter(pk=pk).update(**{field: date - timedelta(days=days)})
+
+    def _warnings(self):
+        return list(NagRecord.objects.filter(supply_point=self.sp, nag_type=Reports.REC)\
+                        .order_by('warning').values_list('warning', flat=True))
+
+    def testNotDueYet(self):
+        self._approved(0)
+        nag_hsas_rec()
+        self.assertEqual([], self._warnings())
+
+    def testEscalation(self):
+        self._approved(WARNING_DAYS + 1)
+        nag_hsas_rec()
+        self.assertEqual([1], self._warnings())
+
+        # nobody gets the same nag twice in a day
+        nag_hsas_rec()
+        self.assertEqual([1], self._warnings())
+
+        self._days_pass(REC_DAYS_BETWEEN_FIRST_AND_SECOND_WARNING)
+        nag_hsas_rec()
+        self.assertEqual([1, 2], self._warnings())
+
+    def testPickedUp(self):
+        self._approved(WARNING_DAYS + 1)
+        StockRequest.objects.filter(supply_point=self.sp)\
+            .update(status=StockRequestStatus.RECEIVED, received_on=datetime.utcnow())
+        nag_hsas_rec()
+        self.assertEqual([], self._warnings())
+
+    def testIndexMatchesPerRequestScan(self):
+        now = datetime.utcnow()
+        data = generate_receipt_data(50, now)
+        ids = create_receipt_data(data, SupplyPoint.objects.get(code="2616"),
+                                  Product.objects.get(sms_code="zi"))
+        hsas = dict((sp, hsa) for hsa, sp in ids.items())
+        tiers = receipt_nag_tiers(*(pending_receipt_index(now) + (now,)))
+        self.assertEqual(naive_tiers(*(data + (now,))),
+                         tuple(set(hsas[sp] for sp in t) for t in tiers))
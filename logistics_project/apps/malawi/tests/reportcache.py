@@ -0,0 +1,83 @@
+import unittest
+from datetime import datetime
+from dimagi.utils.dates import DateSpan
+from logistics.models import SupplyPoint
+from logistics_project.apps.malawi import reportcache
+from logistics_project.apps.malawi.tests.base import MalawiTestBase
+from logistics_project.apps.malawi.tests.util import create_hsa
+from logistics_project.apps.malawi.util import get_facility_supply_points
+
+class _District(object):
+    def __init__(self, pk):
+        self.pk = pk
+
+class TestCachedDistrictNumbers(unittest.TestCase):
+
+    def setUp(self):
+        reportcache._memo.clear()
+        self.calls = []
+        self.datespan = DateSpan(datetime(2011, 5, 1), datetime(2011, 5, 31))
+        self.districts = [_District(-1), _District(-2)]
+        for d in self.districts:
+            reportcache.bump_generation(d.pk)
+
+    def _calc(self, districts, datespan, facility):
+        self.calls.append(([d.pk for d in districts], facility))
+        return [{"district": d.pk, "facility": facility} for d in districts]
+
+    def _numbers(self, facility=False):
+        return reportcache.cached_district_numbers(self._calc, self.districts,
+                                                   self.datespan, facility)
+
+    def testComputedOnce(self):
+        first = self._numbers()
+        second = self._numbers()
+        self.assertEqual(first, second)
+        self.assertEqual([{"district": -1, "facility": False},
+                          {"district": -2, "facility": False}], first)
+        self.assertEqual([([-1, -2], False)], self.calls)
+
+    def testFacilityFlagKeptApart(self):
+        self._numbers()
+        self.assertEqual([{"district": -1, "facility": True},
+                          {"district": -2, "facility": True}], self._numbers(True))
+
+    def testOnlyChangedDistrictRecomputed(self):
+        self._numbers()
+        reportcache.bump_generation(-2)
+        self._numbers()
+        self.assertEqual([([-1, -2], False), ([-2], False)], self.calls)
+
+class TestSupplyPointGenerations(MalawiTestBase):
+
+    def _generations(self, location_ids):
+        return dict((l, reportcache.get_generation(l)) for l in location_ids)
+
+    def _assertBumped(self, before):
+        for location_id, generation in before.items():
+            self.assertNotEqual(generation, reportcache.get_generation(location_id))
+
+    def testRegisteredHSA(self):
+        facility = SupplyPoint.objects.get(code="2616")
+        before = self._generations(reportcache.locations_above(facility.pk))
+        self.assertTrue(before)
+        create_hsa(self, "16175551000", "wendy")
+        self._assertBumped(before)
+
+    def testDeactivatedHSA(self):
+        sp = create_hsa(self, "16175551000", "wendy").supply_point
+        before = self._generations(reportcache.locations_above(sp.pk))
+        sp.active = False
+        sp.save()
+        self._assertBumped(before)
+
+    def testMovedHSA(self):
+        sp = create_hsa(self, "16175551000", "wendy").supply_point
+        old = reportcache.locations_above(sp.pk)
+        other = [f for f in get_facility_supply_points() \
+                 if reportcache.locations_above(f.pk) - old][0]
+        before = self._generations(old | reportcache.locations_above(other.pk))
+        sp.location = other.location
+        sp.supplied_by = other
+        sp.save()
+        self._assertBumped(before)
@@ -0,0 +1,76 @@
+import os
+import unittest
+from collections import defaultdict
+from django.utils.datastructures import SortedDict
+from django.conf import settings
+from logistics_project.apps.malawi import reportcalcs
+from logistics_project.apps.malawi.reportcalcs import _add_district,\
+    _all_district_numbers, DISTRICT_PRODUCT_KEYS, TOTALED_PRODUCT_KEYS
+from logistics_project.utils import parallel
+from logistics_project.utils.parallel import processes_allowed
+
+def _numbers(on_time, stockouts):
+    numbers = {"totals": {"on_time": on_time}, "req_times": [on_time]}
+    for key in set(DISTRICT_PRODUCT_KEYS + TOTALED_PRODUCT_KEYS):
+        numbers[key] = {"co": stockouts}
+    return numbers
+
+class TestAddDistrict(unittest.TestCase):
+
+    def _merge(self, districts):
+        reports = SortedDict()
+        totals = defaultdict(int)
+        totals.update(dict((key, {}) for key in TOTALED_PRODUCT_KEYS))
+        totals["req_times"] = []
+        for d, n in districts:
+            _add_district(reports, totals, d, n)
+        return reports, totals
+
+    def testTotals(self):
+        reports, totals = self._merge([("a", _numbers(2, 1)), ("b", _numbers(3, 4))])
+        self.assertEqual(["a", "b"], reports.keys())
+        self.assertEqual(5, totals["on_time"])
+        self.assertEqual([2, 3], totals["req_times"])
+        self.assertEqual({"co": 5}, totals["no_stockouts_p"])
+        self.assertEqual({"co": 4}, reports["b"]["no_stockouts_p"])
+
+def _fake_district_numbers(args):
+    district, datespan, facility = args
+    return {"district": district, "pid": os.getpid()}
+
+class _DaemonProcess(object):
+    daemon = True
+
+class TestParallelDistricts(unittest.TestCase):
+
+    def setUp(self):
+        self._processes = settings.LOGISTICS_PARALLEL_BREAKDOWNS
+        self._numbers = reportcalcs._district_numbers
+        settings.LOGISTICS_PARALLEL_BREAKDOWNS = 2
+        reportcalcs._district_numbers = _fake_district_numbers
+
+    def tearDown(self):
+        settings.LOGISTICS_PARALLEL_BREAKDOWNS = self._processes
+        reportcalcs._district_numbers = self._numbers
+
+    def _numbers_for(self, districts):
+        numbers = _all_district_numbers(districts, None, False)
+        self.assertEqual(districts, [n["district"] for n in numbers])
+        return set(n["pid"] for n in numbers)
+
+    def testParallelInBatchJobs(self):
+        with processes_allowed():
+            pids = self._numbers_for(["a", "b", "c"])
+        self.assertFalse(os.getpid() in pids)
+
+    def testInProcessOtherwise(self):
+        self.assertEqual(set([os.getpid()]), self._numbers_for(["a", "b", "c"]))
+
+    def testNotFromDaemons(self):
+        current_process = parallel.current_process
+        parallel.current_process = lambda: _DaemonProcess()
+        try:
+            with processes_allowed():
+                self.assertEqual(set([os.getpid()]), self._numbers_for(["a", "b", "c"]))
+        finally:
+            parallel.current_process = current_process
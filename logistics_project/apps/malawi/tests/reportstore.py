@@ -0,0 +1,54 @@
+from datetime import datetime
+from django.test import TestCase
+from logistics_project.apps.malawi import reportstore
+from logistics_project.apps.malawi.models import StoredReport
+from logistics_project.apps.malawi.reports import ReportDefinition, ReportInstance
+
+class _CountingInstance(ReportInstance):
+    calls = 0
+    def get_report_body(self):
+        self.calls += 1
+        return "body of %s" % self.datespan
+
+class TestReportStore(TestCase):
+
+    def setUp(self):
+        self.datespan = reportstore.month_datespan(2011, 5)
+
+    def testReportDatespans(self):
+        current, previous = reportstore.report_datespans(datetime(2011, 1, 15))
+        self.assertEqual((datetime(2011, 1, 1), datetime(2011, 1, 31)),
+                         (current.startdate, current.enddate))
+        self.assertEqual((datetime(2010, 12, 1), datetime(2010, 12, 31)),
+                         (previous.startdate, previous.enddate))
+
+    def testLatestVersionServed(self):
+        self.assertEqual(None, reportstore.latest("hsas_reporting", self.datespan))
+        reportstore.store("hsas_reporting", self.datespan, "old")
+        reportstore.store("hsas_reporting", self.datespan, "new")
+        stored = reportstore.latest("hsas_reporting", self.datespan)
+        self.assertEqual(("new", 2), (stored.body, stored.version))
+        self.assertEqual(None, reportstore.latest("hsas_reporting",
+                                                  reportstore.month_datespan(2011, 4)))
+
+    def testOldVersionsDropped(self):
+        for i in range(reportstore.KEEP_VERSIONS + 2):
+            reportstore.store("hsas_reporting", self.datespan, "body %s" % i)
+        self.assertEqual(reportstore.KEEP_VERSIONS,
+                         StoredReport.objects.filter(slug="hsas_reporting").count())
+
+    def testCurrentReportsIgnoreDates(self):
+        reportstore.store("hsas_with_stock", self.datespan, "now")
+        self.assertEqual("now", reportstore.latest("hsas_with_stock",
+                                                   reportstore.month_datespan(2011, 4)).body)
+
+    def testOnDemandBodyCached(self):
+        instance = _CountingInstance(ReportDefinition("hsas_reporting"), 
+                                     reportstore.month_datespan(2009, 3))
+        body = reportstore.on_demand_body(instance)
+        self.assertEqual(body, reportstore.on_demand_body(instance))
+        self.assertEqual(1, instance.calls)
+        other = _CountingInstance(ReportDefinition("hsas_reporting"), 
+                                  reportstore.month_datespan(2009, 4))
+        reportstore.on_demand_body(other)
+        self.assertEqual(1, other.calls)
@@ -0,0 +1,59 @@
+import bz2
+import gzip
+from cStringIO import StringIO
+from logistics.models import ProductReport
+from logistics_project.apps.malawi import scmgr
+from logistics_project.apps.malawi.tests.base import MalawiTestBase
+
+def _row(quantity, facility="MHG013", product="A0451", month=5, stocked_out=False):
+    return [quantity, 10, stocked_out, facility, [2011, month], "LA 1x6", product]
+
+def _gzip(data):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode="wb")
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+class TestSCMgrLoad(MalawiTestBase):
+
+    def testLoadChunk(self):
+        stats = scmgr.load_chunk([_row(20), _row(30, month=4), _row(0, month=3), 
+                                  _row(5, facility="NOPE"), _row(5, product="NOPE")])
+        self.assertEqual((2, 0, 1, 2), 
+                         (stats.processed, stats.known, stats.blank, stats.unknown))
+        self.assertEqual(2, ProductReport.objects.count())
+
+    def testReloadIsSkipped(self):
+        rows = [_row(20), _row(30, month=4)]
+        scmgr.load(rows, chunk_size=1)
+        stats = scmgr.load(rows + [_row(40, month=3)], chunk_size=2)
+        self.assertEqual([(0, 2), (1, 0)], [(s.processed, s.known) for s in stats])
+        self.assertEqual(3, ProductReport.objects.count())
+
+class TestSCMgrExport(MalawiTestBase):
+
+    def testCommitChunk(self):
+        checkpoint, stats = scmgr.commit_chunk("central", 1, [_row(20, month=4), _row(20)])
+        self.assertEqual(2, stats.processed)
+        self.assertEqual({"site": "central", "sequence": 1, "high_water": [2011, 5, "MHG013"]},
+                         checkpoint.to_dict())
+        # sent again, e.g. when the ack was lost
+        checkpoint, stats = scmgr.commit_chunk("central", 1, [_row(20, month=4), _row(20)])
+        self.assertEqual((1, None), (checkpoint.sequence, stats))
+        self.assertRaises(scmgr.SequenceError, scmgr.commit_chunk, "central", 3, [])
+        self.assertEqual(2, ProductReport.objects.count())
+
+    def testDecompress(self):
+        for encoding, compress in (("bz2", bz2.compress), ("gzip", _gzip), ("", str)):
+            self.assertEqual("[]", scmgr.decompress(compress("[]"), encoding))
+        self.assertRaises(ValueError, scmgr.decompress, "[]", "zip")
+        for encoding, data in (("bz2", "[]"), ("gzip", "[]"), ("gzip", _gzip("[]")[:-6]),
+                               ("gzip", _gzip("[]")[:12] + "garbage")):
+            self.assertRaises(ValueError, scmgr.decompress, data, encoding)
+
+    def testBadRows(self):
+        for rows in ({}, [[]], [_row(20)[:6]], [_row("20")], [_row(20, facility=None)],
+                     [_row(20, month=13)], [_row(20)[:4] + [[2011]] + _row(20)[5:]]):
+            self.assertRaises(ValueError, scmgr.commit_chunk, "central", 1, rows)
+        self.assertEqual(0, scmgr.get_checkpoint("central").sequence)
@@ -0,0 +1,26 @@
+import unittest
+from datetime import datetime, timedelta
+from logistics_project.apps.malawi.nag import next_soh_warning, WARNING_DAYS,\
+    DAYS_BETWEEN_FIRST_AND_SECOND_WARNING
+
+class TestNextSOHWarning(unittest.TestCase):
+
+    def setUp(self):
+        self.since = datetime(2011, 6, 1)
+
+    def _after(self, days):
+        return self.since + timedelta(days=days, hours=1)
+
+    def testFirstWarning(self):
+        self.assertEqual(None, next_soh_warning(0, self.since, self.since))
+        self.assertEqual(1, next_soh_warning(0, self.since, self._after(WARNING_DAYS)))
+
+    def testEscalation(self):
+        second_due = WARNING_DAYS + DAYS_BETWEEN_FIRST_AND_SECOND_WARNING
+        self.assertEqual(None, next_soh_warning(1, self.since, self._after(WARNING_DAYS)))
+        self.assertEqual(2, next_soh_warning(1, self.since, self._after(second_due)))
+        # already had the second one
+        self.assertEqual(None, next_soh_warning(2, self.since, self._after(second_due)))
+
+    def testNoMoreThanFour(self):
+        self.assertEqual(None, next_soh_warning(4, self.since, self._after(100)))
@@ -0,0 +1,23 @@
+from logistics.models import ProductStock
+from logistics_project.apps.malawi.tables import with_stock_counts,\
+    prefetch_hsa_details
+from logistics_project.apps.malawi.tests.base import MalawiTestBase
+from logistics_project.apps.malawi.tests.util import create_hsa
+from logistics_project.apps.malawi.util import hsas_below
+
+class TestHSATable(MalawiTestBase):
+
+    def testStockCounts(self):
+        wendy = create_hsa(self, "16175551000", "wendy", products="la lb zi")
+        create_hsa(self, "16175551001", "steve", id="2")
+        ProductStock.objects.filter(supply_point=wendy.supply_point,
+                                    product__sms_code__in=["la", "zi"]).update(quantity=0)
+        hsas = with_stock_counts(hsas_below(None))
+        self.assertEqual(["steve", "wendy"], [h.name for h in hsas.order_by("stocked_out")])
+        self.assertEqual([2, 0], [h.stocked_out for h in hsas.order_by("-stocked_out")])
+        
+        wendy, steve = prefetch_hsa_details(list(hsas.order_by("-stocked_out")))
+        self.assertEqual(("la lb zi", "None"), (wendy.commodity_codes, steve.commodity_codes))
+        self.assertEqual((0, 0, 0), (wendy.emergency_count, wendy.adequate_count, 
+                                     wendy.overstocked_count))
+        self.assertTrue(wendy.last_message_date is not None)
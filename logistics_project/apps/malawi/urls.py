@@ -41,6 +41,9 @@ urlpatterns = patterns('',
     url(r'^scmgr/receiver/$',
         "logistics_project.apps.malawi.views.scmgr_receiver",
         name="malawi_scmgr_receiver"),
+    url(r'^scmgr/export/(?P<site>[\w-]+)/$',
+        "logistics_project.apps.malawi.views.scmgr_export",
+        name="malawi_scmgr_export"),
     url(r'^facilities/$',
         "logistics_project.apps.malawi.views.facilities",
         name="malawi_facilities"),
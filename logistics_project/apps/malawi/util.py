@@ -3,7 +3,8 @@ from logistics.models import SupplyPoint
 from logistics.util import config
 from logistics_project.apps.malawi.exceptions import MultipleHSAException, IdFormatException
 from rapidsms.contrib.locations.models import Location
-from django.db.models.query_utils import Q
+from logistics_project.apps.hierarchy.utils import supply_point_ids_below,\
+    location_ids_below
 
 def format_id(code, id):
     try:
@@ -39,27 +40,19 @@ def hsas_below(location):
     hsas = Contact.objects.filter(role__code="hsa", is_active=True, 
                                   supply_point__active=True) 
     if location:
-        # support up to 3 levels of parentage. this covers
-        # hsa->facility-> district, which is all we allow you to select
-        
-        hsas = hsas.filter(Q(supply_point__location=location) | \
-                           Q(supply_point__supplied_by__location=location) | \
-                           Q(supply_point__supplied_by__supplied_by__location=location))
+        hsas = hsas.filter(supply_point__in=supply_point_ids_below(location))
     return hsas
     
 def hsa_supply_points_below(location):
     """
-    Given an optional location, return all HSAs below that location.
+    Given an optional location (or list of locations), return all HSAs 
+    below that location.
     
     This method returns SupplyPoints
     """
     hsa_sps = SupplyPoint.objects.filter(type__code="hsa", active=True)
     if location:
-        # support up to 3 levels of parentage. this covers
-        # hsa->facility-> district, which is all we allow you to select
-        hsa_sps = hsa_sps.filter(Q(location=location) | \
-                                 Q(supplied_by__location=location) | \
-                                 Q(supplied_by__supplied_by__location=location))
+        hsa_sps = hsa_sps.filter(pk__in=supply_point_ids_below(location))
     return hsa_sps
     
     
@@ -101,10 +94,7 @@ def group_for_location(location):
 def facility_supply_points_below(location):
     facs = get_facility_supply_points()
     if location:
-        # support up to 2 levels of parentage. this covers
-        # facility-> district, which is all we allow you to select in this case
-        facs = facs.filter(Q(location=location) | \
-                           Q(location__parent_id=location.pk))
+        facs = facs.filter(location__in=location_ids_below(location))
     return facs
 
 
@@ -11,12 +11,12 @@ import logging
 from django.views.decorators.vary import vary_on_cookie
 from logistics_project.apps.malawi.exceptions import IdFormatException
 from logistics_project.apps.malawi.tables import MalawiContactTable, MalawiLocationTable, \
-    MalawiProductTable, HSATable, StockRequestTable, \
+    MalawiProductTable, HSATable, StockRequestTable, with_stock_counts, \
     HSAStockRequestTable, DistrictTable
 from rapidsms.models import Contact
 from rapidsms.contrib.locations.models import Location
 from logistics.models import SupplyPoint, Product, \
-    StockTransaction, StockRequestStatus, StockRequest, ProductReport, ContactRole
+    StockTransaction, StockRequestStatus, StockRequest, ContactRole
 from logistics_project.apps.malawi.util import get_districts, get_facilities, hsas_below, group_for_location, format_id
 from logistics.decorators import place_in_request
 from logistics.charts import stocklevel_plot
@@ -31,8 +31,9 @@ from django.contrib.auth.decorators import permission_required
 from logistics_project.apps.malawi.reports import ReportInstance, ReportDefinition,\
     REPORT_SLUGS, REPORTS_CURRENT, REPORTS_LOCATION
 from rapidsms.models import Backend, Connection
-from static.malawi.scmgr_const import PRODUCT_CODE_MAP, HEALTH_FACILITY_MAP
 from django.conf import settings
+from logistics_project.apps.malawi import reportstore, scmgr
+from logistics_project.apps.malawi.tasks import refresh_monitoring_report
 
 class MonthPager(object):
     """
@@ -108,7 +109,8 @@ def hsas(request):
     districts = get_districts().order_by("id")
     facilities = get_facilities().order_by("parent_id")
     
-    hsa_table = HSATable(hsas, request=request)
+    hsa_table = HSATable(with_stock_counts(hsas.select_related('supply_point__supplied_by')),
+                         request=request)
     return render_to_response("malawi/hsas.html",
         {
             "hsas": hsas,
@@ -235,11 +237,16 @@ def monitoring(request):
     reports = (ReportDefinition(slug) for slug in REPORT_SLUGS) 
     return render_to_response("malawi/monitoring_home.html", {"reports": reports},
                               context_instance=RequestContext(request))
-@cache_page(60 * 15)
 @permission_required("is_superuser")
 @datespan_in_request()
 def monitoring_report(request, report_slug):
     report_def = ReportDefinition(report_slug)
+    default_datespan = "startdate" not in request.GET and "enddate" not in request.GET
+    if default_datespan:
+        # default to the month, which is what gets precomputed
+        now = datetime.utcnow()
+        request.datespan = reportstore.month_datespan(now.year, now.month)
+    datespan = request.datespan
     if report_slug in REPORTS_CURRENT: request.datespan = "current"
     if report_slug in REPORTS_LOCATION:
         request.select_location=True
@@ -255,8 +262,21 @@ def monitoring_report(request, report_slug):
         instance = ReportInstance(report_def, request.datespan)
         facilities = None
         location = None
+    
+    if request.GET.get("refresh") and location is None:
+        refresh_monitoring_report.delay(report_slug, datespan.startdate, datespan.enddate)
+        messages.info(request, "The report is being recalculated. Reload the page in a few minutes to see the new numbers.")
+        params = request.GET.copy()
+        del params["refresh"]
+        return HttpResponseRedirect("%s?%s" % (reverse("malawi_monitoring_report", args=[report_slug]),
+                                               params.urlencode()))
+    # reports for a location are only computed on demand
+    stored = reportstore.latest(report_slug, datespan) if location is None else None
     return render_to_response("malawi/monitoring_report.html",
                               {"report": instance,
+                               "stored": stored,
+                               "body": reportstore.on_demand_body(instance) if stored is None else None,
+                               "default_datespan": default_datespan and report_slug not in REPORTS_CURRENT,
                                "facilities": facilities,
                                "location": location},
                               context_instance=RequestContext(request))
@@ -301,33 +321,50 @@ def scmgr_receiver(request):
         return HttpResponse("You must submit POST data to this url.")
     data = request.POST.get('data', None)
     result = json.simplejson.loads(data)
-    processed = 0
-    for r in result:
-        try:
-            facility = SupplyPoint.objects.get(code=HEALTH_FACILITY_MAP[r[3]])
-            pc = PRODUCT_CODE_MAP[r[6]].lower()
-            product = Product.objects.get(sms_code=pc)
-            date = datetime(year=r[4][0],month=r[4][1], day=1)
-            if ProductReport.objects.filter(supply_point=facility, product=product, report_date=date).exists():
-                # Server sent us some data we already have.  This means they should stop sending it.
-                return HttpResponse('cStock SCMgr data fully updated.')
-            quantity = r[0]
-            is_stocked_out = r[2]
-            if not quantity and not is_stocked_out:
-                # If stock quantity is 0, but stockout not indicated, this line wasn't filled in.
-                continue
-            facility.report_stock(product, quantity, date=date)
-            logging.info("SCMgr: Processed stock report %s %s %s %s" % (facility,product,quantity,date))
-            processed += 1
-        except (KeyError, SupplyPoint.DoesNotExist, Product.DoesNotExist) as e:
-            # Server sent us some data we don't care about.  Keep on truckin'.
-            continue
-    if result:
-        ret = "Processed %d entries." % processed
-        return HttpResponse(ret, status=201) # Keep sending us stuff if you have more to send.
-    else:
+    if not result:
         ret = "Got no data -- ending update."
         return HttpResponse(ret)
+    chunks = scmgr.load(result)
+    for stats in chunks:
+        logging.info("SCMgr: %s" % stats)
+    ret = "\n".join(["Processed %d entries." % sum(stats.processed for stats in chunks)] + \
+                     ["chunk %s: %s" % (i + 1, stats) for i, stats in enumerate(chunks)])
+    if not sum(stats.processed for stats in chunks) and sum(stats.known for stats in chunks):
+        # Server sent us only data we already have. SCMgr sends the newest 
+        # data first, so this means they should stop sending it.
+        return HttpResponse('cStock SCMgr data fully updated.\n%s' % ret)
+    return HttpResponse(ret, status=201) # Keep sending us stuff if you have more to send.
+
+@csrf_exempt
+def scmgr_export(request, site):
+    """
+    The resumable SCMgr export (see deploy/scmgr/export.py). GET returns
+    the site's checkpoint, and each POST is a numbered, compressed chunk
+    of rows which is acknowledged with the new checkpoint.
+    """
+    if request.method == 'POST':
+        try:
+            sequence = int(request.GET.get('seq', ''))
+            data = scmgr.decompress(request.raw_post_data, 
+                                    request.META.get('HTTP_CONTENT_ENCODING', ''))
+            rows = json.simplejson.loads(data)
+        except (ValueError, IOError) as e:
+            return HttpResponse("Bad chunk: %s" % e, status=400)
+        try:
+            checkpoint, stats = scmgr.commit_chunk(site, sequence, rows)
+        except ValueError as e:
+            return HttpResponse("Bad chunk: %s" % e, status=400)
+        except scmgr.SequenceError as e:
+            ret = scmgr.get_checkpoint(site).to_dict()
+            ret["error"] = unicode(e)
+            return HttpResponse(json.simplejson.dumps(ret), status=409, 
+                                mimetype="application/json")
+        ret = checkpoint.to_dict()
+        ret["stats"] = unicode(stats) if stats else "already committed"
+        logging.info("SCMgr export %s chunk %s: %s" % (site, sequence, ret["stats"]))
+    else:
+        ret = scmgr.get_checkpoint(site).to_dict()
+    return HttpResponse(json.simplejson.dumps(ret), mimetype="application/json")
 
 def verify_ajax(request):
     field = request.GET.get('field', None)
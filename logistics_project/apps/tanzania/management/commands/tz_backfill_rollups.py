@@ -0,0 +1,21 @@
+from datetime import datetime
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from logistics.models import SupplyPoint
+from logistics_project.apps.tanzania.rollups import backfill_rollups
+from dimagi.utils.parsing import string_to_datetime
+
+class Command(BaseCommand):
+    help = "Compute the monthly status rollups from the full status history"
+    option_list = BaseCommand.option_list + (
+        make_option('--since', dest='since', default=None,
+                    help='Only recompute months from this date (YYYY-MM-DD) onwards'),
+    )
+    args = "[supply point code ...]"
+
+    def handle(self, *args, **options):
+        since = string_to_datetime(options['since']) if options['since'] else None
+        supply_points = SupplyPoint.objects.filter(code__in=args) if args else None
+        start = datetime.utcnow()
+        count = backfill_rollups(supply_points, since=since)
+        print "Computed %s rollups in %s" % (count, datetime.utcnow() - start)
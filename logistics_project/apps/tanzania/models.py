@@ -166,4 +166,51 @@ class DeliveryGroupReport(models.Model):
     delivery_group = models.ForeignKey(SupplyPointGroup)
 
     class Meta:
-        ordering = ('-report_date',)
\ No newline at end of file
+        ordering = ('-report_date',)
+
+
+class SupplyPointMonthlyRollup(models.Model):
+    """
+    A supply point's reporting status for a single month, rolled up from
+    the status log and product reports so that reports don't have to
+    recompute it. Kept current by the signal handlers in signals.py and
+    backfilled with the tz_backfill_rollups management command.
+    """
+    supply_point = models.ForeignKey(SupplyPoint)
+    year = models.PositiveIntegerField()
+    month = models.PositiveIntegerField()
+    randr_status = models.CharField(max_length=50, null=True, blank=True)
+    randr_on_time = models.CharField(max_length=50, default=OnTimeStates.NO_DATA)
+    delivery_status = models.CharField(max_length=50, null=True, blank=True)
+    soh_status = models.CharField(max_length=50, null=True, blank=True)
+    soh_on_time = models.CharField(max_length=50, default=OnTimeStates.NO_DATA)
+    # every supervision status seen in the reporting window, not just the
+    # latest, since a reminder and an answer both count in the reports
+    supervision_reminder_sent = models.BooleanField(default=False)
+    supervision_received = models.BooleanField(default=False)
+    supervision_not_received = models.BooleanField(default=False)
+    stockout = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return "%s: %s/%s" % (self.supply_point, self.month, self.year)
+
+    SUPERVISION_FIELDS = ((SupplyPointStatusValues.REMINDER_SENT, 'supervision_reminder_sent'),
+                          (SupplyPointStatusValues.RECEIVED, 'supervision_received'),
+                          (SupplyPointStatusValues.NOT_RECEIVED, 'supervision_not_received'))
+
+    def get_supervision_values(self):
+        return set(value for value, field in self.SUPERVISION_FIELDS \
+                   if getattr(self, field))
+
+    def set_supervision_values(self, values):
+        for value, field in self.SUPERVISION_FIELDS:
+            setattr(self, field, value in values)
+
+    class Meta:
+        verbose_name = "Monthly Facility Status"
+        verbose_name_plural = "Monthly Facility Statuses"
+        unique_together = ('supply_point', 'year', 'month')
+
+# don't remove this - it's where signals get instantiated
+from logistics_project.apps.tanzania import signals
@@ -9,19 +9,68 @@ Reminders can fire up to three times.
  
 """
 from rapidsms.contrib.messaging.utils import send_message
+from rapidsms.models import Contact
 from django.utils.translation import ugettext as _
 from datetime import datetime
-from logistics_project.apps.tanzania.models import SupplyPointStatus
+from django.db import connection, transaction
+from logistics.models import ProductReport
+from logistics_project.apps.tanzania.models import SupplyPointStatus,\
+    SupplyPointStatusTypes
+from logistics_project.apps.tanzania.reminders.dispatch import dispatch
+from logistics_project.apps.tanzania.signals import statuses_saved
+from logistics_project.utils.bulk import insert_rows
+from logistics_project.utils.connections import default_connections
+
+def get_recipients(supply_point_type, cutoff, status_type=None, report_type=None, 
+                   group=None, responded=False):
+    """
+    Contacts at supply points of a type (and delivery group, if given) 
+    that have not logged a status of status_type, or a product report of
+    report_type, since the cutoff. With responded=True it's the contacts 
+    that have instead.
+    
+    This is a single query, with the contacts' supply points attached.
+    """
+    contacts = Contact.objects.filter(supply_point__type__code=supply_point_type)
+    if group:
+        contacts = contacts.filter(supply_point__groups__code=group)
+    if status_type:
+        since = SupplyPointStatus.objects.filter(status_type=status_type,
+                                                 status_date__gte=cutoff)
+    else:
+        since = ProductReport.objects.filter(report_type__code=report_type,
+                                             report_date__gte=cutoff)
+    since = since.values('supply_point')
+    if responded:
+        contacts = contacts.filter(supply_point__in=since)
+    else:
+        contacts = contacts.exclude(supply_point__in=since)
+    return contacts.select_related('supply_point').distinct()
 
 def send_reminders(contacts, message):
-    for contact in contacts:
-        if contact.default_connection:
-            send_message(contact.default_connection, _(message))
-        
+    contacts = list(contacts)
+    connections = default_connections(contacts)
+    return dispatch((connections[c.pk], _(message)) for c in contacts \
+                    if c.pk in connections)
+
+@transaction.commit_on_success
 def update_statuses(contacts, type, value):
+    """
+    Give the supply points of the contacts a status, with one insert.
+    """
+    if not SupplyPointStatusTypes.is_legal_combination(type, value):
+        raise ValueError("%s and %s is not a legal value combination" % \
+                         (type, value))
+    supply_points = dict((c.supply_point_id, c.supply_point) for c in contacts \
+                         if c.supply_point_id)
+    if not supply_points:
+        return
     now = datetime.utcnow()
-    for sp in set(c.supply_point for c in contacts):
-        SupplyPointStatus.objects.create(supply_point=sp,
-                                         status_type=type,
-                                         status_value=value,
-                                         status_date=now)
+    opts = SupplyPointStatus._meta
+    columns = [opts.get_field(f).column for f in \
+               ("status_type", "status_value", "status_date", "supply_point")]
+    db_now = connection.ops.value_to_db_datetime(now)
+    insert_rows(SupplyPointStatus, columns,
+                [(type, value, db_now, sp_id) for sp_id in supply_points])
+    # the insert skips post_save
+    statuses_saved(supply_points.values(), now)
@@ -2,10 +2,9 @@ from scheduler.decorators import businessday_before
 from datetime import datetime, timedelta
 from logistics.util import config
 from logistics_project.apps.tanzania.reminders import send_reminders,\
-    update_statuses
+    update_statuses, get_recipients
 from logistics_project.apps.tanzania.models import DeliveryGroups,\
     SupplyPointStatusTypes, SupplyPointStatusValues
-from rapidsms.models import Contact
 from logistics_project.apps.tanzania.config import SupplyPointCodes
 from dimagi.utils.dates import get_business_day_of_month_before
 
@@ -16,24 +15,14 @@ def get_facility_people(cutoff):
     # All people at all Districts get all reminders each month.
     # For facilities the reminder should go out if we haven't received 
     # any status of type of del_fac
-    current_group = DeliveryGroups().current_delivering_group()
-    
-    for contact in Contact.objects.filter\
-            (supply_point__type__code=SupplyPointCodes.FACILITY,
-             supply_point__groups__code__in=current_group):
-        if not contact.supply_point.supplypointstatus_set.filter\
-                (status_type=SupplyPointStatusTypes.DELIVERY_FACILITY,
-                 status_date__gte=cutoff).exists():
-            yield contact
+    return get_recipients(SupplyPointCodes.FACILITY, cutoff,
+                          status_type=SupplyPointStatusTypes.DELIVERY_FACILITY,
+                          group=DeliveryGroups().current_delivering_group())
                 
 def get_district_people(cutoff):
     # All people at all Districts get all reminders each month.
-    for contact in Contact.objects.filter\
-            (supply_point__type__code=SupplyPointCodes.DISTRICT):
-        if not contact.supply_point.supplypointstatus_set.filter\
-                (status_type=SupplyPointStatusTypes.DELIVERY_DISTRICT,
-                 status_date__gte=cutoff).exists():
-            yield contact
+    return get_recipients(SupplyPointCodes.DISTRICT, cutoff,
+                          status_type=SupplyPointStatusTypes.DELIVERY_DISTRICT)
 
 def get_facility_cutoff():
     now = datetime.utcnow()
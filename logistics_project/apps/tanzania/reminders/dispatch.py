@@ -0,0 +1,108 @@
+"""
+Sending a reminder wave.
+
+Each outbound send blocks on the backend (for PUSH, an HTTP round trip),
+so with LOGISTICS_REMINDER_WORKERS above 1 the messages are handed to a
+pool of threads. LOGISTICS_REMINDER_BACKEND_CONCURRENCY caps how many of
+those may be talking to any one backend at a time.
+"""
+import logging
+import threading
+from datetime import datetime
+from Queue import Queue
+from django.conf import settings
+from django.db import connection as db_connection
+from rapidsms.contrib.messaging.utils import send_message
+
+class DispatchStats(object):
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.started = datetime.utcnow()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    @property
+    def seconds(self):
+        end = self.finished or datetime.utcnow()
+        delta = end - self.started
+        return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.0
+
+    @property
+    def per_second(self):
+        return (self.sent + self.failed) / self.seconds if self.seconds else 0.0
+
+    def __unicode__(self):
+        return "%s sent, %s failed in %.1fs (%.1f/s)" % \
+            (self.sent, self.failed, self.seconds, self.per_second)
+
+    def __str__(self):
+        return unicode(self).encode("utf-8")
+
+def _send(connection, text, stats):
+    try:
+        ok = send_message(connection, text) is not False
+    except Exception:
+        logging.exception("reminder to %s failed" % connection)
+        ok = False
+    stats.record(ok)
+
+def _backend_semaphores(workers):
+    limits = settings.LOGISTICS_REMINDER_BACKEND_CONCURRENCY
+    semaphores = {}
+    def get(backend_name):
+        if backend_name not in semaphores:
+            semaphores[backend_name] = threading.BoundedSemaphore\
+                (min(workers, limits.get(backend_name, workers)))
+        return semaphores[backend_name]
+    return get
+
+def dispatch(messages, workers=None):
+    """
+    Send (connection, text) pairs and return the DispatchStats of the run.
+    A failed send is logged and counted, never raised.
+    """
+    if workers is None:
+        workers = settings.LOGISTICS_REMINDER_WORKERS
+    stats = DispatchStats()
+    if workers <= 1:
+        for connection, text in messages:
+            _send(connection, text, stats)
+    else:
+        semaphore_for = _backend_semaphores(workers)
+        # a bounded queue keeps the producer from running ahead of the pool
+        queue = Queue(workers * 2)
+        def work():
+            try:
+                while True:
+                    item = queue.get()
+                    if item is None:
+                        break
+                    connection, text, semaphore = item
+                    with semaphore:
+                        _send(connection, text, stats)
+            finally:
+                # every thread gets its own db connection
+                db_connection.close()
+        threads = [threading.Thread(target=work) for i in range(workers)]
+        for t in threads:
+            t.start()
+        for connection, text in messages:
+            # only this thread touches the semaphore map
+            queue.put((connection, text,
+                       semaphore_for(connection.backend.name)))
+        for t in threads:
+            queue.put(None)
+        for t in threads:
+            t.join()
+    stats.finished = datetime.utcnow()
+    logging.info("reminder dispatch: %s" % stats)
+    return stats
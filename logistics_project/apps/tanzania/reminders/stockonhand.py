@@ -2,9 +2,8 @@ from scheduler.decorators import businessday
 from logistics.util import config
 from datetime import datetime, timedelta
 from logistics_project.apps.tanzania.reminders import send_reminders,\
-    update_statuses
+    update_statuses, get_recipients
 from logistics_project.apps.tanzania.config import SupplyPointCodes
-from rapidsms.models import Contact
 from logistics.const import Reports
 from dimagi.utils.dates import get_business_day_of_month
 from logistics_project.apps.tanzania.models import SupplyPointStatusValues,\
@@ -13,13 +12,8 @@ from logistics_project.apps.tanzania.models import SupplyPointStatusValues,\
 def get_people(cutoff):
     # these go out every month to every active person at all facilities
     # unless they've already submitted a SOH report this month.
-    
-    for contact in Contact.objects.filter\
-            (supply_point__type__code=SupplyPointCodes.FACILITY):
-        if not contact.supply_point.productreport_set.filter\
-                (report_type__code=Reports.SOH,
-                 report_date__gte=cutoff).exists():
-            yield contact
+    return get_recipients(SupplyPointCodes.FACILITY, cutoff,
+                          report_type=Reports.SOH)
                 
 def get_cutoff(year, month):
     return get_business_day_of_month(year, month, -1)
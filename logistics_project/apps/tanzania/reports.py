@@ -1,16 +1,41 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time
+from django.db.models.aggregates import Max
 from logistics.reports import Colors, PieChartData
 from logistics.models import SupplyPoint, ProductReport
+from logistics.const import Reports
 from django.utils.functional import curry
-from logistics_project.apps.tanzania.models import DeliveryGroups, OnTimeStates
-from logistics_project.apps.tanzania.utils import submitted_to_msd, randr_reported_on_time, soh_reported_on_time, facilities_below, historical_response_rate, format_percent, sps_with_status
+from django.conf import settings
+from logistics_project.apps.tanzania.models import DeliveryGroups, OnTimeStates, SupplyPointStatus, SupplyPointMonthlyRollup
+from logistics_project.apps.tanzania.utils import submitted_to_msd, facilities_below, historical_response_rates, format_percent, reporting_window, _reported_on_time
 from models import SupplyPointStatusTypes, SupplyPointStatusValues
 from django.utils.translation import ugettext as _
 from rapidsms.contrib.locations.models import Location
-from utils import sps_with_latest_status, avg_past_lead_time
+from utils import monthly_lead_times, average_lead_time
 from calendar import month_name
+from dimagi.utils.dates import get_business_day_of_month, get_business_day_of_month_before
+
+def _as_datetime(d):
+    return d if isinstance(d, datetime) else datetime.combine(d, time())
+
+def _bucket(name):
+    """
+    A read-only property serving one of the breakdown's precomputed buckets.
+    """
+    def _get(self):
+        if self._buckets is None:
+            self._buckets = self._classify()
+        return self._buckets[name]
+    return property(_get)
 
 class SupplyPointStatusBreakdown(object):
+    """
+    Buckets a set of facilities by their R&R, delivery, supervision and
+    stock on hand status for a month.
+
+    All the buckets are computed together the first time any of them is
+    asked for, from a handful of queries over the whole facility set,
+    and served from memory after that.
+    """
 
     def __init__(self, facilities=None, year=None, month=None):
         if not (year and month):
@@ -26,150 +51,208 @@ class SupplyPointStatusBreakdown(object):
         self.report_year = self.year if self.report_month < 12 else self.year - 1
         self.dg = DeliveryGroups(month=month, facs=self.facilities)
         self._submission_chart = None
+        self._groups = {}
+        self._buckets = None
+
+    def _group(self, name):
+        """
+        The facilities in a delivery group ("submitting", "delivering", ...)
+        as a list, loaded once.
+        """
+        if name not in self._groups:
+            self._groups[name] = list(getattr(self.dg, name)(self.facilities))
+        return self._groups[name]
+
+    def _load(self):
+        """
+        Returns the latest status value per (supply point id, type) in the
+        month, the R&R and SOH on time state per supply point id, the
+        supervision values per supply point id in the reporting window,
+        and the ids of the supply points with a stockout in the report 
+        month.
+        """
+        if settings.LOGISTICS_USE_STATUS_ROLLUPS:
+            return self._load_from_rollups()
+        return self._load_from_log()
+
+    def _load_from_log(self):
+        month_start = datetime(self.year, self.month, 1)
+        month_end = (month_start + timedelta(days=32)).replace(day=1)
+        sup_start, sup_end = reporting_window(SupplyPointStatusTypes.SUPERVISION_FACILITY,
+                                              self.year, self.month)
+        sup_start, sup_end = _as_datetime(sup_start), _as_datetime(sup_end)
+        monthly_types = (SupplyPointStatusTypes.R_AND_R_FACILITY,
+                         SupplyPointStatusTypes.DELIVERY_FACILITY,
+                         SupplyPointStatusTypes.SOH_FACILITY)
+        # walk every status row that can matter for this month once, in id 
+        # order, so the last one seen per (supply point, type) is the latest
+        rows = SupplyPointStatus.objects.filter(
+            supply_point__in=self.facilities.values('pk'),
+            status_type__in=monthly_types + (SupplyPointStatusTypes.SUPERVISION_FACILITY,),
+            status_date__gte=min(month_start, sup_start),
+            status_date__lt=max(month_end, sup_end + timedelta(seconds=1)),
+        ).order_by('id').values_list('supply_point', 'status_type', 'status_value', 'status_date')
+
+        latest = {}
+        last_submitted = {}
+        supervision = {}
+        for sp_id, type, value, date in rows.iterator():
+            if type in monthly_types and month_start <= date < month_end:
+                latest[(sp_id, type)] = value
+                if type == SupplyPointStatusTypes.R_AND_R_FACILITY and \
+                   value == SupplyPointStatusValues.SUBMITTED:
+                    if sp_id not in last_submitted or date > last_submitted[sp_id]:
+                        last_submitted[sp_id] = date
+            elif type == SupplyPointStatusTypes.SUPERVISION_FACILITY and sup_start < date <= sup_end:
+                supervision.setdefault(sp_id, set()).add(value)
+
+        reminder_date = datetime.combine(get_business_day_of_month_before(self.year, self.month, 5), time())
+        randr_states = dict((sp_id, _reported_on_time(reminder_date, date)) \
+                            for sp_id, date in last_submitted.items())
+
+        last_of_last_month = datetime(self.year, self.month, 1) - timedelta(days=1)
+        last_bd_of_last_month = datetime.combine(get_business_day_of_month(last_of_last_month.year,
+                                                                           last_of_last_month.month,
+                                                                           -1), time())
+        last_bd_of_the_month = get_business_day_of_month(self.year, self.month, -1)
+        last_soh = ProductReport.objects.filter(supply_point__in=self.facilities.values('pk'),
+                                                report_type__code=Reports.SOH,
+                                                report_date__lt=last_bd_of_the_month)\
+                                        .order_by().values_list('supply_point')\
+                                        .annotate(last=Max('report_date'))
+        soh_states = dict((sp_id, _reported_on_time(last_bd_of_last_month, date)) \
+                          for sp_id, date in last_soh)
 
-    @property
-    def submitted(self):
-        return list(sps_with_latest_status(sps=self.dg.submitting(self.facilities),
-                                                year=self.year, month=self.month,
-                                                status_type=SupplyPointStatusTypes.R_AND_R_FACILITY,
-                                                status_value=SupplyPointStatusValues.SUBMITTED))
-    @property
-    def submitted_on_time(self):
-        return filter(lambda sp: randr_reported_on_time(sp, self.year, self.month) == OnTimeStates.ON_TIME, self.submitted)
-
-    @property
-    def submitted_late(self):
-        return filter(lambda sp: randr_reported_on_time(sp, self.year, self.month) == OnTimeStates.LATE, self.submitted)
-
-    @property
-    def not_submitted(self):
-        return list(sps_with_latest_status(sps=self.dg.submitting(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.R_AND_R_FACILITY,
-                                                 status_value=SupplyPointStatusValues.NOT_SUBMITTED))
-
-    @property
-    def submit_reminder_sent(self):
-        return list(sps_with_latest_status(sps=self.dg.submitting(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.R_AND_R_FACILITY,
-                                                 status_value=SupplyPointStatusValues.REMINDER_SENT))
-    @property
-    def submit_not_responding(self):
-        return list(set(self.submit_reminder_sent) - set(self.submitted) - set(self.not_submitted))
-
-
-    @property
-    def no_randr_data(self):
-        return list(set(self.dg.submitting(self.facilities)) -
-                    set(self.submitted_on_time) -
-                    set(self.submitted_late) -
-                    set(self.not_submitted) -
-                    set(self.submit_not_responding))
-    @property
-    def delivery_received(self):
-        return list(sps_with_latest_status(sps=self.dg.delivering(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.DELIVERY_FACILITY,
-                                                 status_value=SupplyPointStatusValues.RECEIVED))
-
-    @property
-    def delivery_not_received(self):
-        return list(sps_with_latest_status(sps=self.dg.delivering(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.DELIVERY_FACILITY,
-                                                 status_value=SupplyPointStatusValues.NOT_RECEIVED))
-
-
-    @property
-    def delivery_reminder_sent(self):
-        return list(sps_with_latest_status(sps=self.dg.delivering(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.DELIVERY_FACILITY,
-                                                 status_value=SupplyPointStatusValues.REMINDER_SENT))
-
-    @property
-    def delivery_not_responding(self):
-        return list(set(self.delivery_reminder_sent) - set(self.delivery_received) - set(self.delivery_not_received))
-
-
-    @property
-    def supervision_received(self):
-        return list(sps_with_status(sps=self.dg.submitting(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.SUPERVISION_FACILITY,
-                                                 status_value=SupplyPointStatusValues.RECEIVED))
-
-    @property
-    def supervision_not_received(self):
-        return list(sps_with_status(sps=self.dg.submitting(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.SUPERVISION_FACILITY,
-                                                 status_value=SupplyPointStatusValues.NOT_RECEIVED))
-
-    @property
-    def supervision_reminder_sent(self):
-        return list(sps_with_status(sps=self.dg.submitting(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.SUPERVISION_FACILITY,
-                                                 status_value=SupplyPointStatusValues.REMINDER_SENT))
-
-    @property
-    def supervision_not_responding(self):
-        return list(set(self.supervision_reminder_sent) - set(self.supervision_received) - set(self.supervision_not_received))
-
-
-    @property
-    def no_supervision_data(self):
-        return list(set(self.dg.submitting(self.facilities)) -
-                    set(self.supervision_received) -
-                    set(self.supervision_not_received) -
-                    set(self.supervision_reminder_sent) -
-                    set(self.supervision_not_responding))
-
-    @property
-    def not_submitted(self):
-        return list(sps_with_latest_status(sps=self.dg.submitting(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.R_AND_R_FACILITY,
-                                                 status_value=SupplyPointStatusValues.NOT_SUBMITTED))
-
-    @property
-    def submit_reminder_sent(self):
-        return list(sps_with_latest_status(sps=self.dg.submitting(self.facilities),
-                                                 year=self.year, month=self.month,
-                                                 status_type=SupplyPointStatusTypes.R_AND_R_FACILITY,
-                                                 status_value=SupplyPointStatusValues.REMINDER_SENT))
-    @property
-    def submit_not_responding(self):
-        return list(set(self.submit_reminder_sent) - set(self.submitted) - set(self.not_submitted))
-
-
-    @property
-    def soh_submitted(self):
-        return list(sps_with_latest_status(sps=self.facilities, year=self.year, month=self.month,
-                                                         status_type=SupplyPointStatusTypes.SOH_FACILITY,
-                                                         status_value=SupplyPointStatusValues.SUBMITTED))
-
-    @property
-    def soh_on_time(self):
-        return filter(lambda sp: soh_reported_on_time(sp, self.year, self.month) == OnTimeStates.ON_TIME, self.facilities)
-
-    @property
-    def soh_late(self):
-        return filter(lambda sp: soh_reported_on_time(sp, self.year, self.month) == OnTimeStates.LATE, self.facilities)
-
-    @property
-    def soh_not_responding(self):
-        return filter(lambda sp: soh_reported_on_time(sp, self.year, self.month) in (OnTimeStates.NO_DATA, OnTimeStates.INSUFFICIENT_DATA), self.facilities)
+        # NOTE: Uses the report month/year, not the current month/year.
+        stocked_out = set(ProductReport.objects.filter(supply_point__in=self.facilities.values('pk'),
+                                                       quantity=0,
+                                                       report_date__month=self.report_month,
+                                                       report_date__year=self.report_year)\
+                                               .values_list('supply_point', flat=True).distinct())
+        return latest, randr_states, supervision, soh_states, stocked_out
+
+    def _load_from_rollups(self):
+        latest = {}
+        randr_states = {}
+        supervision = {}
+        soh_states = {}
+        rollups = SupplyPointMonthlyRollup.objects.filter\
+                        (supply_point__in=self.facilities.values('pk'),
+                         year=self.year, month=self.month)
+        for r in rollups:
+            latest[(r.supply_point_id, SupplyPointStatusTypes.R_AND_R_FACILITY)] = r.randr_status
+            latest[(r.supply_point_id, SupplyPointStatusTypes.DELIVERY_FACILITY)] = r.delivery_status
+            latest[(r.supply_point_id, SupplyPointStatusTypes.SOH_FACILITY)] = r.soh_status
+            randr_states[r.supply_point_id] = r.randr_on_time
+            soh_states[r.supply_point_id] = r.soh_on_time
+            values = r.get_supervision_values()
+            if values:
+                supervision[r.supply_point_id] = values
+        # NOTE: Uses the report month/year, not the current month/year.
+        stocked_out = set(SupplyPointMonthlyRollup.objects.filter\
+                                (supply_point__in=self.facilities.values('pk'),
+                                 year=self.report_year, month=self.report_month,
+                                 stockout=True).values_list('supply_point', flat=True))
+        return latest, randr_states, supervision, soh_states, stocked_out
+
+    def _classify(self):
+        latest, randr_states, supervision, soh_states, stocked_out = self._load()
+        b = {}
+
+        def _with_latest(facilities, type, value):
+            return [f for f in facilities if latest.get((f.pk, type)) == value]
+
+        def _with_supervision(value):
+            return [f for f in submitting if value in supervision.get(f.pk, ())]
+
+        def _with_state(facilities, states, *wanted):
+            return [f for f in facilities if states.get(f.pk, OnTimeStates.NO_DATA) in wanted]
+
+        def _minus(facilities, *excluded):
+            excluded_ids = set(f.pk for bucket in excluded for f in bucket)
+            return [f for f in facilities if f.pk not in excluded_ids]
+
+        submitting = self._group('submitting')
+        delivering = self._group('delivering')
+        facilities = list(self.facilities)
+
+        # R&R
+        b['submitted'] = _with_latest(submitting, SupplyPointStatusTypes.R_AND_R_FACILITY,
+                                      SupplyPointStatusValues.SUBMITTED)
+        b['submitted_on_time'] = _with_state(b['submitted'], randr_states, OnTimeStates.ON_TIME)
+        b['submitted_late'] = _with_state(b['submitted'], randr_states, OnTimeStates.LATE)
+        b['not_submitted'] = _with_latest(submitting, SupplyPointStatusTypes.R_AND_R_FACILITY,
+                                          SupplyPointStatusValues.NOT_SUBMITTED)
+        b['submit_reminder_sent'] = _with_latest(submitting, SupplyPointStatusTypes.R_AND_R_FACILITY,
+                                                 SupplyPointStatusValues.REMINDER_SENT)
+        b['submit_not_responding'] = _minus(b['submit_reminder_sent'], b['submitted'], b['not_submitted'])
+        b['no_randr_data'] = _minus(submitting, b['submitted_on_time'], b['submitted_late'],
+                                    b['not_submitted'], b['submit_not_responding'])
+
+        # deliveries
+        b['delivery_received'] = _with_latest(delivering, SupplyPointStatusTypes.DELIVERY_FACILITY,
+                                              SupplyPointStatusValues.RECEIVED)
+        b['delivery_not_received'] = _with_latest(delivering, SupplyPointStatusTypes.DELIVERY_FACILITY,
+                                                  SupplyPointStatusValues.NOT_RECEIVED)
+        b['delivery_reminder_sent'] = _with_latest(delivering, SupplyPointStatusTypes.DELIVERY_FACILITY,
+                                                   SupplyPointStatusValues.REMINDER_SENT)
+        b['delivery_not_responding'] = _minus(b['delivery_reminder_sent'], b['delivery_received'],
+                                              b['delivery_not_received'])
+
+        # supervision
+        b['supervision_received'] = _with_supervision(SupplyPointStatusValues.RECEIVED)
+        b['supervision_not_received'] = _with_supervision(SupplyPointStatusValues.NOT_RECEIVED)
+        b['supervision_reminder_sent'] = _with_supervision(SupplyPointStatusValues.REMINDER_SENT)
+        b['supervision_not_responding'] = _minus(b['supervision_reminder_sent'], b['supervision_received'],
+                                                 b['supervision_not_received'])
+        b['no_supervision_data'] = _minus(submitting, b['supervision_received'], b['supervision_not_received'],
+                                          b['supervision_reminder_sent'], b['supervision_not_responding'])
+
+        # stock on hand
+        b['soh_submitted'] = _with_latest(facilities, SupplyPointStatusTypes.SOH_FACILITY,
+                                          SupplyPointStatusValues.SUBMITTED)
+        b['soh_on_time'] = _with_state(facilities, soh_states, OnTimeStates.ON_TIME)
+        b['soh_late'] = _with_state(facilities, soh_states, OnTimeStates.LATE)
+        b['soh_not_responding'] = _with_state(facilities, soh_states, OnTimeStates.NO_DATA,
+                                              OnTimeStates.INSUFFICIENT_DATA)
+        b['stockouts_in_month'] = [f for f in facilities if f.pk in stocked_out]
+        return b
+
+    submitted = _bucket('submitted')
+    submitted_on_time = _bucket('submitted_on_time')
+    submitted_late = _bucket('submitted_late')
+    not_submitted = _bucket('not_submitted')
+    submit_reminder_sent = _bucket('submit_reminder_sent')
+    submit_not_responding = _bucket('submit_not_responding')
+    no_randr_data = _bucket('no_randr_data')
+
+    delivery_received = _bucket('delivery_received')
+    delivery_not_received = _bucket('delivery_not_received')
+    delivery_reminder_sent = _bucket('delivery_reminder_sent')
+    delivery_not_responding = _bucket('delivery_not_responding')
+
+    supervision_received = _bucket('supervision_received')
+    supervision_not_received = _bucket('supervision_not_received')
+    supervision_reminder_sent = _bucket('supervision_reminder_sent')
+    supervision_not_responding = _bucket('supervision_not_responding')
+    no_supervision_data = _bucket('no_supervision_data')
+
+    soh_submitted = _bucket('soh_submitted')
+    soh_on_time = _bucket('soh_on_time')
+    soh_late = _bucket('soh_late')
+    soh_not_responding = _bucket('soh_not_responding')
+
+    stockouts_in_month = _bucket('stockouts_in_month')
 
     @property
     def avg_lead_time(self):
         if not self.facilities: return "<span class='no_data'>None</span>"
+        now = datetime.utcnow()
+        monthly = monthly_lead_times(self.facilities)
         sum = timedelta(0)
         count = 0
         for f in self.facilities:
-            lt = avg_past_lead_time(f)
+            lt = average_lead_time(monthly.get(f.pk, {}), until=(now.year, now.month))
             if lt:
                 sum += lt
                 count += 1
@@ -180,7 +263,7 @@ class SupplyPointStatusBreakdown(object):
         if not of:
             of= len(self.facilities)
         else:
-            of = len(getattr(self.dg, of)(self.facilities))
+            of = len(self._group(of))
         return format_percent(len(getattr(self, fn)), of)
 
     percent_randr_on_time = curry(_percent, fn='submitted_on_time', of='submitting')
@@ -199,16 +282,8 @@ class SupplyPointStatusBreakdown(object):
     percent_supervision_reminder_sent = curry(_percent, fn='supervision_reminder_sent', of='submitting')
     percent_supervision_not_responding = curry(_percent, fn='supervision_not_responding', of='submitting')
 
-    @property
-    def stockouts_in_month(self):
-        # NOTE: Uses the report month/year, not the current month/year.
-        return [f for f in self.facilities if ProductReport.objects.filter(supply_point__pk=f.pk, quantity=0, report_date__month=self.report_month, report_date__year=self.report_year).count()]
-
     percent_stockouts_in_month = curry(_percent, fn='stockouts_in_month')
 
-    def stocked_out_of(self, product=None, month=None, year=None):
-        return [f for f in self.facilities if f.historical_stock(product, year, month, default_value=None) == 0]
-
     def stocked_out_of(self, product=None, month=None, year=None):
         return [f for f in self.facilities if f.historical_stock(product, year, month, default_value=None) == 0]
 
@@ -217,13 +292,9 @@ class SupplyPointStatusBreakdown(object):
         return format_percent(len(self.stocked_out_of(product=product, year=year, month=month)), len(self.facilities))
 
     def _response_rate(self, type=None):
-        num = 0.0
-        denom = 0.0
-        for f in self.dg.submitting(self.facilities):
-            hrr = historical_response_rate(f, type)
-            if hrr:
-                num += hrr[0]
-                denom += 1
+        rates = historical_response_rates(self.dg.submitting(self.facilities), type)
+        num = sum(hrr[0] for hrr in rates.values())
+        denom = float(len(rates))
         if denom:
             return "%.1f%%" % ((num / denom) * 100.0)
         else:
@@ -233,7 +304,6 @@ class SupplyPointStatusBreakdown(object):
     randr_response_rate = curry(_response_rate, type=SupplyPointStatusTypes.R_AND_R_FACILITY)
 
 
-
     def submission_chart(self):
         graph_data = [
                 {"display": _("Submitted On Time"),
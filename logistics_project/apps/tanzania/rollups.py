@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+from django.db.models import Q
+from logistics.models import SupplyPoint, ProductReport
+from logistics_project.apps.tanzania.models import SupplyPointStatus,\
+    SupplyPointStatusTypes, SupplyPointMonthlyRollup
+from logistics_project.apps.tanzania.utils import reporting_window,\
+    randr_reported_on_time, _soh_reported_on_time
+
+def _month_bounds(year, month):
+    start = datetime(year, month, 1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+def _latest_value(statuses):
+    values = statuses.order_by('-id').values_list('status_value', flat=True)[:1]
+    return values[0] if values else None
+
+def update_rollup(supply_point, year, month):
+    """
+    Recompute and save the monthly rollup for a supply point.
+    """
+    start, end = _month_bounds(year, month)
+    in_month = SupplyPointStatus.objects.filter(supply_point=supply_point,
+                                                status_date__gte=start,
+                                                status_date__lt=end)
+    sup_start, sup_end = reporting_window(SupplyPointStatusTypes.SUPERVISION_FACILITY,
+                                          year, month)
+    supervision = set(SupplyPointStatus.objects.filter\
+                            (supply_point=supply_point,
+                             status_type=SupplyPointStatusTypes.SUPERVISION_FACILITY,
+                             status_date__gt=sup_start,
+                             status_date__lte=sup_end)\
+                            .values_list('status_value', flat=True))
+
+    try:
+        rollup = SupplyPointMonthlyRollup.objects.get(supply_point=supply_point,
+                                                      year=year, month=month)
+    except SupplyPointMonthlyRollup.DoesNotExist:
+        rollup = SupplyPointMonthlyRollup(supply_point=supply_point,
+                                          year=year, month=month)
+    rollup.randr_status = _latest_value(in_month.filter\
+                            (status_type=SupplyPointStatusTypes.R_AND_R_FACILITY))
+    rollup.randr_on_time = randr_reported_on_time(supply_point, year, month)
+    rollup.delivery_status = _latest_value(in_month.filter\
+                            (status_type=SupplyPointStatusTypes.DELIVERY_FACILITY))
+    rollup.soh_status = _latest_value(in_month.filter\
+                            (status_type=SupplyPointStatusTypes.SOH_FACILITY))
+    rollup.soh_on_time = _soh_reported_on_time(supply_point, year, month)
+    rollup.set_supervision_values(supervision)
+    rollup.stockout = ProductReport.objects.filter(supply_point=supply_point,
+                                                   quantity=0,
+                                                   report_date__gte=start,
+                                                   report_date__lt=end).exists()
+    rollup.save()
+    return rollup
+
+def update_rollups_for_date(supply_point, date):
+    """
+    Something happened at a supply point on a date. Refresh the rollups
+    it can affect: its own month, and the next one, whose reporting
+    window starts at the end of this one.
+    """
+    update_rollup(supply_point, date.year, date.month)
+    update_rollup(supply_point, *_next_month(date.year, date.month))
+
+def _first_activity(supply_point):
+    """
+    The date of the first status or product report of a supply point,
+    or None if it has neither.
+    """
+    dates = list(SupplyPointStatus.objects.filter(supply_point=supply_point)\
+                    .order_by('status_date').values_list('status_date', flat=True)[:1])
+    dates += list(ProductReport.objects.filter(supply_point=supply_point)\
+                    .order_by('report_date').values_list('report_date', flat=True)[:1])
+    return min(dates) if dates else None
+
+def backfill_rollups(supply_points=None, since=None):
+    """
+    Compute rollups for every month from the first status or product
+    report of each supply point (or since the date passed in) until the
+    current month. Returns the number of rollups written.
+    """
+    if supply_points is None:
+        supply_points = SupplyPoint.objects.filter\
+            (Q(pk__in=SupplyPointStatus.objects.values('supply_point')) |
+             Q(pk__in=ProductReport.objects.values('supply_point')))
+    now = datetime.utcnow()
+    count = 0
+    for sp in supply_points:
+        first = since if since is not None else _first_activity(sp)
+        if first is None:
+            continue
+        year, month = first.year, first.month
+        while (year, month) <= (now.year, now.month):
+            update_rollup(sp, year, month)
+            count += 1
+            year, month = _next_month(year, month)
+    return count
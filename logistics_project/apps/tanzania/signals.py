@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# vim: ai ts=4 sts=4 et sw=4 encoding=utf-8
+
+from django.conf import settings
+from django.db.models.signals import post_save
+from logistics.models import ProductReport
+from logistics.const import Reports
+from logistics_project.apps.tanzania.models import SupplyPointStatus
+from logistics_project.apps.tanzania.spotcache import bump_generation
+
+def invalidate_spot_cache(sender, instance, **kwargs):
+    bump_generation(instance.supply_point_id)
+
+def update_rollups_on_status(sender, instance, created, **kwargs):
+    if not settings.LOGISTICS_USE_STATUS_ROLLUPS:
+        return
+    from logistics_project.apps.tanzania.rollups import update_rollups_for_date
+    update_rollups_for_date(instance.supply_point, instance.status_date)
+
+def statuses_saved(supply_points, date):
+    """
+    Do what the receivers above would for statuses written without
+    post_save, e.g. in bulk.
+    """
+    from logistics_project.apps.tanzania.rollups import update_rollups_for_date
+    for sp in supply_points:
+        bump_generation(sp.pk)
+        if settings.LOGISTICS_USE_STATUS_ROLLUPS:
+            update_rollups_for_date(sp, date)
+
+def update_rollups_on_report(sender, instance, created, **kwargs):
+    # only stock on hand reports and stockouts show up in the rollups
+    if settings.LOGISTICS_USE_STATUS_ROLLUPS and created and (instance.quantity == 0 or 
+                    instance.report_type.code == Reports.SOH):
+        from logistics_project.apps.tanzania.rollups import update_rollups_for_date
+        update_rollups_for_date(instance.supply_point, instance.report_date)
+
+post_save.connect(invalidate_spot_cache, sender=SupplyPointStatus)
+post_save.connect(invalidate_spot_cache, sender=ProductReport)
+post_save.connect(update_rollups_on_status, sender=SupplyPointStatus)
+post_save.connect(update_rollups_on_report, sender=ProductReport)
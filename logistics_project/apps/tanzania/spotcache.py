@@ -0,0 +1,66 @@
+"""
+Spot caching of per supply point calculations.
+
+Every cached value is keyed by its supply point's generation, a counter
+that is bumped whenever a status or product report is saved for the
+supply point (see signals.py). Bumping it orphans all the supply point's
+old entries at once, so they can be cached for a long time without ever
+going stale.
+"""
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from logistics_project.utils import generations
+
+# stands in for None in the cache, where None means a miss
+NONE_SENTINEL = "__spot_cache_none__"
+
+_stats = {"hits": 0, "misses": 0}
+
+def _generation_key(supply_point_id):
+    return "log-sp-generation-%s" % supply_point_id
+
+def get_generation(supply_point_id):
+    return generations.get_generation(_generation_key(supply_point_id),
+                                      settings.LOGISTICS_SPOT_CACHE_TIMEOUT)
+
+def bump_generation(supply_point_id):
+    generations.bump_generation(_generation_key(supply_point_id))
+
+def stats():
+    """
+    Hit and miss counts of this process since it started.
+    """
+    return dict(_stats)
+
+def _key(name, supply_point, args, kwargs):
+    params = [str(a) for a in args] + \
+             ["%s=%s" % (k, kwargs[k]) for k in sorted(kwargs)]
+    return ("log-%(name)s-%(sp)s-%(gen)s-%(params)s" % \
+            {"name": name, "sp": supply_point.pk,
+             "gen": get_generation(supply_point.pk),
+             "params": "-".join(params)}).replace(" ", "-")
+
+def spot_cached(name):
+    """
+    Decorator that caches a function whose first argument is a supply
+    point, when LOGISTICS_USE_SPOT_CACHING is on. None results are cached
+    too.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(supply_point, *args, **kwargs):
+            if not settings.LOGISTICS_USE_SPOT_CACHING:
+                return fn(supply_point, *args, **kwargs)
+            key = _key(name, supply_point, args, kwargs)
+            from_cache = cache.get(key)
+            if from_cache is not None:
+                _stats["hits"] += 1
+                return None if from_cache == NONE_SENTINEL else from_cache
+            _stats["misses"] += 1
+            ret = fn(supply_point, *args, **kwargs)
+            cache.set(key, NONE_SENTINEL if ret is None else ret,
+                      settings.LOGISTICS_SPOT_CACHE_TIMEOUT)
+            return ret
+        return wrapper
+    return decorator
@@ -7,7 +7,7 @@ from djtables.column import DateColumn
 from logistics_project.apps.tanzania.models import SupplyPointStatusTypes, SupplyPointStatusValues,\
     DeliveryGroups, OnTimeStates
 from logistics_project.apps.tanzania.templatetags.tz_tags import last_report_span, last_report_cell
-from logistics_project.apps.tanzania.utils import calc_lead_time, historical_response_rate, soh_reported_on_time, avg_past_lead_time
+from logistics_project.apps.tanzania.utils import historical_response_rates, soh_reported_on_time, monthly_lead_times, average_lead_time
 from logistics.models import SupplyPoint
 from utils import latest_status
 from rapidsms.models import Contact
@@ -26,9 +26,49 @@ class MonthTable(Table):
         else:
             self.month = datetime.utcnow().month
             self.year = datetime.utcnow().year
+        self._supply_points = kwargs.get('object_list')
+        self._response_rates = {}
+        self._lead_times = None
 
         super(MonthTable, self).__init__(**kwargs)
 
+    def get_response_rate(self, supply_point, type):
+        """
+        The historical response rate of a supply point in this table,
+        computed for every row at once the first time it's asked for.
+        """
+        if type not in self._response_rates:
+            self._response_rates[type] = historical_response_rates(self._supply_points, type)
+        return self._response_rates[type].get(supply_point.pk)
+
+    @property
+    def object_list(self):
+        ol = super(MonthTable, self).object_list
+        # response rates are sorted here, from the rates of every row,
+        # rather than by a sort key looking each row's up on its own
+        order_by = self._meta.order_by
+        if isinstance(order_by, basestring):
+            order_by = [order_by]
+        if order_by:
+            reverse = order_by[0].startswith("-")
+            name = order_by[0].lstrip("-")
+            for column in self.columns:
+                if isinstance(column, ResponseRateColumn) and \
+                   name in (column.name, column.bound_to[1]):
+                    ol = sorted(ol, key=lambda sp: self.get_response_rate(sp, column.type),
+                                reverse=reverse)
+                    break
+        return ol
+
+    def get_lead_times(self, supply_point):
+        """
+        The monthly lead times of a supply point in this table, computed
+        for every row at once the first time they're asked for.
+        """
+        if self._lead_times is None:
+            self._lead_times = monthly_lead_times(self._supply_points)
+        return self._lead_times.get(supply_point.pk, {})
+
 def _latest_status_or_none(cell, type, attr, value=None):
     t = latest_status(cell.object, type, month=cell.row.table.month, year=cell.row.table.year, value=value)
     if t and attr:
@@ -72,6 +112,15 @@ class RandRStatusTable(MonthTable):
         per_page = 9999
         order_by = ["Facility Name"]
 
+def _last_lead_time(cell):
+    table = cell.row.table
+    return table.get_lead_times(cell.object).get((table.year, table.month))
+
+def _average_lead_time(cell):
+    now = datetime.utcnow()
+    return average_lead_time(cell.row.table.get_lead_times(cell.object),
+                             until=(now.year, now.month))
+
 class DeliveryStatusTable(MonthTable):
     """
     Same as above but includes a column for the HSA
@@ -80,8 +129,8 @@ class DeliveryStatusTable(MonthTable):
     name = Column(name="Facility Name", value=lambda cell: cell.object.name, sort_key_fn=lambda obj: obj.name, link=supply_point_link)
     delivery_status = Column(sortable=False, name="Delivery Status", value=lambda cell: _latest_status_or_none(cell, SupplyPointStatusTypes.DELIVERY_FACILITY, "name"))
     delivery_date = DateColumn(sortable=False, name="Delivery Date", value=lambda cell: _latest_status_or_none(cell, SupplyPointStatusTypes.DELIVERY_FACILITY, "status_date"))
-    last_lead_time = Column(sortable=False, name="Last Lead Time", value=lambda cell: calc_lead_time(cell.object, month=cell.row.table.month, year=cell.row.table.year))
-    average_lead_time = Column(sortable=False, name="Average Lead Time", value=lambda cell: avg_past_lead_time(cell.object))
+    last_lead_time = Column(sortable=False, name="Last Lead Time", value=_last_lead_time)
+    average_lead_time = Column(sortable=False, name="Average Lead Time", value=_average_lead_time)
 
     class Meta:
         per_page = 9999
@@ -107,17 +156,21 @@ def _randr_css_class(cell):
     else:
         return "good_icon iconified"
 
-def _hrr_randr(sp):
-    r = historical_response_rate(sp, SupplyPointStatusTypes.R_AND_R_FACILITY)
+def _hrr(cell, type):
+    r = cell.row.table.get_response_rate(cell.object, type)
     return "<span title='%d of %d'>%s%%</span>" % (r[1], r[2], floatformat(r[0]*100.0)) if r else "No data"
 
-def _hrr_super(sp):
-    r = historical_response_rate(sp, SupplyPointStatusTypes.SUPERVISION_FACILITY)
-    return "<span title='%d of %d'>%s%%</span>" % (r[1], r[2], floatformat(r[0]*100.0)) if r else "No data"
-
-def _hrr_soh(sp):
-    r = historical_response_rate(sp, SupplyPointStatusTypes.SOH_FACILITY)
-    return "<span title='%d of %d'>%s%%</span>" % (r[1], r[2], floatformat(r[0]*100.0)) if r else "No data"
+class ResponseRateColumn(Column):
+    """
+    The historical response rate of each supply point in a MonthTable,
+    for a status type. The table sorts by it itself, so the sort key
+    here is a placeholder.
+    """
+    def __init__(self, type, **kwargs):
+        self.type = type
+        super(ResponseRateColumn, self).__init__(value=curry(_hrr, type=type),
+                                                 sort_key_fn=lambda sp: None,
+                                                 safe=True, **kwargs)
 
 def _dg_class(cell):
     if _dg(cell.object):
@@ -158,7 +211,7 @@ class RandRReportingHistoryTable(MonthTable):
                                      css_class=_randr_css_class,
                                      sortable=False)
     contact = Column(name="Contact", value=lambda cell: _default_contact(cell.object), sort_key_fn=_default_contact)
-    response_rate = Column(name="Historical Response Rate", safe=True, value=lambda cell: _hrr_randr(cell.object), sort_key_fn=lambda sp: historical_response_rate(sp, SupplyPointStatusTypes.R_AND_R_FACILITY))
+    response_rate = ResponseRateColumn(SupplyPointStatusTypes.R_AND_R_FACILITY, name="Historical Response Rate")
     @property
     def submitting_group(self):
         return DeliveryGroups(self.month).current_submitting_group()
@@ -172,7 +225,7 @@ class SupervisionTable(MonthTable):
     name = Column(name="Facility Name", value=lambda cell: cell.object.name, sort_key_fn=lambda obj: obj.name, link=supply_point_link)
     supervision_this_quarter = Column(sortable=False, name="Supervision This Quarter", value=lambda cell: _latest_status_or_none(cell, SupplyPointStatusTypes.SUPERVISION_FACILITY, "name"))
     date = DateColumn(sortable=False, value=lambda cell: _latest_status_or_none(cell, SupplyPointStatusTypes.SUPERVISION_FACILITY, "status_date"))
-    response_rate = Column(name="Historical Response Rate", safe=True, value=lambda cell: _hrr_super(cell.object), sort_key_fn=lambda sp: historical_response_rate(sp, SupplyPointStatusTypes.SUPERVISION_FACILITY))
+    response_rate = ResponseRateColumn(SupplyPointStatusTypes.SUPERVISION_FACILITY, name="Historical Response Rate")
 
     class Meta:
         per_page = 9999
@@ -244,7 +297,7 @@ class StockOnHandTable(MonthTable):
     name = Column(name="Facility Name", value=lambda cell: cell.object.name, sort_key_fn=lambda obj: obj.name, link=supply_point_link, css_class=_fac_name_class)
     delivery_group = Column(css_class=_dg_class, value=lambda cell: _dg(cell.object), sort_key_fn=_dg, name="D G")
     last_reported = Column(css_class=_ontime_class, value=lambda cell: last_report_span(cell.object, cell.row.table.year, cell.row.table.month, format=False))
-    response_rate = Column(name="Hist. Resp. Rate", safe=True, value=lambda cell: _hrr_soh(cell.object), sort_key_fn=lambda sp: historical_response_rate(sp, SupplyPointStatusTypes.SOH_FACILITY))
+    response_rate = ResponseRateColumn(SupplyPointStatusTypes.SOH_FACILITY, name="Hist. Resp. Rate")
 
     class Meta:
         per_page = 9999
@@ -1,13 +1,17 @@
+from .breakdown import *
 from .delivery import *
 from .deliverygroups import *
 from .help import *
 from .language import *
+from .lead_time import *
 from .loss_adjust import *
 from .messageinitiator import *
 from .randr import *
 from .registration import *
 from .reminders import *
 from .report_reminders import *
+from .response_rate import *
+from .rollups import *
 from .stockinquiry import *
 from .stockonhand import *
 from .stockout import *
@@ -0,0 +1,116 @@
+from datetime import datetime
+from django.conf import settings
+from logistics.models import SupplyPoint, SupplyPointGroup
+from rapidsms.models import Contact
+from logistics_project.apps.tanzania.reports import SupplyPointStatusBreakdown
+from logistics_project.apps.tanzania.rollups import backfill_rollups
+from logistics_project.apps.tanzania.tests.util import register_user
+from logistics_project.apps.tanzania.tests.base import TanzaniaTestScriptBase
+from logistics_project.apps.tanzania.models import DeliveryGroups, SupplyPointStatus,\
+    SupplyPointStatusTypes, SupplyPointStatusValues, SupplyPointMonthlyRollup
+
+class TestSupplyPointStatusBreakdown(TanzaniaTestScriptBase):
+
+    def setUp(self):
+        super(TestSupplyPointStatusBreakdown, self).setUp()
+        Contact.objects.all().delete()
+        SupplyPointStatus.objects.all().delete()
+        self.contact = register_user(self, "778", "someone")
+        self.sp = self.contact.supply_point
+        self.sp.groups = (SupplyPointGroup.objects.get\
+                          (code=DeliveryGroups().current_submitting_group()),)
+        self.sp.save()
+
+    def _breakdown(self):
+        now = datetime.utcnow()
+        return SupplyPointStatusBreakdown(SupplyPoint.objects.filter(pk=self.sp.pk),
+                                          year=now.year, month=now.month)
+
+    def _status(self, type, value):
+        # mid-month is inside both the calendar month and the reporting window
+        now = datetime.utcnow()
+        SupplyPointStatus.objects.create(supply_point=self.sp,
+                                         status_type=type,
+                                         status_value=value,
+                                         status_date=datetime(now.year, now.month, 15))
+
+    def testNoData(self):
+        bd = self._breakdown()
+        self.assertEqual([], bd.submitted)
+        self.assertEqual([], bd.not_submitted)
+        self.assertEqual([], bd.submit_not_responding)
+        self.assertEqual([self.sp], bd.no_randr_data)
+        self.assertEqual([self.sp], bd.no_supervision_data)
+
+    def testLatestStatusWins(self):
+        self._status(SupplyPointStatusTypes.R_AND_R_FACILITY,
+                     SupplyPointStatusValues.REMINDER_SENT)
+        bd = self._breakdown()
+        self.assertEqual([self.sp], bd.submit_reminder_sent)
+        self.assertEqual([self.sp], bd.submit_not_responding)
+
+        self._status(SupplyPointStatusTypes.R_AND_R_FACILITY,
+                     SupplyPointStatusValues.NOT_SUBMITTED)
+        bd = self._breakdown()
+        self.assertEqual([], bd.submit_reminder_sent)
+        self.assertEqual([], bd.submit_not_responding)
+        self.assertEqual([self.sp], bd.not_submitted)
+
+        self._status(SupplyPointStatusTypes.R_AND_R_FACILITY,
+                     SupplyPointStatusValues.SUBMITTED)
+        bd = self._breakdown()
+        self.assertEqual([], bd.not_submitted)
+        self.assertEqual([self.sp], bd.submitted)
+
+    def testSupervision(self):
+        self._status(SupplyPointStatusTypes.SUPERVISION_FACILITY,
+                     SupplyPointStatusValues.REMINDER_SENT)
+        bd = self._breakdown()
+        self.assertEqual([self.sp], bd.supervision_not_responding)
+
+        self._status(SupplyPointStatusTypes.SUPERVISION_FACILITY,
+                     SupplyPointStatusValues.RECEIVED)
+        bd = self._breakdown()
+        self.assertEqual([self.sp], bd.supervision_received)
+        self.assertEqual([], bd.supervision_not_responding)
+        self.assertEqual([], bd.no_supervision_data)
+
+    def testBucketsComputedOnce(self):
+        bd = self._breakdown()
+        bd.submitted
+        self.assertTrue(bd._buckets is not None)
+        buckets = bd._buckets
+        bd.soh_on_time
+        bd.percent_randr_on_time()
+        self.assertTrue(buckets is bd._buckets)
+
+    def _classify(self, use_rollups):
+        old = settings.LOGISTICS_USE_STATUS_ROLLUPS
+        settings.LOGISTICS_USE_STATUS_ROLLUPS = use_rollups
+        try:
+            return self._breakdown()._classify()
+        finally:
+            settings.LOGISTICS_USE_STATUS_ROLLUPS = old
+
+    def _assertRollupsMatchLog(self):
+        SupplyPointMonthlyRollup.objects.all().delete()
+        backfill_rollups()
+        self.assertEqual(self._classify(False), self._classify(True))
+
+    def testRollupsMatchLog(self):
+        self._status(SupplyPointStatusTypes.R_AND_R_FACILITY,
+                     SupplyPointStatusValues.SUBMITTED)
+        self._status(SupplyPointStatusTypes.SUPERVISION_FACILITY,
+                     SupplyPointStatusValues.REMINDER_SENT)
+        self._assertRollupsMatchLog()
+
+        # a reminder and an answer in the same window both count
+        self._status(SupplyPointStatusTypes.SUPERVISION_FACILITY,
+                     SupplyPointStatusValues.NOT_RECEIVED)
+        self._assertRollupsMatchLog()
+        self.assertEqual([self.sp], self._classify(True)['supervision_reminder_sent'])
+        self.assertEqual([self.sp], self._classify(True)['supervision_not_received'])
+
+        self._status(SupplyPointStatusTypes.SUPERVISION_FACILITY,
+                     SupplyPointStatusValues.RECEIVED)
+        self._assertRollupsMatchLog()
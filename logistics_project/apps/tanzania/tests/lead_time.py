@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+from logistics.models import SupplyPoint
+from rapidsms.models import Contact
+from logistics_project.apps.tanzania.utils import monthly_lead_times,\
+    average_lead_time, calc_lead_time
+from logistics_project.apps.tanzania.tests.util import register_user
+from logistics_project.apps.tanzania.tests.base import TanzaniaTestScriptBase
+from logistics_project.apps.tanzania.models import SupplyPointStatus,\
+    SupplyPointStatusTypes, SupplyPointStatusValues
+
+class TestLeadTimes(TanzaniaTestScriptBase):
+
+    def setUp(self):
+        super(TestLeadTimes, self).setUp()
+        Contact.objects.all().delete()
+        SupplyPointStatus.objects.all().delete()
+        self.sp = register_user(self, "778", "someone").supply_point
+
+    def _submitted(self, date):
+        SupplyPointStatus.objects.create(supply_point=self.sp,
+                                         status_type=SupplyPointStatusTypes.R_AND_R_FACILITY,
+                                         status_value=SupplyPointStatusValues.SUBMITTED,
+                                         status_date=date)
+
+    def _received(self, date):
+        SupplyPointStatus.objects.create(supply_point=self.sp,
+                                         status_type=SupplyPointStatusTypes.DELIVERY_FACILITY,
+                                         status_value=SupplyPointStatusValues.RECEIVED,
+                                         status_date=date)
+
+    def _monthly(self):
+        return monthly_lead_times(SupplyPoint.objects.filter(pk=self.sp.pk)).get(self.sp.pk, {})
+
+    def testNoData(self):
+        self.assertEqual({}, self._monthly())
+        self.assertEqual(None, average_lead_time(self._monthly()))
+
+    def testPairsWithPrecedingSubmission(self):
+        self._submitted(datetime(2011, 1, 5))
+        self._received(datetime(2011, 2, 4))
+        self._submitted(datetime(2011, 4, 5))
+        self._received(datetime(2011, 4, 15))
+        monthly = self._monthly()
+        self.assertEqual({(2011, 2): timedelta(days=30),
+                          (2011, 4): timedelta(days=10)}, monthly)
+        for year, month in monthly:
+            self.assertEqual(monthly[(year, month)], 
+                             calc_lead_time(self.sp, year=year, month=month))
+        self.assertEqual(timedelta(days=20), average_lead_time(monthly))
+        self.assertEqual(timedelta(days=30), average_lead_time(monthly, until=(2011, 3)))
+        self.assertEqual(timedelta(days=10), average_lead_time(monthly, since=(2011, 3)))
+
+    def testWrongCycle(self):
+        self._submitted(datetime(2011, 1, 5))
+        self._received(datetime(2011, 6, 5))
+        self.assertEqual({(2011, 6): None}, self._monthly())
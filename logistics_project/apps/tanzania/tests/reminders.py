@@ -1,5 +1,8 @@
 from logistics_project.apps.tanzania.reminders import stockonhand , delivery,\
     randr, stockonhandthankyou, supervision
+from logistics_project.apps.tanzania.reminders import update_statuses
+from logistics_project.utils import connections
+from logistics_project.utils.connections import default_connections
 from logistics_project.apps.tanzania.tests.util import register_user
 from logistics_project.apps.tanzania.tests.base import TanzaniaTestScriptBase
 from logistics_project.apps.tanzania.config import SupplyPointCodes
@@ -209,3 +212,48 @@ class TestSOHThankYou(TanzaniaTestScriptBase):
 
         self.assertEqual(1, len(list(stockonhandthankyou.get_people(now))))
         self.assertEqual(0, len(list(stockonhandthankyou.get_people(datetime.utcnow()))))
+
+class TestDefaultConnections(TanzaniaTestScriptBase):
+
+    def setUp(self):
+        super(TestDefaultConnections, self).setUp()
+        Contact.objects.all().delete()
+        self.contact = register_user(self, "778", "someone")
+
+    def testMatchesContact(self):
+        conns = default_connections([self.contact])
+        self.assertEqual(self.contact.default_connection, conns[self.contact.pk])
+        self.assertEqual({}, default_connections([]))
+
+    def testBatches(self):
+        other = register_user(self, "779", "someone else")
+        batch_size = connections.BATCH_SIZE
+        connections.BATCH_SIZE = 1
+        try:
+            conns = default_connections([self.contact, other])
+        finally:
+            connections.BATCH_SIZE = batch_size
+        self.assertEqual(self.contact.default_connection, conns[self.contact.pk])
+        self.assertEqual(other.default_connection, conns[other.pk])
+
+class TestUpdateStatuses(TanzaniaTestScriptBase):
+
+    def setUp(self):
+        super(TestUpdateStatuses, self).setUp()
+        Contact.objects.all().delete()
+        SupplyPointStatus.objects.all().delete()
+        self.contact = register_user(self, "778", "someone")
+
+    def testOneStatusPerSupplyPoint(self):
+        update_statuses([self.contact, self.contact],
+                        SupplyPointStatusTypes.SOH_FACILITY,
+                        SupplyPointStatusValues.REMINDER_SENT)
+        statuses = SupplyPointStatus.objects.all()
+        self.assertEqual(1, statuses.count())
+        self.assertEqual(self.contact.supply_point, statuses[0].supply_point)
+        self.assertEqual(SupplyPointStatusValues.REMINDER_SENT, statuses[0].status_value)
+
+    def testIllegalCombination(self):
+        self.assertRaises(ValueError, update_statuses, [self.contact],
+                          SupplyPointStatusTypes.SOH_FACILITY,
+                          SupplyPointStatusValues.RECEIVED)
@@ -0,0 +1,53 @@
+from datetime import datetime
+from logistics.models import SupplyPoint
+from rapidsms.models import Contact
+from logistics_project.apps.tanzania.utils import historical_response_rate,\
+    historical_response_rates
+from logistics_project.apps.tanzania.tables import RandRReportingHistoryTable
+from logistics_project.apps.tanzania.tests.util import register_user
+from logistics_project.apps.tanzania.tests.base import TanzaniaTestScriptBase
+from logistics_project.apps.tanzania.models import SupplyPointStatus,\
+    SupplyPointStatusTypes, SupplyPointStatusValues
+
+class TestHistoricalResponseRates(TanzaniaTestScriptBase):
+
+    def setUp(self):
+        super(TestHistoricalResponseRates, self).setUp()
+        Contact.objects.all().delete()
+        SupplyPointStatus.objects.all().delete()
+        self.sp = register_user(self, "778", "someone").supply_point
+
+    def _status(self, value, year, month, sp=None):
+        SupplyPointStatus.objects.create(supply_point=sp or self.sp,
+                                         status_type=SupplyPointStatusTypes.R_AND_R_FACILITY,
+                                         status_value=value,
+                                         status_date=datetime(year, month, 10))
+
+    def testNoData(self):
+        sps = SupplyPoint.objects.filter(pk=self.sp.pk)
+        self.assertEqual({}, historical_response_rates(sps, SupplyPointStatusTypes.R_AND_R_FACILITY))
+
+    def testRates(self):
+        # responded in january, only reminded in february and march
+        self._status(SupplyPointStatusValues.REMINDER_SENT, 2011, 1)
+        self._status(SupplyPointStatusValues.SUBMITTED, 2011, 1)
+        self._status(SupplyPointStatusValues.REMINDER_SENT, 2011, 2)
+        self._status(SupplyPointStatusValues.REMINDER_SENT, 2011, 3)
+        self._status(SupplyPointStatusValues.REMINDER_SENT, 2011, 3)
+        sps = SupplyPoint.objects.filter(pk=self.sp.pk)
+        rates = historical_response_rates(sps, SupplyPointStatusTypes.R_AND_R_FACILITY)
+        self.assertEqual({self.sp.pk: (1.0/3.0, 1, 3)}, rates)
+        self.assertEqual(rates[self.sp.pk], 
+                         historical_response_rate(self.sp, SupplyPointStatusTypes.R_AND_R_FACILITY))
+        self.assertEqual({}, historical_response_rates(sps, SupplyPointStatusTypes.SOH_FACILITY))
+
+    def testTableSortedByRate(self):
+        other = SupplyPoint.objects.get(code="D31049")
+        self._status(SupplyPointStatusValues.SUBMITTED, 2011, 1)
+        self._status(SupplyPointStatusValues.REMINDER_SENT, 2011, 2)
+        self._status(SupplyPointStatusValues.SUBMITTED, 2011, 1, sp=other)
+        sps = SupplyPoint.objects.filter(pk__in=[self.sp.pk, other.pk])
+        table = RandRReportingHistoryTable(object_list=sps, order_by="-Historical Response Rate")
+        self.assertEqual([other, self.sp], list(table.object_list))
+        table = RandRReportingHistoryTable(object_list=sps, order_by="Historical Response Rate")
+        self.assertEqual([self.sp, other], list(table.object_list))
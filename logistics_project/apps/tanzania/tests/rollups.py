@@ -0,0 +1,75 @@
+from datetime import datetime
+from django.conf import settings
+from rapidsms.models import Contact
+from logistics_project.apps.tanzania.rollups import backfill_rollups
+from logistics_project.apps.tanzania.tests.util import register_user
+from logistics_project.apps.tanzania.tests.base import TanzaniaTestScriptBase
+from logistics_project.apps.tanzania.models import SupplyPointStatus,\
+    SupplyPointStatusTypes, SupplyPointStatusValues, SupplyPointMonthlyRollup
+
+class TestMonthlyRollups(TanzaniaTestScriptBase):
+
+    def setUp(self):
+        super(TestMonthlyRollups, self).setUp()
+        self._use_rollups = settings.LOGISTICS_USE_STATUS_ROLLUPS
+        settings.LOGISTICS_USE_STATUS_ROLLUPS = True
+        Contact.objects.all().delete()
+        SupplyPointStatus.objects.all().delete()
+        SupplyPointMonthlyRollup.objects.all().delete()
+        self.contact = register_user(self, "778", "someone")
+        self.sp = self.contact.supply_point
+
+    def tearDown(self):
+        settings.LOGISTICS_USE_STATUS_ROLLUPS = self._use_rollups
+        super(TestMonthlyRollups, self).tearDown()
+
+    def _rollup(self):
+        now = datetime.utcnow()
+        return SupplyPointMonthlyRollup.objects.get(supply_point=self.sp,
+                                                    year=now.year, month=now.month)
+
+    def testStatusUpdatesRollup(self):
+        self.assertEqual(0, SupplyPointMonthlyRollup.objects.count())
+        self.runScript("""
+            778 > nimetuma
+        """)
+        self.assertEqual(SupplyPointStatusValues.SUBMITTED, self._rollup().randr_status)
+
+        self.runScript("""
+            778 > nimepokea
+        """)
+        rollup = self._rollup()
+        self.assertEqual(SupplyPointStatusValues.SUBMITTED, rollup.randr_status)
+        self.assertEqual(SupplyPointStatusValues.RECEIVED, rollup.delivery_status)
+
+    def testStockoutUpdatesRollup(self):
+        self.runScript("""
+            778 > Hmk Id 400 Dp 0 Ip 678
+        """)
+        self.assertTrue(self._rollup().stockout)
+
+    def testBackfill(self):
+        self.runScript("""
+            778 > nimetuma
+        """)
+        SupplyPointMonthlyRollup.objects.all().delete()
+        self.assertTrue(backfill_rollups() >= 1)
+        self.assertEqual(SupplyPointStatusValues.SUBMITTED, self._rollup().randr_status)
+
+    def testBackfillReportsOnly(self):
+        # a stock on hand report with no status left in the log still
+        # gets its month rolled up
+        self.runScript("""
+            778 > Hmk Id 400 Dp 0 Ip 678
+        """)
+        SupplyPointStatus.objects.all().delete()
+        SupplyPointMonthlyRollup.objects.all().delete()
+        self.assertTrue(backfill_rollups() >= 1)
+        self.assertTrue(self._rollup().stockout)
+
+    def testNotMaintainedWhenOff(self):
+        settings.LOGISTICS_USE_STATUS_ROLLUPS = False
+        self.runScript("""
+            778 > nimetuma
+        """)
+        self.assertEqual(0, SupplyPointMonthlyRollup.objects.count())
@@ -1,14 +1,17 @@
 from datetime import datetime,timedelta, time
+from django.db import connection
 from django.db.models.aggregates import Max
 from django.db.models.query_utils import Q
-from logistics_project import settings
+from django.utils.datastructures import SortedDict
 from logistics_project.apps.tanzania.models import SupplyPointStatus, DeliveryGroups,\
     SupplyPointStatusValues, SupplyPointStatusTypes, OnTimeStates, DeliveryGroupReport
 from logistics.models import SupplyPoint, ProductReport
 from logistics.const import Reports
 from dimagi.utils.dates import get_business_day_of_month, get_business_day_of_month_before
+from itertools import groupby
 import logging
-from django.core.cache import cache
+from logistics_project.apps.tanzania.spotcache import spot_cached
+from logistics_project.apps.hierarchy.utils import supply_point_ids_below
 
 logger = logging.getLogger(__name__)
 
@@ -28,11 +31,7 @@ def format_percent(a, b):
 
 def supply_points_below(location):
     if not location: return None
-        # covers facility->district->region->national
-    return SupplyPoint.objects.filter(Q(location=location) | \
-                             Q(supplied_by__location=location) | \
-                             Q(supplied_by__supplied_by__location=location) | \
-                             Q(supplied_by__supplied_by__supplied_by__location=location))
+    return SupplyPoint.objects.filter(pk__in=supply_point_ids_below(location))
 
 def facilities_below(location):
     c = supply_points_below(location)
@@ -119,20 +118,18 @@ def supply_points_with_latest_status_by_datespan(sps, status_type, status_value,
 def soh(sp, product, month=None, year=None):
     ProductReport.objects.filter(type=Reports.SOH)
 
+@spot_cached("lead-time")
 def calc_lead_time(supply_point, year=None, month=None):
     """
     The days elapsed from the day they respond "submitted" to the day they 
     respond "delivered". Only include the last period for now
     """
-    def _cache_key():
-            return (("log-lead-time-%(fac)s-%(month)s-%(year)s" % \
-                    {"fac": supply_point.code, "month": month, "year":year}).replace(" ", "-"))
-    key = _cache_key()
-    if settings.LOGISTICS_USE_SPOT_CACHING:
-        from_cache = cache.get(key)
-        if from_cache:
-            return from_cache
+    return _calc_lead_time(supply_point, year, month)
 
+def _calc_lead_time(supply_point, year=None, month=None):
+    """
+    Uncached version of calc_lead_time
+    """
     deliveries = SupplyPointStatus.objects.filter\
                         (supply_point=supply_point, 
                          status_type__in=[SupplyPointStatusTypes.DELIVERY_FACILITY,
@@ -155,34 +152,62 @@ def calc_lead_time(supply_point, year=None, month=None):
             if lead_time < timedelta(days=100):
                 # if it's more than 100 days it's likely the wrong cycle
                 ret = lead_time
-    if settings.LOGISTICS_USE_SPOT_CACHING:
-        cache.set(key, ret, settings.LOGISTICS_SPOT_CACHE_TIMEOUT)
     return ret
 
-def avg_past_lead_time(supply_point):
-    if not SupplyPointStatus.objects.filter(supply_point=supply_point).count(): return None
-    earliest = SupplyPointStatus.objects.filter(supply_point=supply_point).order_by('status_date')[0]
-
-    earliest_year = earliest.status_date.year
-    earliest_month = earliest.status_date.month
-    now_year = datetime.now().year
-    now_month = datetime.now().month
-
-    total_time = timedelta(days=0)
-    count = 0
+def monthly_lead_times(supply_points):
+    """
+    The lead time for every month with a delivery, for every supply
+    point in a queryset, from one pass over their statuses. Returns a 
+    dict of {supply point id: {(year, month): lead time}}.
+    
+    Each month's value is what calc_lead_time would return for it: the
+    time between the last delivery in the month and the submission 
+    before it, or None if that's too long to be the same cycle.
+    """
+    rows = SupplyPointStatus.objects.filter(supply_point__in=supply_points).filter(
+        Q(status_type__in=[SupplyPointStatusTypes.DELIVERY_FACILITY,
+                           SupplyPointStatusTypes.DELIVERY_DISTRICT],
+          status_value=SupplyPointStatusValues.RECEIVED) |
+        Q(status_type__in=[SupplyPointStatusTypes.R_AND_R_FACILITY,
+                           SupplyPointStatusTypes.R_AND_R_DISTRICT],
+          status_value=SupplyPointStatusValues.SUBMITTED))\
+        .order_by('supply_point', 'status_date')\
+        .values_list('supply_point', 'status_date', 'status_value')
+    ret = {}
+    for sp_id, statuses in groupby(rows.iterator(), lambda row: row[0]):
+        monthly = ret.setdefault(sp_id, {})
+        last_submission = None
+        # submissions go before deliveries at the same time, to match 
+        # calc_lead_time's status_date__lte
+        for _, date, value in sorted(statuses, key=lambda row: \
+                (row[1], row[2] == SupplyPointStatusValues.RECEIVED)):
+            if value == SupplyPointStatusValues.SUBMITTED:
+                last_submission = date
+                continue
+            lead_time = None
+            if last_submission is not None:
+                lead_time = date - last_submission
+                if lead_time >= timedelta(days=100):
+                    # if it's more than 100 days it's likely the wrong cycle
+                    lead_time = None
+            monthly[(date.year, date.month)] = lead_time
+    return ret
 
-    while now_year != earliest_year and now_month != earliest_month:
-        ltime = calc_lead_time(supply_point, year=now_year, month=now_month)
-        if ltime is not None:
-            total_time += ltime
-            count += 1
-        if now_month == 1:
-            now_month = 12
-            now_year -= 1
-        else:
-            now_month -= 1
+def average_lead_time(monthly, since=None, until=None):
+    """
+    Averages one supply point's monthly_lead_times between two
+    (year, month) tuples, inclusive. Returns None if there were none.
+    """
+    times = [lt for month, lt in monthly.items() 
+             if lt is not None and (since is None or month >= since) \
+                and (until is None or month <= until)]
+    return sum(times, timedelta(0)) / len(times) if times else None
 
-    return total_time / count if count else None
+def avg_past_lead_time(supply_point):
+    now = datetime.utcnow()
+    monthly = monthly_lead_times(SupplyPoint.objects.filter(pk=supply_point.pk))
+    return average_lead_time(monthly.get(supply_point.pk, {}), 
+                             until=(now.year, now.month))
 
 def get_user_location(user):
     """
@@ -201,25 +226,19 @@ def last_stock_on_hand(facility):
     tomorrow = datetime(tomorrow_now.year, tomorrow_now.month, tomorrow_now.day)
     return last_stock_on_hand_before(facility, tomorrow)
 
+@spot_cached("last-soh-before")
 def last_stock_on_hand_before(facility, date):
-    def _cache_key():
-        return (("log-last_stock_on_hand_before-%(fac)s-%(date)s" % \
-                {"fac": facility.code, "date": date}).replace(" ", "-"))
-    key = _cache_key()
-    if settings.LOGISTICS_USE_SPOT_CACHING: 
-        from_cache = cache.get(key)
-        if from_cache:
-            return from_cache
-            
-    
+    return _last_stock_on_hand_before(facility, date)
+
+def _last_stock_on_hand_before(facility, date):
+    """
+    Uncached version of last_stock_on_hand_before
+    """
     reports = ProductReport.objects.filter(supply_point=facility,
                                            report_type__code=Reports.SOH,
                                            report_date__lt=date)\
                                            .order_by('-report_date')
-    ret = reports[0] if reports.exists() else None
-    if settings.LOGISTICS_USE_SPOT_CACHING: 
-        cache.set(key, ret, settings.LOGISTICS_SPOT_CACHE_TIMEOUT)
-    return ret
+    return reports[0] if reports.exists() else None
 
 def last_status_before(facility, date, type, value=None):
     statuses = SupplyPointStatus.objects.filter(supply_point=facility,
@@ -231,16 +250,16 @@ def last_status_before(facility, date, type, value=None):
 
     return statuses[0] if statuses.exists() else None
 
+@spot_cached("soh-on-time")
 def soh_reported_on_time(supply_point, year, month):
-    key = "log_soh_reported_on_time-%(sp)s-%(year)s-%(month)s" % \
-        {"sp": supply_point.code, "year": year, "month": month}
-    if settings.LOGISTICS_USE_SPOT_CACHING:
-        from_cache = cache.get(key)
-        if from_cache: return from_cache
-        
-    
+    return _soh_reported_on_time(supply_point, year, month)
+
+def _soh_reported_on_time(supply_point, year, month):
+    """
+    Uncached version of soh_reported_on_time
+    """
     last_bd_of_the_month = get_business_day_of_month(year, month, -1)
-    last_report = last_stock_on_hand_before(supply_point, last_bd_of_the_month)
+    last_report = _last_stock_on_hand_before(supply_point, last_bd_of_the_month)
     last_of_last_month = datetime(year, month, 1) - timedelta(days=1)
     last_bd_of_last_month = datetime.combine\
        (get_business_day_of_month(last_of_last_month.year,
@@ -250,9 +269,6 @@ def soh_reported_on_time(supply_point, year, month):
         ret = _reported_on_time(last_bd_of_last_month, last_report.report_date)
     else:
         ret = OnTimeStates.NO_DATA
-
-    if settings.LOGISTICS_USE_SPOT_CACHING:
-        cache.set(key, ret, settings.LOGISTICS_SPOT_CACHE_TIMEOUT)
     return ret
 
 def randr_reported_on_time(supply_point, year, month):
@@ -290,26 +306,46 @@ def submitted_to_msd(districts, month, year):
             count += dg[0].quantity
     return count
 
-def historical_response_rate(supply_point, type):
-    key = "hrr-%(sp)s-%(type)s" % {"sp": supply_point.pk, "type": type}
-    if settings.LOGISTICS_USE_SPOT_CACHING:
-        from_cache = cache.get(key)
-        if from_cache: return from_cache
-        
-    statuses = SupplyPointStatus.objects.filter(supply_point=supply_point, status_type=type).order_by("-status_date")
-    if not statuses.count(): return None
-    status_month_years = set([(x.status_date.month, x.status_date.year) for x in statuses])
-    denom = len(status_month_years)
-    num = 0
-    for s in status_month_years:
-        f = statuses.filter(status_date__month=s[0], status_date__year=s[1]).filter(
-            Q(status_value=SupplyPointStatusValues.SUBMITTED) |
-            Q(status_value=SupplyPointStatusValues.NOT_SUBMITTED) |
-            Q(status_value=SupplyPointStatusValues.RECEIVED) |
-            Q(status_value=SupplyPointStatusValues.NOT_RECEIVED)).order_by("-status_date")
-        if f.count(): num += 1
-    ret = float(num)/float(denom), num, denom
-    if settings.LOGISTICS_USE_SPOT_CACHING:
-        cache.set(key, ret, settings.LOGISTICS_SPOT_CACHE_TIMEOUT)
+RESPONSE_VALUES = (SupplyPointStatusValues.SUBMITTED,
+                   SupplyPointStatusValues.NOT_SUBMITTED,
+                   SupplyPointStatusValues.RECEIVED,
+                   SupplyPointStatusValues.NOT_RECEIVED)
+
+def historical_response_rates(supply_points, type):
+    """
+    The historical response rate of every supply point in a queryset,
+    as a dict of {supply point id: (rate, months responded, months with
+    a status)}. Supply points without any status of the type are left 
+    out, like historical_response_rate returns None for them.
+    
+    This is one query, returning at most two rows per supply point and
+    month: whether there was a status, and whether there was a response.
+    """
+    table = connection.ops.quote_name(SupplyPointStatus._meta.db_table)
+    column = "%s.%s" % (table, connection.ops.quote_name("status_date"))
+    value = "%s.%s" % (table, connection.ops.quote_name("status_value"))
+    rows = SupplyPointStatus.objects.filter(supply_point__in=supply_points, 
+                                            status_type=type)\
+            .extra(select=SortedDict([
+                        ("status_month", connection.ops.date_trunc_sql("month", column)),
+                        ("responded", "CASE WHEN %s IN (%s) THEN 1 ELSE 0 END" % \
+                            (value, ", ".join(["%s"] * len(RESPONSE_VALUES))))]),
+                   select_params=RESPONSE_VALUES)\
+            .order_by().values_list("supply_point", "status_month", "responded").distinct()
+    months = {}
+    responded = {}
+    for sp_id, month, response in rows:
+        months.setdefault(sp_id, set()).add(month)
+        if response:
+            responded.setdefault(sp_id, set()).add(month)
+    ret = {}
+    for sp_id, status_months in months.items():
+        num = len(responded.get(sp_id, ()))
+        denom = len(status_months)
+        ret[sp_id] = float(num)/float(denom), num, denom
     return ret
 
+@spot_cached("hrr")
+def historical_response_rate(supply_point, type):
+    return historical_response_rates(SupplyPoint.objects.filter(pk=supply_point.pk), 
+                                     type).get(supply_point.pk)
@@ -4,13 +4,269 @@
 from rapidsms.backends.http import RapidHttpBackend
 from xml.sax.saxutils import escape
 from django.http import HttpResponse
+import atexit
 import datetime
-import urllib2
+import httplib
+import logging
+import select
+import socket
+import threading
+import time
+import urlparse
+
+class GatewayError(Exception):
+    pass
+
+class GatewayUnreachable(GatewayError):
+    """
+    The request never got to the gateway, so it is safe to send again.
+    """
+    pass
+
+class GatewayConnection(object):
+    """
+    A keep-alive HTTP connection to the gateway, reopened if it drops.
+    Not thread safe: each sending thread has its own.
+    """
+
+    def __init__(self, url, timeout=30):
+        parts = urlparse.urlsplit(url)
+        self.connection_class = httplib.HTTPSConnection if parts.scheme == "https" \
+                                else httplib.HTTPConnection
+        self.netloc = parts.netloc
+        self.path = (parts.path or "/") + ("?%s" % parts.query if parts.query else "")
+        self.timeout = timeout
+        self._conn = None
+
+    def _dropped(self):
+        # an idle keep-alive socket with something to read has been
+        # closed by the gateway
+        sock = self._conn.sock
+        return sock is None or bool(select.select([sock], [], [], 0)[0])
+
+    def post(self, body):
+        """
+        POST to the gateway. Raises GatewayUnreachable if it couldn't
+        connect; any other error may come after the gateway got the 
+        request.
+        """
+        if self._conn is not None and self._dropped():
+            self.close()
+        if self._conn is None:
+            conn = self.connection_class(self.netloc, timeout=self.timeout)
+            try:
+                conn.connect()
+            except (httplib.HTTPException, socket.error) as e:
+                raise GatewayUnreachable("couldn't connect to the gateway: %s" % e)
+            self._conn = conn
+        try:
+            self._conn.request("POST", self.path, body,
+                               {"Content-Type": "application/xml"})
+            response = self._conn.getresponse()
+            data = response.read()
+        except (httplib.HTTPException, socket.error):
+            self.close()
+            raise
+        if response.status >= 400:
+            raise GatewayError("gateway returned %s: %s" % (response.status, data))
+        return data
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class Delivery(object):
+    """
+    The outcome of a queued message, for whoever queued it to wait on.
+    """
+
+    def __init__(self):
+        self.ok = None
+        self._done = threading.Event()
+
+    def finish(self, ok):
+        self.ok = ok
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        Whether the message was sent; None if it hasn't been yet.
+        """
+        self._done.wait(timeout)
+        return self.ok
+
+class SendQueue(object):
+    """
+    Outgoing messages waiting for the gateway. Messages with the same
+    text are sent together, up to batch_size numbers per request, waiting
+    at most batch_wait seconds for others to join them. Whatever is still
+    queued is sent before the process exits, waiting at most 
+    shutdown_timeout seconds.
+    """
+
+    def __init__(self, deliver, workers=2, batch_size=50, batch_wait=0.5,
+                 shutdown_timeout=30):
+        self.deliver = deliver
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.shutdown_timeout = shutdown_timeout
+        # text -> [(number, time queued, delivery)], in the order texts arrived
+        self._pending = {}
+        self._order = []
+        self._depth = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._closing = False
+        self._registered = False
+        self._stats = {"sent": 0, "failed": 0, "requests": 0, 
+                       "request_seconds": 0.0, "max_request_seconds": 0.0,
+                       "wait_seconds": 0.0}
+
+    def put(self, number, text):
+        """
+        Queue a message. Returns its Delivery.
+        """
+        delivery = Delivery()
+        with self._cond:
+            if not self._threads:
+                self._start()
+            if text not in self._pending:
+                self._pending[text] = []
+                self._order.append(text)
+            self._pending[text].append((number, time.time(), delivery))
+            self._depth += 1
+            self._cond.notify()
+        return delivery
+
+    def flush(self, timeout=None):
+        """
+        Block until everything queued so far has been sent or has failed.
+        Returns whether it got there before the timeout.
+        """
+        end = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while self._depth or self._in_flight:
+                if end is None:
+                    self._cond.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Send what is queued, then stop the threads. Returns whether
+        everything went before the timeout.
+        """
+        with self._cond:
+            # send everything now, without waiting for batches to fill
+            self._closing = True
+            self._cond.notify_all()
+        done = self.flush(timeout)
+        for t in self._threads:
+            t.join(0 if not done else None)
+        self._threads = []
+        return done
+
+    def _shutdown(self):
+        if not self.close(self.shutdown_timeout):
+            logging.error("push queue shut down with %s messages unsent" % self._depth)
+
+    def stats(self):
+        with self._cond:
+            ret = dict(self._stats)
+            ret["queued"] = self._depth
+            ret["in_flight"] = self._in_flight
+        requests = ret["requests"]
+        ret["avg_request_seconds"] = ret["request_seconds"] / requests if requests else 0.0
+        done = ret["sent"] + ret["failed"]
+        ret["avg_wait_seconds"] = ret["wait_seconds"] / done if done else 0.0
+        return ret
+
+    def _start(self):
+        self._closing = False
+        if not self._registered:
+            atexit.register(self._shutdown)
+            self._registered = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _take(self):
+        # call holding the lock. the first text whose batch is full or has
+        # waited long enough, or None and how long until there will be one
+        now = time.time()
+        soonest = None
+        for text in self._order:
+            items = self._pending[text]
+            ready_at = items[0][1] + self.batch_wait
+            if len(items) >= self.batch_size or ready_at <= now or self._closing:
+                batch, rest = items[:self.batch_size], items[self.batch_size:]
+                if rest:
+                    self._pending[text] = rest
+                else:
+                    del self._pending[text]
+                    self._order.remove(text)
+                self._depth -= len(batch)
+                return (text, batch), None
+            if soonest is None or ready_at < soonest:
+                soonest = ready_at
+        return None, (soonest - now if soonest is not None else None)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                batch, wait = self._take()
+                while batch is None:
+                    if self._closing:
+                        return
+                    self._cond.wait(wait)
+                    batch, wait = self._take()
+                self._in_flight += 1
+            text, items = batch
+            numbers = [number for number, queued, delivery in items]
+            start = time.time()
+            try:
+                self.deliver(text, numbers)
+                ok = True
+            except Exception:
+                logging.exception("push send to %s failed" % ", ".join(numbers))
+                ok = False
+            for number, queued, delivery in items:
+                delivery.finish(ok)
+            elapsed = time.time() - start
+            with self._cond:
+                self._in_flight -= 1
+                self._stats["sent" if ok else "failed"] += len(numbers)
+                self._stats["requests"] += 1
+                self._stats["request_seconds"] += elapsed
+                self._stats["max_request_seconds"] = max(elapsed, 
+                                                         self._stats["max_request_seconds"])
+                self._stats["wait_seconds"] += sum(start - queued for number, queued, delivery in items)
+                self._cond.notify_all()
 
 class PushBackend(RapidHttpBackend):
     """
     A RapidSMS backend for PUSH SMS
     
+    With a "workers" config value above 0, messages are queued and sent
+    from that many threads, with identical texts going out together in one
+    SendSMS call (see SendQueue). send() still waits for its message to go
+    out, so texts are only coalesced across threads sending at the same
+    time, e.g. a reminder wave sent from a pool. Without workers (the 
+    default) each message is sent as it comes in.
+    
+    SendSMS isn't idempotent, so a call is only retried ("retries" times,
+    backing off from "backoff" seconds) when the gateway couldn't be 
+    reached at all. Any other failure is logged and send() returns False.
+    
     Example POST:
     
     RemoteNetwork=celtel-tz&IsReceipt=NO&BSDate-tomorrow=20101009&Local=*15522&ReceiveDate=2010-10-08%2016:46:22%20%2B0000&BSDate-today=20101008&ClientID=1243&MessageID=336876061&ChannelID=9840&ReceiptStatus=&ClientName=OnPoint%20-%20TZ&Prefix=JSI&MobileDevice=&BSDate-yesterday=20101007&Remote=%2B255785000017&MobileNetwork=celtel-tz&State=11&ServiceID=124328&Text=test%203&MobileNumber=%2B255785000017&NewSubscriber=NO&RegType=1&Subscriber=%2B255785000017&ServiceName=JSI%20Demo&Parsed=&BSDate-thisweek=20101004&ServiceEndDate=2010-10-30%2023:29:00%20%2B0300&Now=2010-10-08%2016:46:22%20%2B0000
@@ -57,6 +313,16 @@ class PushBackend(RapidHttpBackend):
             if key not in config:
                 raise ValueError("You are missing required config parameter: %s" % key)
         self.config = config
+        self.retries = int(config.get("retries", 2))
+        self.backoff = float(config.get("backoff", 1))
+        self.number_separator = config.get("number_separator", ",")
+        self._local = threading.local()
+        workers = int(config.get("workers", 0))
+        self.queue = SendQueue(self.deliver, workers=workers,
+                               batch_size=int(config.get("batch_size", 50)),
+                               batch_wait=float(config.get("batch_wait", 0.5)),
+                               shutdown_timeout=float(config.get("shutdown_timeout", 30))) \
+                     if workers else None
         super(PushBackend, self).configure(host, port, **kwargs)
 
     def handle_request(self, request):
@@ -92,23 +358,44 @@ class PushBackend(RapidHttpBackend):
         now = datetime.datetime.utcnow()
         return super(PushBackend, self).message(mobile_number, text, now)
 
-    def send(self, message):
-        number = message.connection.identity
-        text = message.text
-        
+    def get_gateway(self):
+        if getattr(self._local, "gateway", None) is None:
+            self._local.gateway = GatewayConnection(self.get_url())
+        return self._local.gateway
+
+    def deliver(self, text, numbers):
+        """
+        Send one text to any number of numbers in a single SendSMS call.
+        """
         # this is ghetto xml parsing but we control all the inputs so 
         # we're comfortable with that. 
         payload = self.OUTBOUND_SMS_TEMPLATE % {"password": self.get_password(),
                                                 "channel": self.get_channel(),
                                                 "service": self.get_service(),
                                                 "text": escape(text),
-                                                "number": number}
-        req = urllib2.Request(url=self.get_url(), 
-                              data=payload, 
-                              headers={'Content-Type': 'application/xml'})
-        
-        handle = urllib2.urlopen(req)
-        resp = handle.read()
+                                                "number": escape(self.number_separator.join(numbers))}
+        for attempt in range(self.retries + 1):
+            try:
+                resp = self.get_gateway().post(payload)
+                break
+            except GatewayUnreachable:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
         self.debug("got push response: %s" % resp)
+        return resp
+
+    def stats(self):
+        return self.queue.stats() if self.queue else {}
+
+    def send(self, message):
+        number = message.connection.identity
+        text = message.text
+        if self.queue:
+            return self.queue.put(number, text).wait()
+        try:
+            self.deliver(text, [number])
+        except Exception:
+            logging.exception("push send to %s failed" % number)
+            return False
         return True
-        
\ No newline at end of file
@@ -0,0 +1,143 @@
+import httplib
+import socket
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from django.test import TestCase
+from logistics_project.backends.push import PushBackend, SendQueue
+
+class FakeGateway(ThreadingMixIn, HTTPServer):
+    """
+    Stands in for the PUSH gateway on localhost. Fails the first
+    <failures> requests with a 500, then accepts everything.
+    """
+    daemon_threads = True
+
+    def __init__(self, failures=0):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FakeGatewayHandler)
+        self.failures = failures
+        self.payloads = []
+        self.connections = 0
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s/sendsms" % self.server_address[1]
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        payload = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.failures:
+            self.server.failures -= 1
+            status = 500
+        else:
+            self.server.payloads.append(payload)
+            status = 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write("OK")
+
+    def log_message(self, *args):
+        pass
+
+class _Connection(object):
+    def __init__(self, identity):
+        self.identity = identity
+
+class _Message(object):
+    def __init__(self, identity, text):
+        self.connection = _Connection(identity)
+        self.text = text
+
+class TestPushBackend(TestCase):
+
+    def _backend(self, gateway, **config):
+        config.update({"url": gateway.url, "channel": 1, "service": 2,
+                       "password": "secret", "backoff": 0.01})
+        return PushBackend(None, "push", config=config)
+
+    def _start(self, gateway):
+        thread = threading.Thread(target=gateway.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(gateway.shutdown)
+
+    def testSendInline(self):
+        gateway = FakeGateway()
+        self._start(gateway)
+        backend = self._backend(gateway)
+        backend.send(_Message("+255785000017", "hello"))
+        backend.send(_Message("+255785000018", "hello"))
+        self.assertEqual(2, len(gateway.payloads))
+        self.assertTrue("+255785000017" in gateway.payloads[0])
+        self.assertEqual(1, gateway.connections)
+
+    def testCoalesce(self):
+        gateway = FakeGateway()
+        self._start(gateway)
+        # nothing is ready to go until the queue is closed, so the four
+        # messages are all queued before any request is made
+        backend = self._backend(gateway, workers=1, batch_wait=3600)
+        deliveries = dict((number, backend.queue.put(number, text)) for number, text in \
+                          (("+1", "same text"), ("+2", "same text"),
+                           ("+3", "same text"), ("+4", "other text")))
+        self.assertTrue(backend.queue.close(5))
+        self.assertEqual({"+1": True, "+2": True, "+3": True, "+4": True},
+                         dict((number, d.wait(0)) for number, d in deliveries.items()))
+        self.assertEqual(2, len(gateway.payloads))
+        same = [p for p in gateway.payloads if "same text" in p][0]
+        for number in ("+1", "+2", "+3"):
+            self.assertTrue(number in same)
+        stats = backend.stats()
+        self.assertEqual(4, stats["sent"])
+        self.assertEqual(2, stats["requests"])
+        self.assertEqual(0, stats["queued"])
+
+    def testQueuedFailuresReported(self):
+        gateway = FakeGateway(failures=1)
+        self._start(gateway)
+        backend = self._backend(gateway, workers=1, batch_wait=0)
+        self.assertFalse(backend.send(_Message("+1", "hello")))
+        self.assertTrue(backend.send(_Message("+1", "hello")))
+        self.assertEqual(1, backend.stats()["failed"])
+
+    def testCloseSendsQueued(self):
+        sent = []
+        queue = SendQueue(lambda text, numbers: sent.extend(numbers), 
+                          workers=1, batch_wait=10)
+        delivery = queue.put("+1", "hello")
+        self.assertEqual(None, delivery.wait(0))
+        self.assertTrue(queue.close(5))
+        self.assertEqual(["+1"], sent)
+        self.assertTrue(delivery.wait(0))
+
+    def testGatewayErrorsNotRetried(self):
+        gateway = FakeGateway(failures=1)
+        self._start(gateway)
+        backend = self._backend(gateway, retries=2)
+        self.assertFalse(backend.send(_Message("+1", "hello")))
+        self.assertEqual(0, len(gateway.payloads))
+        self.assertEqual(0, gateway.failures)
+
+    def testRetryUnreachable(self):
+        gateway = FakeGateway()
+        self._start(gateway)
+        backend = self._backend(gateway, retries=1)
+        real_class = backend.get_gateway().connection_class
+        attempts = []
+        class FlakyConnection(real_class):
+            def connect(self):
+                attempts.append(1)
+                if len(attempts) == 1:
+                    raise socket.error("connection refused")
+                real_class.connect(self)
+        backend.get_gateway().connection_class = FlakyConnection
+        self.assertTrue(backend.send(_Message("+1", "hello")))
+        self.assertEqual(2, len(attempts))
+        self.assertEqual(1, len(gateway.payloads))
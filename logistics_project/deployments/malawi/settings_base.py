@@ -135,6 +135,7 @@ LOGISTICS_EXCEL_EXPORT_ENABLED = False
 LOGISTICS_LOGIN_TEMPLATE = "logistics/login.html"
 LOGISTICS_LOGOUT_TEMPLATE = "logistics/loggedout.html"
 LOGISTICS_USE_AUTO_CONSUMPTION = True
+LOGISTICS_PARALLEL_BREAKDOWNS = 4
 LOGISTICS_APPROVAL_REQUIRED = False
 LOGISTICS_USE_COMMODITY_EQUIVALENTS = False
 LOGISTICS_USERS_HAVE_ADMIN_ACCESS = True
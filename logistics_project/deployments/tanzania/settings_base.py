@@ -51,6 +51,11 @@ INSTALLED_BACKENDS = {
             'channel': "24358",
             'service': "147118",
             'password': 'CHANGEME',
+            # set workers to queue sends and coalesce identical texts
+            # from concurrent senders, see PushBackend
+            'workers': 0,
+            'batch_size': 50,
+            'batch_wait': 0.5,
         }
     },
 }
@@ -163,7 +168,10 @@ LOGISTICS_MAP_POPUP_FUNCTION = "logistics_project.apps.tanzania.templatetags.tz_
 LOGISTICS_USE_LOCATION_SESSIONS = True
 LOGISTICS_NAVIGATION_MODE = "param" 
 LOGISTICS_USE_SPOT_CACHING = True
-LOGISTICS_SPOT_CACHE_TIMEOUT = 60 * 60
+LOGISTICS_SPOT_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+LOGISTICS_USE_STATUS_ROLLUPS = False
+LOGISTICS_REMINDER_WORKERS = 8
+LOGISTICS_REMINDER_BACKEND_CONCURRENCY = {"push": 4}
 LOGISTICS_REPORTING_CYCLE_IN_DAYS = 30
 
 LOGO_LEFT_URL="/static/tanzania/img/Tanzania-Flag.png"
@@ -46,6 +46,7 @@ BASE_APPS = [
     "logistics_project.apps.registration",
     "logistics_project.apps.web_registration",
     "logistics",
+    "logistics_project.apps.hierarchy",
     "logistics_project.apps.maps",
     "email_reports",
 #    "logistics_project.apps.reports",
@@ -213,6 +214,28 @@ LOGISTICS_USE_AUTO_CONSUMPTION = False
 LOGISTICS_DAYS_UNTIL_LATE_PRODUCT_REPORT = 7
 LOGISTICS_DAYS_UNTIL_DATA_UNAVAILABLE = 21
 LOGISTICS_APPROVAL_REQUIRED = False
+# read tanzania report statuses from the precomputed monthly rollups,
+# and keep them up to date. run tz_backfill_rollups when turning this on.
+LOGISTICS_USE_STATUS_ROLLUPS = False
+# cache per supply point calculations. entries are invalidated whenever
+# a status or report comes in for the supply point, so the timeout can
+# be long.
+LOGISTICS_USE_SPOT_CACHING = False
+LOGISTICS_SPOT_CACHE_TIMEOUT = 60 * 60
+# how long computed report breakdowns are cached. like the spot cache,
+# they are invalidated when new reports come in.
+LOGISTICS_REPORT_CACHE_TIMEOUT = 60 * 60 * 24
+# how many processes work out malawi district breakdowns at once, in
+# batch jobs like malawi_publish_reports (which the celery tasks run in a
+# process of their own when this is set). web requests always work them
+# out one at a time (see utils/parallel.py).
+LOGISTICS_PARALLEL_BREAKDOWNS = 0
+# how many scmgr rows are saved per transaction when they are uploaded
+LOGISTICS_SCMGR_CHUNK_SIZE = 500
+# threads sending a tanzania reminder wave (1 sends inline), and optional
+# caps per backend name, e.g. {"push": 4}
+LOGISTICS_REMINDER_WORKERS = 1
+LOGISTICS_REMINDER_BACKEND_CONCURRENCY = {}
 MAGIC_TOKEN = "changeme"
 
 MAP_DEFAULT_LATITUDE  = -10.49
@@ -0,0 +1,25 @@
+"""
+Writing many rows at once.
+"""
+from django.db import connection, transaction
+
+def insert_rows(model, columns, rows):
+    """
+    Insert rows, each a sequence of values for the columns (database
+    column names) of model's table, with a single executemany. Returns
+    the number of rows.
+
+    Django 1.3 has no bulk_create, so this is raw SQL: no post_save is
+    sent, and inside a managed transaction (e.g. commit_on_success) it
+    is marked dirty so that it gets committed.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % \
+        (qn(model._meta.db_table), ", ".join(qn(c) for c in columns),
+         ", ".join(["%s"] * len(columns)))
+    connection.cursor().executemany(sql, rows)
+    transaction.commit_unless_managed()
+    return len(rows)
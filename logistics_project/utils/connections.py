@@ -0,0 +1,21 @@
+"""
+Looking up the connections of many contacts at once.
+"""
+from rapidsms.models import Connection
+
+# how many contacts go in each IN (...) list
+BATCH_SIZE = 500
+
+def default_connections(contacts):
+    """
+    The default connection of each contact, as {contact id: connection},
+    for the contacts that have one. The connections come with their
+    backends, from a query per batch of contacts rather than per contact.
+    """
+    ids = [c.pk for c in contacts]
+    ret = {}
+    for i in range(0, len(ids), BATCH_SIZE):
+        for conn in Connection.objects.filter(contact__in=ids[i:i + BATCH_SIZE])\
+                                      .select_related('backend').order_by('id'):
+            ret.setdefault(conn.contact_id, conn)
+    return ret
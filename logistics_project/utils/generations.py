@@ -0,0 +1,27 @@
+"""
+Generation counters for invalidating groups of cache entries.
+
+Cache keys that include a generation are all orphaned at once when it
+is bumped, so entries can be kept for a long time without going stale.
+"""
+import time
+from django.core.cache import cache
+
+def _new_generation():
+    # start from the clock rather than 0, so that if a counter falls out
+    # of the cache its old generations are never reused
+    return int(time.time() * 1000)
+
+def get_generation(key, timeout):
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _new_generation(), timeout)
+        generation = cache.get(key)
+    return generation
+
+def bump_generation(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # not in the cache, so the next lookup starts a new generation
+        pass
@@ -0,0 +1,46 @@
+"""
+Spreading work over a pool of processes, where that is safe.
+
+Forking copies the whole process, database connection and all, so a
+pool is only used by code running inside processes_allowed() - batch
+jobs such as management commands, never the middle of a web request -
+and never from a daemonic process such as a celery worker, which isn't
+allowed children. Anywhere else the work is done in order, in process.
+"""
+import threading
+from contextlib import contextmanager
+from multiprocessing import Pool, current_process
+from django.db import connection
+
+_local = threading.local()
+
+@contextmanager
+def processes_allowed():
+    previous = getattr(_local, "allowed", False)
+    _local.allowed = True
+    try:
+        yield
+    finally:
+        _local.allowed = previous
+
+def can_fork():
+    return getattr(_local, "allowed", False) and not current_process().daemon
+
+def parallel_map(func, args, processes):
+    """
+    map(func, args), spread over up to processes processes when that is
+    allowed. func and args have to be picklable; the results come back
+    in the order of args.
+    """
+    args = list(args)
+    if not processes or processes < 2 or len(args) < 2 or not can_fork():
+        return map(func, args)
+    # the workers are forked from here, so make sure they don't all end 
+    # up sharing this process's database connection
+    connection.close()
+    pool = Pool(processes=min(processes, len(args)))
+    try:
+        return pool.map(func, args)
+    finally:
+        pool.close()
+        pool.join()